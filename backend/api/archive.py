@@ -0,0 +1,249 @@
+from api.database import run_db
+from api.models import Session, Message, ArchivedSession
+from api.search import drop_index_entries
+from sqlalchemy import and_, delete, exists, func, insert, select, text, update
+from utils.metrics import ARCHIVE_SESSIONS
+from typing import List, Optional
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import os
+
+try:
+    import zstandard
+except ImportError: # optional, archives are gzipped without it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# sessions without a message for this many days are archived, 0 disables the job
+ARCHIVE_AFTER_DAYS = float(os.getenv("CHATBOT_ARCHIVE_AFTER_DAYS", "30"))
+# seconds between two runs of the archival job
+ARCHIVE_INTERVAL = float(os.getenv("CHATBOT_ARCHIVE_INTERVAL", "3600"))
+# sessions archived per transaction, the write lock is released between two
+ARCHIVE_BATCH_SIZE = int(os.getenv("CHATBOT_ARCHIVE_BATCH_SIZE", "100"))
+# free pages given back per PRAGMA incremental_vacuum, the write lock is
+# released between two steps
+VACUUM_PAGES = int(os.getenv("CHATBOT_VACUUM_PAGES", "1000"))
+
+ARCHIVE_CODEC = "zstd" if zstandard else "gzip"
+
+# message columns kept in the archive. A restored message gets a new id,
+# the old one finds its entry in the full-text index (see api.search)
+ARCHIVED_COLUMNS = ("id", "seq", "role", "content", "display_content", "reasoning",
+                    "tool_calls", "tool_call_id", "tool_name", "created_at")
+
+
+def compress(data: bytes, codec: str = ARCHIVE_CODEC) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    raise ValueError(f"Unknown archive codec {codec!r}")
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The session was archived with zstd, install zstandard to restore it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "gzip":
+        return gzip.decompress(data)
+    raise ValueError(f"Unknown archive codec {codec!r}")
+
+
+def idle_since(cutoff: datetime.datetime):
+    """sessions that are not archived and had no activity since cutoff"""
+    return and_(
+        Session.archived_at.is_(None),
+        func.coalesce(Session.restored_at, Session.created_at) < cutoff,
+        # served by the (session_id, created_at) index
+        ~exists().where(Message.session_id == Session.id, Message.created_at >= cutoff),
+    )
+
+def idle_sessions(db, cutoff: datetime.datetime, limit: int) -> List[str]:
+    return [sid for (sid,) in db.query(Session.id).filter(idle_since(cutoff)).limit(limit)]
+
+def archive_session(db, session_id: str, cutoff: datetime.datetime) -> Optional[int]:
+    """Move the messages of an idle session into one compressed blob, in
+    the transaction of db, which the caller commits. Returns the number of
+    archived messages, None when the session is not idle anymore (a turn
+    may have run since it was selected)."""
+    now = datetime.datetime.now()
+    # the update takes the write lock, so the session cannot get a new
+    # message between the check and the delete
+    claimed = db.execute(update(Session)
+                         .where(Session.id == session_id, idle_since(cutoff))
+                         .values(archived_at=now)).rowcount
+    if not claimed:
+        return None
+
+    columns = [getattr(Message, name) for name in ARCHIVED_COLUMNS]
+    rows = db.execute(select(*columns)
+                      .where(Message.session_id == session_id)
+                      .order_by(Message.seq, Message.id)).all()
+    messages = [dict(zip(ARCHIVED_COLUMNS, row)) for row in rows]
+    for message in messages:
+        message["created_at"] = message["created_at"] and message["created_at"].isoformat()
+
+    db.execute(insert(ArchivedSession).values(
+        session_id=session_id, codec=ARCHIVE_CODEC, message_count=len(messages), archived_at=now,
+        data=compress(json.dumps(messages, separators=(",", ":")).encode())))
+    db.execute(delete(Message).where(Message.session_id == session_id))
+    return len(messages)
+
+def archive_idle_sessions(db, cutoff: datetime.datetime, limit: int = ARCHIVE_BATCH_SIZE) -> List[str]:
+    """archive up to limit sessions idle since cutoff in one transaction,
+    returns their ids"""
+    archived = [sid for sid in idle_sessions(db, cutoff, limit) if archive_session(db, sid, cutoff) is not None]
+    db.commit()
+    ARCHIVE_SESSIONS.labels("archived").inc(len(archived))
+    return archived
+
+def restore_session(db, session_id: str) -> bool:
+    """Put the messages of an archived session back in the messages table.
+    Returns False when the session is not archived."""
+    if not db.query(Session.archived_at).filter(Session.id == session_id, Session.archived_at.isnot(None)).first():
+        return False
+
+    # only one of concurrent restores of the session gets it
+    now = datetime.datetime.now()
+    claimed = db.execute(update(Session)
+                         .where(Session.id == session_id, Session.archived_at.isnot(None))
+                         .values(archived_at=None, restored_at=now)).rowcount
+    archived = db.get(ArchivedSession, session_id) if claimed else None
+    if archived is None:
+        db.rollback()
+        return False
+
+    messages = json.loads(decompress(archived.data, archived.codec))
+    # the index entries kept while archived, the restored rows are indexed anew
+    drop_index_entries(db, session_id, [message.pop("id", None) for message in messages])
+    for position, message in enumerate(messages, 1):
+        message["session_id"] = session_id
+        # archived before messages had a seq, they are in order
+        message["seq"] = message.get("seq") or position
+        message["created_at"] = message["created_at"] and datetime.datetime.fromisoformat(message["created_at"])
+    if messages:
+        db.execute(insert(Message), messages)
+    db.execute(delete(ArchivedSession).where(ArchivedSession.session_id == session_id))
+    db.commit()
+    ARCHIVE_SESSIONS.labels("restored").inc()
+    return True
+
+def delete_archive(db, session_id: str):
+    """delete the archive of a session and its index entries, in the
+    transaction of db"""
+    archived = db.get(ArchivedSession, session_id)
+    if archived is None:
+        return
+    messages = json.loads(decompress(archived.data, archived.codec))
+    drop_index_entries(db, session_id, [message.get("id") for message in messages])
+    db.execute(delete(ArchivedSession).where(ArchivedSession.session_id == session_id))
+
+def open_session(db, session_id: str) -> bool:
+    """whether the session exists, its messages are restored if it was archived"""
+    row = db.query(Session.archived_at).filter(Session.id == session_id).first()
+    if row is None:
+        return False
+    if row.archived_at is not None:
+        restore_session(db, session_id)
+    return True
+
+def incremental_vacuum(db, pages: int = VACUUM_PAGES) -> int:
+    """Give free pages back to the OS, pages at a time. Returns the number
+    of pages freed, 0 when the database does not use auto_vacuum=INCREMENTAL."""
+    if db.get_bind().dialect.name != "sqlite":
+        return 0
+    if db.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+        return 0
+    db.commit()
+    # the pragma frees one page per step of the statement, executescript
+    # runs it to completion where execute would only do the first step
+    connection = db.connection().connection.driver_connection
+    start = free = db.execute(text("PRAGMA freelist_count")).scalar()
+    while free:
+        connection.executescript(f"PRAGMA incremental_vacuum({pages});")
+        free = db.execute(text("PRAGMA freelist_count")).scalar()
+    db.commit()
+    return start
+
+
+class ArchiveJob:
+    """Background task archiving the sessions idle for after_days, then
+    reclaiming the freed pages of the database.
+
+    The graph checkpoints of archived sessions are deleted: on their next
+    turn the history is replayed from the restored messages.
+    """
+    def __init__(self, memory_saver=None, after_days: float = ARCHIVE_AFTER_DAYS,
+                 interval: float = ARCHIVE_INTERVAL, batch_size: int = ARCHIVE_BATCH_SIZE,
+                 vacuum_pages: int = VACUUM_PAGES):
+        self.memory_saver = memory_saver
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.archived = 0
+        self.freed_pages = 0
+        self.errors = 0
+        self.last_run: Optional[str] = None
+
+    def start(self):
+        if self.after_days > 0 and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        task, self.task = self.task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("Session archival failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """archive every idle session, returns how many were archived"""
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=self.after_days)
+        archived = 0
+        while True:
+            session_ids = await run_db(archive_idle_sessions, cutoff, self.batch_size)
+            if self.memory_saver is not None:
+                for session_id in session_ids:
+                    await self.memory_saver.adelete_thread(session_id)
+            archived += len(session_ids)
+            if len(session_ids) < self.batch_size:
+                break
+
+        freed = await run_db(incremental_vacuum, self.vacuum_pages)
+        self.runs += 1
+        self.archived += archived
+        self.freed_pages += freed
+        self.last_run = datetime.datetime.now().isoformat()
+        if archived or freed:
+            logger.info(f"Archived {archived} idle sessions, freed {freed} pages")
+        return archived
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.after_days > 0,
+            "after_days": self.after_days,
+            "codec": ARCHIVE_CODEC,
+            "runs": self.runs,
+            "archived": self.archived,
+            "freed_pages": self.freed_pages,
+            "errors": self.errors,
+            "last_run": self.last_run,
+        }
@@ -0,0 +1,316 @@
+from api.database import run_db, iterate_db
+from api.models import Session, Message, ArchivedSession
+from api.archive import decompress, restore_session
+from sqlalchemy import bindparam, case, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import AsyncIterable, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+import datetime
+import json
+import os
+import time
+import zlib
+
+# Sessions and their messages as NDJSON, for backups and moves between
+# databases. A file is a header line, then each session followed by its
+# messages in seq order, then an end line with the counts, which tells a
+# complete file from a truncated one:
+#   {"type": "header", "format": "chatbot-export", "version": 1, ...}
+#   {"type": "session", "id": ..., "created_at": ..., "name": ..., ...}
+#   {"type": "message", "session_id": ..., "seq": 1, "role": "user", ...}
+#   {"type": "end", "sessions": 2, "messages": 10}
+# Message ids are not kept: an import gives new ones, and a message that
+# is already there (same session and seq) is skipped, so importing a file
+# twice changes nothing.
+EXPORT_FORMAT = "chatbot-export"
+EXPORT_VERSION = 1
+# rows fetched from the database cursor at a time by an export
+EXPORT_CHUNK_SIZE = int(os.getenv("CHATBOT_EXPORT_CHUNK_SIZE", "2000"))
+# lines written per transaction by an import
+IMPORT_BATCH_SIZE = int(os.getenv("CHATBOT_IMPORT_BATCH_SIZE", "5000"))
+
+SESSION_COLUMNS = ("id", "created_at", "name", "renamed_at", "message_seq", "archived_at")
+MESSAGE_COLUMNS = ("seq", "role", "content", "display_content", "reasoning",
+                   "tool_calls", "tool_call_id", "tool_name", "created_at")
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def ndjson_line(record: dict) -> str:
+    return ENCODER.encode(record) + "\n"
+
+def isoformat(value: Optional[datetime.datetime]) -> Optional[str]:
+    return value and value.isoformat()
+
+def parse_datetime(value: Optional[str]) -> Optional[datetime.datetime]:
+    return value and datetime.datetime.fromisoformat(value)
+
+
+def export_filters(session_ids: Optional[Sequence[str]], since: Optional[datetime.datetime],
+                   until: Optional[datetime.datetime]) -> list:
+    """sessions exported: by id, and created in [since, until)"""
+    filters = []
+    if session_ids:
+        filters.append(Session.id.in_(session_ids))
+    if since:
+        filters.append(Session.created_at >= since)
+    if until:
+        filters.append(Session.created_at < until)
+    return filters
+
+def export_lines(db, session_ids: Optional[Sequence[str]] = None, since: Optional[datetime.datetime] = None,
+                 until: Optional[datetime.datetime] = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """Yield the NDJSON of the selected sessions, a chunk of lines at a time.
+
+    One query walks the sessions and their messages (outer join, ordered
+    by session and seq on the unique index) through a cursor read
+    chunk_size rows at a time, so memory does not grow with the database.
+    The whole export runs in one read transaction: a consistent snapshot,
+    turns written meanwhile are not in it. Archived sessions are exported
+    with their messages, read from the archive.
+    """
+    yield ndjson_line({"type": "header", "format": EXPORT_FORMAT, "version": EXPORT_VERSION,
+                       "exported_at": datetime.datetime.now().isoformat()})
+    columns = ([getattr(Session, name).label(f"session_{name}") for name in SESSION_COLUMNS]
+               + [Message.id.label("message_id")] + [getattr(Message, name) for name in MESSAGE_COLUMNS])
+    first_message_column = len(columns) - len(MESSAGE_COLUMNS)
+    query = (select(*columns)
+             .outerjoin(Message, Message.session_id == Session.id)
+             .where(*export_filters(session_ids, since, until))
+             .order_by(Session.id, Message.seq, Message.id)
+             .execution_options(yield_per=chunk_size))
+
+    sessions = messages = 0
+    current = None
+    # core rows, the ORM has nothing to load here
+    for rows in db.connection().execute(query).partitions():
+        lines = []
+        for row in rows:
+            if row.session_id != current:
+                current = row.session_id
+                sessions += 1
+                lines.append(ndjson_line({"type": "session", "id": current,
+                                          "created_at": isoformat(row.session_created_at),
+                                          "name": row.session_name,
+                                          "renamed_at": isoformat(row.session_renamed_at),
+                                          "message_seq": row.session_message_seq}))
+                if row.session_archived_at is not None:
+                    archived = archived_lines(db, current)
+                    messages += len(archived)
+                    lines.extend(archived)
+            if row.message_id is not None:
+                messages += 1
+                message = {"type": "message", "session_id": current,
+                           **dict(zip(MESSAGE_COLUMNS, row[first_message_column:]))}
+                message["created_at"] = isoformat(message["created_at"])
+                lines.append(ndjson_line(message))
+        yield "".join(lines)
+    yield ndjson_line({"type": "end", "sessions": sessions, "messages": messages})
+
+def archived_lines(db, session_id: str) -> List[str]:
+    """message lines of an archived session"""
+    archived = db.get(ArchivedSession, session_id)
+    if archived is None:
+        return []
+    lines = []
+    for position, message in enumerate(json.loads(decompress(archived.data, archived.codec)), 1):
+        # archived before messages had a seq, they are in order
+        message["seq"] = message.get("seq") or position
+        lines.append(ndjson_line({"type": "message", "session_id": session_id,
+                                  **{name: message.get(name) for name in MESSAGE_COLUMNS}}))
+    return lines
+
+def gzip_chunks(chunks: Iterator[str]) -> Iterator[bytes]:
+    """gzip a stream of text chunks as it goes"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+def encoded_chunks(chunks: Iterator[str]) -> Iterator[bytes]:
+    for chunk in chunks:
+        yield chunk.encode()
+
+def export_chunks(db, session_ids: Optional[Sequence[str]] = None, since: Optional[datetime.datetime] = None,
+                  until: Optional[datetime.datetime] = None, compress: bool = False,
+                  chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """export_lines as bytes, gzipped with compress"""
+    lines = export_lines(db, session_ids, since, until, chunk_size)
+    return gzip_chunks(lines) if compress else encoded_chunks(lines)
+
+async def export_stream(session_ids: Optional[Sequence[str]] = None, since: Optional[datetime.datetime] = None,
+                        until: Optional[datetime.datetime] = None, compress: bool = False) -> AsyncIterator[bytes]:
+    """the export as a byte stream, each chunk read and encoded in the DB
+    thread pool"""
+    async for chunk in iterate_db(export_chunks, session_ids, since, until, compress):
+        yield chunk
+
+
+class LineReader:
+    """Split a stream of bytes into lines, gunzipped first when it starts
+    with the gzip magic number."""
+    def __init__(self):
+        self.decompressor = None
+        self.head = b"" # first bytes, until the format is known
+        self.started = False
+        self.buffer = b""
+
+    def _start(self) -> bytes:
+        self.started = True
+        data, self.head = self.head, b""
+        if data.startswith(GZIP_MAGIC):
+            self.decompressor = zlib.decompressobj(31)
+        return data
+
+    def _split(self, data: bytes) -> List[bytes]:
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\n")
+        return [line for line in lines if line.strip()]
+
+    def feed(self, data: bytes) -> List[bytes]:
+        if not self.started:
+            self.head += data
+            if len(self.head) < len(GZIP_MAGIC):
+                return []
+            data = self._start()
+        return self._split(data)
+
+    def close(self) -> List[bytes]:
+        """the last line, when the stream does not end with a newline"""
+        lines = [] if self.started else self._split(self._start())
+        if self.decompressor is not None and not self.decompressor.eof:
+            raise ValueError("Truncated gzip stream")
+        if self.buffer.strip():
+            lines.append(self.buffer)
+        self.buffer = b""
+        return lines
+
+
+def insert_ignore(db, table, index_elements: Sequence[str]):
+    """insert skipping the rows that conflict on index_elements"""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table).on_conflict_do_nothing(index_elements=index_elements)
+
+def parse_record(record: dict, sessions: list, messages: list, counts: dict):
+    kind = record.get("type")
+    if kind == "session":
+        if not isinstance(record.get("id"), str) or not record["id"]:
+            raise ValueError("session without an id")
+        sessions.append({"id": record["id"],
+                         "created_at": parse_datetime(record.get("created_at")),
+                         "name": record.get("name"),
+                         "renamed_at": parse_datetime(record.get("renamed_at")),
+                         "message_seq": record.get("message_seq") or 0})
+    elif kind == "message":
+        if not isinstance(record.get("seq"), int) or record["seq"] < 1:
+            raise ValueError("message without a seq")
+        row = {name: record.get(name) for name in MESSAGE_COLUMNS}
+        row["session_id"] = record["session_id"]
+        row["created_at"] = parse_datetime(row["created_at"])
+        messages.append(row)
+    elif kind == "header":
+        if record.get("format") != EXPORT_FORMAT or record.get("version", 0) > EXPORT_VERSION:
+            raise ValueError(f"unsupported format {record.get('format')} version {record.get('version')}")
+    elif kind == "end":
+        counts["end"] = record
+    else:
+        raise ValueError(f"unknown record type {kind!r}")
+
+def parse_lines(lines: Sequence[bytes], first_line: int, counts: dict) -> tuple:
+    """session and message rows of NDJSON lines, raises ValueError with the
+    line number on a malformed one"""
+    sessions, messages = [], []
+    for number, line in enumerate(lines, first_line):
+        try:
+            parse_record(json.loads(line), sessions, messages, counts)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Line {number}: {e}") from e
+    return sessions, messages
+
+def import_lines(db, lines: Sequence[bytes], first_line: int = 1, counts: Optional[dict] = None) -> dict:
+    """Import a batch of NDJSON lines in one transaction, counts are added
+    to counts. Sessions and messages already there are skipped; messages
+    of a session neither in the batch nor in the database too."""
+    counts = {} if counts is None else counts
+    for name in ("sessions", "sessions_skipped", "messages", "messages_skipped", "lines"):
+        counts.setdefault(name, 0)
+    sessions, messages = parse_lines(lines, first_line, counts)
+    counts["lines"] += len(lines)
+
+    # a session archived here has its messages up to its seq counter: the
+    # ones past it are new, then its archive goes back to the table first
+    # so the others are recognized
+    session_ids = {row["session_id"] for row in messages}
+    archived = dict(db.query(Session.id, Session.message_seq)
+                    .filter(Session.id.in_(session_ids), Session.archived_at.isnot(None)))
+    if archived:
+        for session_id in {row["session_id"] for row in messages
+                           if row["session_id"] in archived and row["seq"] > archived[row["session_id"]]}:
+            restore_session(db, session_id)
+            del archived[session_id]
+        kept = [row for row in messages if row["session_id"] not in archived]
+        counts["messages_skipped"] += len(messages) - len(kept)
+        messages = kept
+
+    if sessions:
+        inserted = db.execute(insert_ignore(db, Session.__table__, ["id"]), sessions).rowcount
+        counts["sessions"] += inserted
+        counts["sessions_skipped"] += len(sessions) - inserted
+
+    if messages:
+        known = {sid for (sid,) in db.query(Session.id).filter(Session.id.in_(session_ids))}
+        rows = [row for row in messages if row["session_id"] in known]
+        counts["messages_skipped"] += len(messages) - len(rows)
+        if rows:
+            inserted = db.execute(insert_ignore(db, Message.__table__, ["session_id", "seq"]), rows).rowcount
+            counts["messages"] += inserted
+            counts["messages_skipped"] += len(rows) - inserted
+            # the seq counter of each session past its imported messages
+            last_seqs: Dict[str, int] = {}
+            for row in rows:
+                last_seqs[row["session_id"]] = max(last_seqs.get(row["session_id"], 0), row["seq"])
+            sessions_table = Session.__table__
+            db.execute(update(sessions_table)
+                       .where(sessions_table.c.id == bindparam("sid"))
+                       .values(message_seq=case((sessions_table.c.message_seq < bindparam("last"), bindparam("last")),
+                                                else_=sessions_table.c.message_seq)),
+                       [{"sid": sid, "last": last} for sid, last in last_seqs.items()])
+    db.commit()
+    return counts
+
+async def import_stream(chunks: AsyncIterable[bytes], batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Import an NDJSON stream, plain or gzipped, batch_size lines per
+    transaction. The stream is read as the batches are written, so memory
+    holds one batch. Returns the counts; "complete" tells whether the end
+    line was reached and its counts match the lines read."""
+    start = time.perf_counter()
+    reader = LineReader()
+    counts: dict = {}
+    batch: List[bytes] = []
+    first_line = 1
+
+    async def flush():
+        nonlocal batch, first_line
+        await run_db(import_lines, batch, first_line, counts)
+        first_line += len(batch)
+        batch = []
+
+    async for data in chunks:
+        for line in reader.feed(data):
+            batch.append(line)
+            if len(batch) >= batch_size:
+                await flush()
+    batch.extend(reader.close())
+    await flush()
+
+    end = counts.pop("end", None)
+    read = {"sessions": counts["sessions"] + counts["sessions_skipped"],
+            "messages": counts["messages"] + counts["messages_skipped"]}
+    counts["complete"] = bool(end) and all(end.get(name) == read[name] for name in read)
+    counts["seconds"] = round(time.perf_counter() - start, 3)
+    return counts
@@ -0,0 +1,142 @@
+from api.models import BatchRequest
+from api.database import run_db
+from api.scheduler import MAX_CONCURRENT_TURNS, SchedulerBusy, TurnScheduler
+from api import crud
+from api.persistence import turn_record, new_turn_messages
+from utils.text_utils import remove_think_tags
+import anyio
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# conversations of a batch running at once, a request may ask for less
+BATCH_MAX_CONCURRENCY = int(os.getenv("CHATBOT_BATCH_MAX_CONCURRENCY", str(MAX_CONCURRENT_TURNS)))
+# finished conversations written to the DB per transaction
+BATCH_WRITE_SIZE = int(os.getenv("CHATBOT_BATCH_WRITE_SIZE", "100"))
+
+
+def ndjson(data: dict) -> str:
+    return json.dumps(data) + "\n"
+
+
+async def run_item(scheduler: TurnScheduler, runner, session_id: str, inputs: dict, config: dict):
+    """one conversation, admitted by the scheduler like an interactive turn;
+    a batch waits for a slot rather than failing when the queue is full"""
+    while True:
+        try:
+            async with scheduler.turn(session_id):
+                return await runner.ainvoke(inputs, config)
+        except SchedulerBusy as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def run_batch(graph, request: BatchRequest, chat_config, scheduler: TurnScheduler):
+    """Run independent single-turn conversations and yield one NDJSON line
+    per conversation, in completion order, then a summary line.
+
+    At most max_concurrency conversations are submitted at a time, each is
+    admitted by the scheduler, so a batch shares the limit of running
+    turns and its queue with the chats. The graph runs each one with
+    ainvoke rather than abatch: abatch would start its inputs together,
+    past the scheduler, and only return once all of them are done.
+
+    With persist, each one is a new session: its graph state is
+    checkpointed and the turns are written to the DB in bulk, what
+    finished while the previous write ran, up to BATCH_WRITE_SIZE sessions
+    per transaction. The line of a session is yielded once its rows are
+    written, so its session_id can be read back; when a write fails the
+    lines carry a "persist_error" and the summary counts them. Without
+    persist the stateless graph is used and nothing is stored.
+    """
+    start = time.perf_counter()
+    concurrency = min(request.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    session_ids = [str(uuid.uuid4()) for _ in request.items]
+    inputs = [{"messages": [{"role": "user", "content": item.user_input}]} for item in request.items]
+    configs = [chat_config(session_id, request.recursion_limit) for session_id in session_ids]
+    if not request.persist:
+        runner = graph.stateless_graph
+        # no thread to checkpoint
+        for config in configs:
+            config.pop("configurable")
+    else:
+        runner = graph.graph
+
+    pending = []  # (line, turn record) not written yet
+    completed = errors = persist_errors = 0
+
+    async def flush() -> list:
+        """write the pending turns, returns their lines"""
+        nonlocal persist_errors
+        written = list(pending)
+        pending.clear()
+        try:
+            await run_db(crud.save_turns, [record for _, record in written])
+        except Exception as e:
+            persist_errors += len(written)
+            logger.error(f"Batch write of {len(written)} conversations failed: {e!r}")
+            for line, _ in written:
+                line["persist_error"] = repr(e)
+        return [line for line, _ in written]
+
+    submitted = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def run(index: int):
+        async with submitted:
+            try:
+                output = await run_item(scheduler, runner, session_ids[index], inputs[index], configs[index])
+            except Exception as e:
+                output = e
+        results.put_nowait((index, output))
+
+    tasks = [asyncio.create_task(run(index)) for index in range(len(request.items))]
+    try:
+        for _ in tasks:
+            index, output = await results.get()
+            item = request.items[index]
+            line = {"index": index, "id": item.id,
+                    "session_id": session_ids[index] if request.persist else None}
+            if isinstance(output, Exception):
+                errors += 1
+                logger.error(f"Batch conversation {index} failed: {output!r}")
+                line["error"] = repr(output)
+                line["session_id"] = None  # nothing is written for it
+                yield ndjson(line)
+                continue
+
+            message = output["messages"][-1]
+            completed += 1
+            line["response"] = remove_think_tags(message.content)
+            line["cached"] = bool(message.response_metadata.get("cache_hit"))
+            if not request.persist:
+                yield ndjson(line)
+                continue
+
+            pending.append((line, turn_record(session_ids[index], item.user_input,
+                                              new_turn_messages(output["messages"]), new_session=True)))
+            # written as soon as no other conversation is done, so the
+            # writes batch up only while the results come faster than them
+            if len(pending) >= BATCH_WRITE_SIZE or results.empty():
+                for written in await flush():
+                    yield ndjson(written)
+
+        if pending:
+            for written in await flush():
+                yield ndjson(written)
+    finally:
+        # the client went away: the conversations not finished are dropped
+        for task in tasks:
+            task.cancel()
+        # what finished is kept even when the client went away
+        if pending:
+            with anyio.CancelScope(shield=True):
+                await flush()
+
+    yield ndjson({"done": True, "completed": completed, "errors": errors,
+                  "persisted": request.persist, "persist_errors": persist_errors,
+                  "seconds": round(time.perf_counter() - start, 3)})
@@ -0,0 +1,56 @@
+from api.database import CHECKPOINT_DB_PATH, DATABASE_URL
+from contextlib import asynccontextmanager
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from typing import AsyncContextManager, AsyncIterator, Callable, Dict
+import os
+
+# where the graph checkpoints live, picked by the scheme of the URL:
+#  a file path (or sqlite:///path)  SQLite, shared by the workers of one host
+#  postgresql://...                  a server shared by several hosts, needs
+#                                    langgraph-checkpoint-postgres
+# the server of the sessions by default when they are on one
+CHECKPOINT_URL = os.getenv("CHATBOT_CHECKPOINT_URL",
+                           CHECKPOINT_DB_PATH if DATABASE_URL.startswith("sqlite") else DATABASE_URL)
+
+
+@asynccontextmanager
+async def open_sqlite(url: str) -> AsyncIterator[BaseCheckpointSaver]:
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+    async with AsyncSqliteSaver.from_conn_string(url.removeprefix("sqlite:///")) as checkpointer:
+        await checkpointer.setup()
+        yield checkpointer
+
+@asynccontextmanager
+async def open_postgres(url: str) -> AsyncIterator[BaseCheckpointSaver]:
+    try:
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+        from psycopg import AsyncConnection
+    except ImportError as e:
+        raise RuntimeError("A postgresql:// checkpoint URL needs langgraph-checkpoint-postgres") from e
+    # the SQLAlchemy driver suffix is not part of a libpq URL
+    url = f"postgresql://{url.split('://', 1)[1]}"
+    async with AsyncPostgresSaver.from_conn_string(url) as checkpointer:
+        # workers starting together would run the checkpoint migrations side
+        # by side, which deadlock: they take turns, as api.migrations.lock.
+        # The lock is held by an idle connection, outside any transaction
+        # the concurrent index builds would wait for
+        async with await AsyncConnection.connect(url, autocommit=True) as lock:
+            await lock.execute("SELECT pg_advisory_lock(hashtext('chatbot_checkpoints'))")
+            await checkpointer.setup()
+        yield checkpointer
+
+# URL scheme (without its +driver) -> checkpointer opener, another shared
+# store is added here
+CHECKPOINTERS: Dict[str, Callable[[str], AsyncContextManager[BaseCheckpointSaver]]] = {
+    "sqlite": open_sqlite,
+    "postgres": open_postgres,
+    "postgresql": open_postgres,
+}
+
+
+def open_checkpointer(url: str = CHECKPOINT_URL) -> AsyncContextManager[BaseCheckpointSaver]:
+    """the checkpointer of url, with its tables created"""
+    scheme = url.split("://", 1)[0].split("+", 1)[0] if "://" in url else "sqlite"
+    if scheme not in CHECKPOINTERS:
+        raise ValueError(f"No checkpointer for {scheme}:// URLs, known: {', '.join(CHECKPOINTERS)}")
+    return CHECKPOINTERS[scheme](url)
@@ -0,0 +1,237 @@
+from api.models import Session, Message
+from api.archive import delete_archive
+from sqlalchemy import func, and_, or_, insert, delete, select, update
+from sqlalchemy.orm import load_only
+from utils.text_utils import split_think_tags
+from typing import Optional, List, Tuple
+import base64
+import datetime
+import json
+
+
+def get_session(db, session_id: str) -> Optional[Session]:
+    return db.query(Session).filter(Session.id == session_id).first()
+
+def session_exists(db, session_id: str) -> bool:
+    return db.query(Session.id).filter(Session.id == session_id).first() is not None
+
+def encode_cursor(session: Session) -> str:
+    raw = json.dumps([session.created_at.isoformat(), session.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    """raises ValueError on a malformed cursor"""
+    try:
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.datetime.fromisoformat(created_at), session_id
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def sessions_version(db) -> tuple:
+    """cheap fingerprint of the sessions table, changes on insert, delete and rename"""
+    count, last_created, last_renamed = db.query(func.count(Session.id), func.max(Session.created_at),
+                                                 func.max(Session.renamed_at)).one()
+    return count, last_created and last_created.isoformat(), last_renamed and last_renamed.isoformat()
+
+def list_sessions(db, limit: Optional[int] = None,
+                  before: Optional[str] = None, after: Optional[str] = None) -> dict:
+    """Sessions ordered by creation, paginated on the (created_at, id) key.
+    `after` returns the page following a cursor, `before` the page preceding it."""
+    query = db.query(Session)
+    if after:
+        created_at, session_id = decode_cursor(after)
+        query = query.filter(or_(Session.created_at > created_at,
+                                 and_(Session.created_at == created_at, Session.id > session_id)))
+    if before:
+        created_at, session_id = decode_cursor(before)
+        query = query.filter(or_(Session.created_at < created_at,
+                                 and_(Session.created_at == created_at, Session.id < session_id)))
+
+    # with only `before`, walk backwards from the cursor
+    backwards = bool(before) and not after
+    if backwards:
+        query = query.order_by(Session.created_at.desc(), Session.id.desc())
+    else:
+        query = query.order_by(Session.created_at, Session.id)
+
+    sessions = query.limit(limit + 1).all() if limit else query.all()
+    has_more = bool(limit) and len(sessions) > limit
+    if limit:
+        sessions = sessions[:limit]
+    if backwards:
+        sessions.reverse()
+
+    # cursors of the neighbour pages, None when there is nothing there
+    has_next = has_more if not backwards else True
+    has_prev = has_more if backwards else bool(after)
+    return {
+        "sessions": [
+            {
+                "session_id": s.id,
+                "created_at": s.created_at.isoformat(),
+                "name": s.name
+            }
+            for s in sessions
+        ],
+        "next_cursor": encode_cursor(sessions[-1]) if sessions and has_next else None,
+        "prev_cursor": encode_cursor(sessions[0]) if sessions and has_prev else None,
+    }
+
+def get_messages(db, session_id: str) -> List[Message]:
+    return db.query(Message).filter(Message.session_id == session_id).order_by(Message.seq, Message.id).all()
+
+def history_version(db, session_id: str) -> tuple:
+    """cheap fingerprint of a session history, changes when messages are added"""
+    return db.query(func.count(Message.id), func.max(Message.id)).filter(Message.session_id == session_id).one()
+
+def message_row(session_id: str, role: str, content: str, **columns) -> dict:
+    """message columns, with the display content and reasoning filled"""
+    display_content, reasoning = split_think_tags(content)
+    return {"session_id": session_id, "role": role, "content": content,
+            "display_content": display_content, "reasoning": reasoning, **columns}
+
+def new_message(session_id: str, role: str, content: str) -> Message:
+    """build a message with its display content and reasoning filled"""
+    return Message(**message_row(session_id, role, content))
+
+def seq_of(session_id: str, message_id: int):
+    return select(Message.seq).where(Message.id == message_id, Message.session_id == session_id).scalar_subquery()
+
+def get_messages_page(db, session_id: str, limit: Optional[int] = None,
+                      before: Optional[int] = None, after_id: Optional[int] = None,
+                      include_reasoning: bool = False, include_tools: bool = False,
+                      after_seq: Optional[int] = None) -> List[dict]:
+    """Messages of a session in turn order (seq), paginated on it.
+    `after_seq` returns only the messages after the last one the client
+    has, as does `after_id`, its id; `before` the page preceding a message
+    id. With only a limit, the latest messages are returned. Tool calls and
+    results are only returned with `include_tools`.
+
+    Restoring an archived session gives its messages new ids but keeps
+    their seq: an `after_id` not in the session is ignored, the client
+    gets the page it would get without it."""
+    # only the display columns, the raw content is read below for the rows
+    # that have none
+    columns = [Message.id, Message.seq, Message.role, Message.created_at, Message.display_content]
+    if include_reasoning:
+        columns.append(Message.reasoning)
+    if include_tools:
+        columns += [Message.tool_calls, Message.tool_call_id, Message.tool_name]
+    query = db.query(Message).options(load_only(*columns)).filter(Message.session_id == session_id)
+    if not include_tools:
+        query = query.filter(Message.role != "tool", Message.tool_calls.is_(None))
+    # the id cursors are compared by their position in the session
+    if after_seq is None and after_id is not None:
+        after_seq = db.query(Message.seq).filter(Message.id == after_id, Message.session_id == session_id).scalar()
+    if after_seq is not None:
+        query = query.filter(Message.seq > after_seq)
+    if before is not None:
+        query = query.filter(Message.seq < seq_of(session_id, before))
+
+    if limit and after_seq is None:
+        # latest page, fetched backwards then returned in order
+        messages = query.order_by(Message.seq.desc()).limit(limit).all()
+        messages.reverse()
+    else:
+        query = query.order_by(Message.seq)
+        messages = query.limit(limit).all() if limit else query.all()
+
+    missing = [msg.id for msg in messages if msg.display_content is None]
+    raw_content = dict(db.query(Message.id, Message.content).filter(Message.id.in_(missing)).all()) if missing else {}
+
+    history = []
+    for msg in messages:
+        item = {"id": msg.id, "seq": msg.seq, "role": msg.role, "created_at": msg.created_at.isoformat()}
+        if msg.display_content is not None:
+            item["content"] = msg.display_content
+            if include_reasoning:
+                item["reasoning"] = msg.reasoning
+        else:
+            # row not backfilled yet, content is loaded for it only
+            item["content"], reasoning = split_think_tags(raw_content[msg.id])
+            if include_reasoning:
+                item["reasoning"] = reasoning
+        if include_tools:
+            if msg.tool_calls:
+                item["tool_calls"] = json.loads(msg.tool_calls)
+            if msg.role == "tool":
+                item["tool_call_id"] = msg.tool_call_id
+                item["name"] = msg.tool_name
+        history.append(item)
+    return history
+
+def load_history(db, session_id: str) -> Optional[list]:
+    """get session messages formatted as graph inputs, None if the session does not exist"""
+    if not get_session(db, session_id):
+        return None
+    history = []
+    for msg in get_messages(db, session_id):
+        if msg.role == "system":
+            history.append({"role":"system", "content":msg.content})
+        elif msg.role == "user":
+            history.append({"role":"user", "content":msg.content})
+        elif msg.role == "tool":
+            history.append({"role":"tool", "content":msg.content,
+                            "tool_call_id":msg.tool_call_id, "name":msg.tool_name})
+        elif msg.tool_calls:
+            history.append({"role":"assistant", "content":msg.content,
+                            "tool_calls":json.loads(msg.tool_calls)})
+        else:
+            history.append({"role":"assistant", "content":msg.content})
+    return history
+
+def next_seqs(db, session_id: str, count: int) -> Optional[int]:
+    """Reserve count positions in a session, returns the first one, None
+    when the session is gone. The increment is atomic: concurrent
+    writers, of any worker, get distinct ranges."""
+    last = db.execute(update(Session)
+                      .where(Session.id == session_id)
+                      .values(message_seq=Session.message_seq + count)
+                      .returning(Session.message_seq)).scalar()
+    return None if last is None else last - count + 1
+
+def save_turns(db, turns: List[dict]):
+    """Persist turns in one transaction with two bulk inserts. A turn is
+    {"session_id", "new_session", "rows"} with its message rows in order,
+    see api.persistence.turn_record. The rows are numbered (seq) after the
+    messages already in their session."""
+    if not turns:
+        return
+    now = datetime.datetime.now()
+    sessions = [{"id": turn["session_id"], "created_at": now, "message_seq": len(turn["rows"])}
+                for turn in turns if turn["new_session"]]
+    if sessions:
+        db.execute(insert(Session), sessions)
+    rows = []
+    for turn in turns:
+        first = 1 if turn["new_session"] else next_seqs(db, turn["session_id"], len(turn["rows"]))
+        if first is None:
+            # the session was deleted during the turn
+            continue
+        rows.extend({**row, "created_at": now, "seq": first + i} for i, row in enumerate(turn["rows"]))
+    if rows:
+        db.execute(insert(Message), rows)
+    db.commit()
+
+def save_turn(db, session_id: str, user_input: str, ai_content: str, new_session: bool = False):
+    """persist a user/ai exchange, and the session if it is a new one"""
+    save_turns(db, [{"session_id": session_id, "new_session": new_session,
+                     "rows": [message_row(session_id, "user", user_input),
+                              message_row(session_id, "ai", ai_content)]}])
+
+def rename_session(db, session_id: str, name: str) -> bool:
+    """set the name of a session, False when it does not exist"""
+    renamed = db.execute(update(Session)
+                         .where(Session.id == session_id)
+                         .values(name=name, renamed_at=datetime.datetime.now())).rowcount
+    db.commit()
+    return renamed > 0
+
+def delete_session(db, session_id: str) -> bool:
+    """delete a session and its messages with set-based statements, the
+    messages are not loaded into the ORM"""
+    db.execute(delete(Message).where(Message.session_id == session_id))
+    delete_archive(db, session_id)
+    deleted = db.execute(delete(Session).where(Session.id == session_id)).rowcount
+    db.commit()
+    return deleted > 0
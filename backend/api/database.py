@@ -0,0 +1,145 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from concurrent.futures import ThreadPoolExecutor
+from api import migrations
+from utils.metrics import DB_CALL_SECONDS, DB_QUERY_SECONDS
+from utils import tracing
+import asyncio
+import contextvars
+import os
+import time
+
+# the default databases are in the backend folder whatever the working
+# directory, so every worker of a host opens the same files
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# sessions database:
+#  sqlite:///path                  a file, shared by the workers of one host
+#  postgresql+psycopg://...        a server shared by several hosts, which
+#                                  also holds the session leases (api.locks);
+#                                  full-text search is SQLite's, /chat/search
+#                                  answers 503 there
+DATABASE_URL = os.getenv("CHATBOT_DATABASE_URL", f"sqlite:///{os.path.join(BACKEND_DIR, 'chatbot_sessions.db')}")
+# langgraph checkpoints (graph state per session) live in a sibling file,
+# or on the server, see api.checkpoints
+CHECKPOINT_DB_PATH = os.getenv("CHATBOT_CHECKPOINT_DB_PATH", os.path.join(BACKEND_DIR, "chatbot_checkpoints.db"))
+# DB work runs in this many threads so it never blocks the event loop
+DB_MAX_WORKERS = int(os.getenv("CHATBOT_DB_MAX_WORKERS", "8"))
+
+# applied on every new sqlite connection: WAL lets readers run during a
+# write, and busy_timeout makes concurrent writers wait instead of failing
+SQLITE_PRAGMAS = {
+    # pages freed by deletes and archival are given back to the OS by
+    # PRAGMA incremental_vacuum (see api.archive); this only takes effect on
+    # a new database, an existing one needs a VACUUM once
+    # (scripts/enable_incremental_vacuum.py)
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    # NORMAL: a commit survives a crash of the app but may be lost on power
+    # loss, FULL also fsyncs every commit
+    "synchronous": os.getenv("CHATBOT_SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": 5000,
+    "cache_size": -65536, # in KiB, 64MB
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,
+}
+
+
+def tune_sqlite(engine, pragmas=SQLITE_PRAGMAS):
+    """set the pragmas on each connection of a sqlite engine"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def time_queries(engine):
+    """record the execution time of each SQL statement"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_start"].pop()
+        kind = statement.lstrip().split(" ", 1)[0].upper()
+        DB_QUERY_SECONDS.labels(kind).observe(seconds)
+        tracing.record_span("sql", seconds, statement=kind)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("query_start"):
+            context.connection.info["query_start"].pop()
+
+
+def connect(url: str):
+    """engine of a sessions database"""
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    # a connection per DB thread, checked as a server may have closed it
+    return create_engine(url, pool_size=DB_MAX_WORKERS, pool_pre_ping=True)
+
+
+engine = connect(DATABASE_URL)
+tune_sqlite(engine)
+time_queries(engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# the tables are created by the migration, under its lock
+migrations.upgrade(engine)
+
+db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="db")
+
+
+def _run_in_session(fn, *args, **kwargs):
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def run_db(fn, *args, **kwargs):
+    """Run fn(db, *args, **kwargs) in the bounded DB thread pool"""
+    loop = asyncio.get_running_loop()
+    # the thread sees the trace of the request
+    ctx = contextvars.copy_context()
+    with tracing.span(f"db:{fn.__name__}"):
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(
+                db_executor, lambda: ctx.run(_run_in_session, fn, *args, **kwargs)
+            )
+        finally:
+            DB_CALL_SECONDS.labels(fn.__name__).observe(time.perf_counter() - start)
+
+def _close_iteration(items, db):
+    try:
+        items.close()
+    finally:
+        db.rollback()
+        db.close()
+
+async def iterate_db(fn, *args, **kwargs):
+    """Iterate the generator fn(db, *args, **kwargs) from the event loop.
+    Each step runs in the DB thread pool, the session (and its read
+    transaction) is kept until the iteration ends, so a long read never
+    holds a thread while its consumer is away."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    db = SessionLocal()
+    items = fn(db, *args, **kwargs)
+    done = object()
+    try:
+        while True:
+            item = await loop.run_in_executor(db_executor, lambda: ctx.run(next, items, done))
+            if item is done:
+                return
+            yield item
+    finally:
+        await loop.run_in_executor(db_executor, _close_iteration, items, db)
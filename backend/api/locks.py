@@ -0,0 +1,142 @@
+from api.database import run_db
+from api.models import SessionLock
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from utils.metrics import LOCK_WAIT_SECONDS
+from utils import tracing
+from typing import Optional, Set
+import asyncio
+import datetime
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# turns of a session run one at a time across the workers and hosts sharing
+# the sessions database: needed with uvicorn --workers or several hosts, a
+# single process is already ordered by its scheduler. Expiry times are
+# taken from the clock of each worker, the clocks of the hosts must agree
+# well within LOCK_TTL
+SESSION_LOCKS = os.getenv("CHATBOT_SESSION_LOCKS", "0") == "1"
+# seconds a lease lasts, renewed while its turn runs, so the lease of a
+# crashed worker frees itself
+LOCK_TTL = float(os.getenv("CHATBOT_LOCK_TTL", "30"))
+# seconds between two attempts to take a lease held by another turn
+LOCK_POLL = float(os.getenv("CHATBOT_LOCK_POLL", "0.02"))
+
+
+def try_acquire(db, session_id: str, owner: str, ttl: float) -> bool:
+    """take the lease of a session when free or expired"""
+    now = datetime.datetime.now()
+    expires_at = now + datetime.timedelta(seconds=ttl)
+    try:
+        db.execute(insert(SessionLock).values(session_id=session_id, owner=owner, expires_at=expires_at))
+    except IntegrityError:
+        db.rollback()
+        taken = db.execute(update(SessionLock)
+                           .where(SessionLock.session_id == session_id, SessionLock.expires_at < now)
+                           .values(owner=owner, expires_at=expires_at)).rowcount
+        if not taken:
+            db.rollback()
+            return False
+    db.commit()
+    return True
+
+def renew(db, session_id: str, owner: str, ttl: float) -> bool:
+    """extend a lease, False when it expired and was taken by another turn"""
+    expires_at = datetime.datetime.now() + datetime.timedelta(seconds=ttl)
+    renewed = db.execute(update(SessionLock)
+                         .where(SessionLock.session_id == session_id, SessionLock.owner == owner)
+                         .values(expires_at=expires_at)).rowcount
+    db.commit()
+    return renewed > 0
+
+def release(db, session_id: str, owner: str):
+    db.execute(delete(SessionLock).where(SessionLock.session_id == session_id, SessionLock.owner == owner))
+    db.commit()
+
+
+class Lease:
+    """lease held by a running turn, release() may be called more than
+    once and from any thread"""
+    def __init__(self, locks: "SessionLocks", session_id: str, owner: str):
+        self.locks = locks
+        self.session_id = session_id
+        self.owner = owner
+        self.loop = asyncio.get_running_loop()
+        self.heartbeat = self.loop.create_task(self._renew())
+        self.released = False
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(self.locks.ttl / 3)
+            try:
+                if not await run_db(renew, self.session_id, self.owner, self.locks.ttl):
+                    self.locks.lost += 1
+                    logger.warning(f"Lease of session {self.session_id} expired while its turn was running")
+                    return
+            except Exception:
+                logger.exception(f"Renewing the lease of session {self.session_id} failed")
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.loop.call_soon_threadsafe(self._release)
+
+    def _release(self):
+        self.heartbeat.cancel()
+        task = self.loop.create_task(run_db(release, self.session_id, self.owner))
+        # kept until done, the release is not awaited by the turn
+        self.locks.releasing.add(task)
+        task.add_done_callback(self.locks.releasing.discard)
+
+
+class SessionLocks:
+    """Per-session turn leases in the database, shared by every worker.
+
+    A turn takes the lease of its session before running and gives it back
+    when done. Other workers poll until it is free, so turns of a session
+    run one after the other whatever worker or host receives them, and the
+    history and the checkpoints see them in the same order.
+    """
+    def __init__(self, ttl: float = LOCK_TTL, poll: float = LOCK_POLL):
+        self.ttl = ttl
+        self.poll = poll
+        self.releasing: Set[asyncio.Task] = set()
+        # metrics
+        self.acquired = 0
+        self.contended = 0
+        self.timed_out = 0
+        self.lost = 0
+        self.total_wait = 0.0
+
+    async def acquire(self, session_id: str, timeout: float) -> Optional[Lease]:
+        """wait up to timeout seconds for the lease of the session, None on timeout"""
+        owner = uuid.uuid4().hex
+        start = time.perf_counter()
+        attempts = 0
+        while not await run_db(try_acquire, session_id, owner, self.ttl):
+            attempts += 1
+            if time.perf_counter() - start + self.poll > timeout:
+                self.timed_out += 1
+                return None
+            await asyncio.sleep(self.poll)
+        wait = time.perf_counter() - start
+        self.acquired += 1
+        self.contended += attempts > 0
+        self.total_wait += wait
+        LOCK_WAIT_SECONDS.observe(wait)
+        tracing.record_span("lock_wait", wait, attempts=attempts)
+        return Lease(self, session_id, owner)
+
+    def stats(self) -> dict:
+        return {
+            "ttl_seconds": self.ttl,
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "timed_out": self.timed_out,
+            "lost": self.lost,
+            "avg_wait_seconds": round(self.total_wait / self.acquired, 4) if self.acquired else 0.0,
+        }
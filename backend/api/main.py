@@ -1,189 +1,477 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+import asyncio
 import logging
-from typing import Dict, Any
-from api.models import ChatRequest, ChatResponse, Session, Message, Base
-from core.graph import ChatGraph
+import os
+import time
+from typing import Dict, Any, List, Optional
+from api.models import ChatRequest, ChatResponse, BatchRequest, SessionRename
+from api.database import run_db
+from api.checkpoints import open_checkpointer
+from api.locks import SessionLocks, SESSION_LOCKS
+from api import crud
+from api.scheduler import TurnScheduler, SchedulerBusy
+from api.middleware import TracingMiddleware
+from api.batch import run_batch
+from api.persistence import TurnWriter, new_turn_messages
+from api.archive import ArchiveJob, open_session, restore_session
+from api.search import search_messages, has_index
+from api.backup import export_stream, import_stream
+from core.graph import ChatGraph, AGENT_NODES
+from tools.web_search import search_service
+from utils.model_pool import PooledChatOllama, NoBackendAvailable
+from utils.model_provider import warm_up
+from utils.model_params import MODEL_WARMUP
 import uuid
 import traceback
-from langchain_core.messages import HumanMessage
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from langchain_core.messages import HumanMessage, AIMessage
+from utils.text_utils import remove_think_tags, ThinkTagFilter
+from utils import tracing
+from utils.tracing import TracingCallbackHandler, trace_store
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import datetime
-import re
+import hashlib
+import json
 
 
 # configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# sqlite database
-DATABASE_URL = "sqlite:///./chatbot_sessions.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base.metadata.create_all(bind=engine)
+# build the graph once per process, it is shared by all requests
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start = time.perf_counter()
+    # loads the model on the Ollama servers while the graph is built
+    app.state.warmup = asyncio.create_task(warm_up()) if MODEL_WARMUP else None
+    # graph state is checkpointed per session (thread_id) in SQLite or a
+    # shared server, so a turn only sends the new message and resumes from
+    # the saved state
+    async with open_checkpointer() as checkpointer:
+        app.state.graph = ChatGraph(checkpointer=checkpointer)
+        app.state.graph.graph # compile now rather than on the first request
+        app.state.graph_build_seconds = time.perf_counter() - start
+        # bounds the turns running at once and queues the others fairly,
+        # session leases order the turns of a session across workers
+        app.state.scheduler = TurnScheduler(locks=SessionLocks() if SESSION_LOCKS else None)
+        logger.info(f"Chat graph built in {app.state.graph_build_seconds:.3f}s")
+        # writes each turn in one transaction, optionally grouped across turns
+        app.state.writer = TurnWriter()
+        await app.state.writer.start()
+        # moves idle sessions to compressed archives, restored when opened
+        app.state.archiver = ArchiveJob(checkpointer)
+        app.state.archiver.start()
+        try:
+            yield
+        finally:
+            await app.state.archiver.close()
+            await app.state.writer.close()
+            if app.state.warmup is not None:
+                app.state.warmup.cancel()
 
 # define the app
 app = FastAPI(
     title="Smart AI Chat Agent API",
     description="API for interacting with the smart chatbot",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
+# per-request traces (X-Request-ID) and request latency metrics
+app.add_middleware(TracingMiddleware)
+
+@app.exception_handler(SchedulerBusy)
+async def scheduler_busy_handler(request: Request, exc: SchedulerBusy):
+    """the server is full, tell the client when to come back"""
+    return JSONResponse({"detail": str(exc)}, status_code=exc.status_code,
+                        headers={"Retry-After": str(exc.retry_after)})
 
 # utils function
-def remove_think_tags(raw: str) -> str:
-    # Remove <think>...</think> block
-    cleaned = re.sub(r"<think>.*?</think>", "", raw, flags=re.DOTALL).strip()
-    return cleaned
+def chat_config(session_id: str, recursion_limit: int) -> Dict[str, Any]:
+    return {
+        "recursion_limit": recursion_limit,
+        "configurable": {"thread_id": session_id},
+        # node and model timings go to the request trace and /metrics
+        "callbacks": [TracingCallbackHandler()]
+    }
+
+async def turn_inputs(graph, session_id: str, user_input: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """Graph inputs for a new turn of an existing session.
+    Only the new message is sent when the session has a checkpoint, the
+    history is replayed from the DB otherwise (sessions not migrated yet)."""
+    state = await graph.aget_state(config)
+    if state.values.get("messages"):
+        return {"messages": [{"role":"user", "content":user_input}]}
+
+    history = await run_db(crud.load_history, session_id)
+    history.append({"role":"user", "content":user_input})
+    return {"messages": history}
+
+async def session_known(session_id: str) -> bool:
+    """the session is in the DB, or queued to be written. An archived
+    session is restored, so its history can be replayed"""
+    return app.state.writer.is_pending(session_id) or await run_db(open_session, session_id)
+
+def make_etag(*parts) -> str:
+    return 'W/"' + hashlib.sha1(repr(parts).encode()).hexdigest() + '"'
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """whether the client already has this version (If-None-Match)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+def is_cached(message) -> bool:
+    return bool(message.response_metadata.get("cache_hit"))
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_chat(graph, inputs: Dict[str, Any], config: Dict[str, Any],
+                      session_id: str, user_input: str, new_session: bool = False, turn=None):
+    """Run the graph and yield tokens and tool events as server-sent events.
+    The turn is persisted once the stream completes, then its scheduler
+    slot is released."""
+    think_filter = ThinkTagFilter()
+    final_message = None
+    turn_messages = [] # ai messages and tool results of the turn
+    try:
+        async for mode, chunk in graph.astream(inputs, config, stream_mode=["messages", "updates"]):
+            if mode == "messages":
+                message, metadata = chunk
+                if (metadata.get("langgraph_node") in AGENT_NODES
+                        and isinstance(message, AIMessage)
+                        and isinstance(message.content, str)):
+                    text = think_filter.feed(message.content)
+                    if text:
+                        yield sse_event("token", {"content": text})
+                continue
+
+            # node updates: tool calls requested by the agent and their results
+            for node, update in chunk.items():
+                if not update or not update.get("messages"):
+                    continue
+                if node in AGENT_NODES:
+                    final_message = update["messages"][-1]
+                    turn_messages.append(final_message)
+                    for tool_call in getattr(final_message, "tool_calls", None) or []:
+                        yield sse_event("tool_call", {"id": tool_call["id"],
+                                                      "name": tool_call["name"],
+                                                      "args": tool_call["args"]})
+                elif node == "tools":
+                    turn_messages.extend(update["messages"])
+                    for tool_msg in update["messages"]:
+                        yield sse_event("tool_result", {"id": tool_msg.tool_call_id,
+                                                        "name": tool_msg.name,
+                                                        "content": str(tool_msg.content)})
+
+        text = think_filter.flush()
+        if text:
+            yield sse_event("token", {"content": text})
+
+        if final_message is None:
+            raise RuntimeError("The graph did not produce an answer")
+
+        await app.state.writer.save(session_id, user_input, turn_messages, new_session=new_session)
+        yield sse_event("done", {"session_id": session_id,
+                                 "response": remove_think_tags(final_message.content),
+                                 "cached": is_cached(final_message)})
+    except Exception:
+        logger.error(f"Error streaming chat: {traceback.format_exc()}")
+        yield sse_event("error", {"session_id": session_id, "detail": traceback.format_exc()})
+    finally:
+        if turn is not None:
+            turn.release()
 
 
 # end points
 @app.post("/chat/start", response_model=ChatResponse)
 async def start_chat(request: ChatRequest):
     """Start a new chat session with the chatbot"""
-    db = SessionLocal()
     try:
         # generate a unique session id
         session_id = str(uuid.uuid4())
+        tracing.set_session(session_id)
 
-        # create a new graph instance
-        graph = ChatGraph()        
+        # use the shared graph instance
+        graph = app.state.graph
 
         # run a chat by invoking the graph
         inputs = {"messages":[{"role":"user",
                                "content":request.user_input}]}
-        
-        config = {
-            "recursion_limit":request.recursion_limit,
-            "configurable":{"thread_id":session_id}
-            }
-
-        output = graph.invoke(
-            input=inputs,
-            config=config
-        )
 
-        # save the session to DB
-        new_session = Session(id=session_id)
-        db.add(new_session)
-        db.commit()
+        config = chat_config(session_id, request.recursion_limit)
 
-        # save messages to DB
-        user_msg = Message(session_id=session_id, role="user", content=request.user_input)
-        db.add(user_msg)
-        ai_msg = Message(session_id=session_id, role="ai", content=output["messages"][-1].content)
-        db.add(ai_msg)
-        db.commit()    
+        async with app.state.scheduler.turn(session_id):
+            output = await graph.ainvoke(
+                input=inputs,
+                config=config
+            )
+
+            # save the session and the messages of the turn to DB
+            await app.state.writer.save(session_id, request.user_input,
+                                        new_turn_messages(output["messages"]), new_session=True)
 
         return ChatResponse(
             response=remove_think_tags(output["messages"][-1].content),
-            session_id=session_id
+            session_id=session_id,
+            cached=is_cached(output["messages"][-1])
         )
+    except SchedulerBusy:
+        raise
+    except NoBackendAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error starting chat: {traceback.format_exc()}")
-        db.rollback()
         raise HTTPException(status_code=500, detail=traceback.format_exc())
-    finally:
-        db.close()
-    
+
 # continue chat
 @app.post("/chat/{session_id}/continue", response_model=ChatResponse)
 async def continue_chat(session_id:str, request:ChatRequest):
-    db = SessionLocal()
     try:
-        session_obj = db.query(Session).filter(Session.id == session_id).first()
-        if not session_obj:
+        if not await session_known(session_id):
             raise HTTPException(status_code=404, detail="Session not found")
-        
-
-        # get messages and format them
-        messages = db.query(Message).filter(Message.session_id == session_id).order_by(Message.created_at).all()
-        history = []
-        for msg in messages:
-            if msg.role == "system":
-                history.append({"role":"system", "content":msg.content})
-            elif msg.role == "user":
-                history.append({"role":"user", "content":msg.content})
-            else:
-                history.append({"role":"assistant", "content":msg.content})
-
-        # add latest user input
-        history.append({"role":"user", "content":request.user_input})
-
-        # invoke graph
-        graph = ChatGraph()
-        config = {
-            "recursion_limit": request.recursion_limit,
-            "configurable": {"thread_id": session_id}
-        }
-        output = graph.invoke(
-            input={"messages": history},
-            config=config
-        )
 
-        # save messages to DB
-        user_msg = Message(session_id=session_id, role="user", content=request.user_input)
-        ai_msg = Message(session_id=session_id, role="ai", content=output["messages"][-1].content)
-        db.add(user_msg)
-        db.add(ai_msg)
-        db.commit()
+        # latest user input, on top of the checkpointed state
+        graph = app.state.graph
+        config = chat_config(session_id, request.recursion_limit)
+
+        # turns of a session run one at a time, in order
+        async with app.state.scheduler.turn(session_id):
+            inputs = await turn_inputs(graph, session_id, request.user_input, config)
+
+            # invoke graph
+            output = await graph.ainvoke(
+                input=inputs,
+                config=config
+            )
+
+            # save the messages of the turn to DB
+            await app.state.writer.save(session_id, request.user_input,
+                                        new_turn_messages(output["messages"]))
 
         return ChatResponse(
             response=remove_think_tags(output["messages"][-1].content),
-            session_id=session_id
+            session_id=session_id,
+            cached=is_cached(output["messages"][-1])
         )
+    except (HTTPException, SchedulerBusy):
+        raise
+    except NoBackendAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error continuing chat: {traceback.format_exc()}")
-        db.rollback()
-        raise HTTPException(status_code=500, detail=traceback.format_exc())        
-    finally:
-        db.close()
-    
+        raise HTTPException(status_code=500, detail=traceback.format_exc())
+
+
+# streaming variants
+@app.post("/chat/start/stream")
+async def start_chat_stream(request: ChatRequest):
+    """Start a new chat session and stream the answer as server-sent events"""
+    session_id = str(uuid.uuid4())
+    tracing.set_session(session_id)
+    inputs = {"messages":[{"role":"user", "content":request.user_input}]}
+    config = chat_config(session_id, request.recursion_limit)
+    # the slot is taken before answering so a full server returns a 429/503,
+    # the background task releases it if the client leaves before the stream
+    turn = await app.state.scheduler.acquire(session_id)
+    return StreamingResponse(
+        stream_chat(app.state.graph, inputs, config, session_id, request.user_input,
+                    new_session=True, turn=turn),
+        media_type="text/event-stream",
+        background=BackgroundTask(turn.release)
+    )
+
+@app.post("/chat/{session_id}/continue/stream")
+async def continue_chat_stream(session_id: str, request: ChatRequest):
+    """Continue a chat session and stream the answer as server-sent events"""
+    if not await session_known(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    config = chat_config(session_id, request.recursion_limit)
+    turn = await app.state.scheduler.acquire(session_id)
+    try:
+        inputs = await turn_inputs(app.state.graph, session_id, request.user_input, config)
+    except Exception:
+        turn.release()
+        raise
+    return StreamingResponse(
+        stream_chat(app.state.graph, inputs, config, session_id, request.user_input, turn=turn),
+        media_type="text/event-stream",
+        background=BackgroundTask(turn.release)
+    )
+
+
+# batch of independent conversations, e.g. evaluation sets
+@app.post("/chat/batch")
+async def chat_batch(request: BatchRequest):
+    """Run many single-turn conversations and stream the results as NDJSON,
+    one line per conversation as it completes, then a summary line.
+    With `persist` false no session, message or checkpoint is stored."""
+    return StreamingResponse(
+        run_batch(app.state.graph, request, chat_config, app.state.scheduler),
+        media_type="application/x-ndjson"
+    )
+
+
+def warmup_status(task: Optional[asyncio.Task]):
+    if task is None:
+        return None
+    if not task.done():
+        return "pending"
+    if task.cancelled() or task.exception() is not None:
+        return "failed"
+    return task.result()
+
+@app.get("/health")
+async def health():
+    """Health check with startup metrics"""
+    model = app.state.graph.summary_node.model
+    return {
+        "status": "ok",
+        "worker": os.getpid(),
+        "graph_build_seconds": app.state.graph_build_seconds,
+        "search": search_service.stats(),
+        "tools": app.state.graph.tool_executor.stats.snapshot(),
+        "router": app.state.graph.router.stats(),
+        "prompt_prefix": app.state.graph.prefix_tracker.stats(),
+        "response_cache": app.state.graph.response_cache.stats() if app.state.graph.response_cache else None,
+        "model_backends": model.pool.stats() if isinstance(model, PooledChatOllama) else None,
+        "scheduler": app.state.scheduler.stats(),
+        "writer": app.state.writer.stats(),
+        "archive": app.state.archiver.stats(),
+        "model_warmup": warmup_status(getattr(app.state, "warmup", None))
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/traces/{request_id}")
+async def get_trace(request_id: str):
+    """Spans of a recent request, its id is in the X-Request-ID response header"""
+    trace = trace_store.get(request_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_dict()
+
+@app.get("/chat/{session_id}/traces")
+async def get_session_traces(session_id: str, limit: int = Query(20, ge=1, le=200)):
+    """Recent request traces of a session, newest first"""
+    return [trace.to_dict() for trace in trace_store.for_session(session_id, limit)]
+
 
 @app.get("/chat/sessions")
-async def list_sessions():
-    """List all active sessions with metadata"""
-    db = SessionLocal()
+async def list_sessions(request: Request,
+                        limit: Optional[int] = Query(None, ge=1, le=500),
+                        before: Optional[str] = None,
+                        after: Optional[str] = None):
+    """List sessions with metadata, paginated with `before`/`after` cursors.
+    Returns 304 when the list did not change since the client ETag."""
+    version = await run_db(crud.sessions_version)
+    etag = make_etag("sessions", version, limit, before, after)
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
     try:
-        sessions = db.query(Session).order_by(Session.created_at).all()
-        return {
-            "sessions": [
-                {
-                    "session_id": s.id,
-                    "created_at": s.created_at.isoformat()
-                }
-                for s in sessions
-            ]
-        }
-    finally:
-        db.close()
+        page = await run_db(crud.list_sessions, limit, before, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(page, headers={"ETag": etag})
+
+@app.get("/chat/search")
+async def search_history(q: str = Query(..., min_length=1, max_length=500),
+                         limit: int = Query(20, ge=1, le=100),
+                         cursor: Optional[str] = None):
+    """Full-text search over the messages of all sessions. Every word of q
+    must match, `word*` matches a prefix. Results are ranked by bm25 with
+    a snippet (matches in **bold**) and their session id, the next page
+    is fetched with `cursor`."""
+    if not await run_db(has_index):
+        raise HTTPException(status_code=503, detail="Full-text search is not available (needs SQLite with FTS5)")
+    try:
+        return await run_db(search_messages, q, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/chat/export")
+async def export_sessions(session_id: Optional[List[str]] = Query(None),
+                          since: Optional[datetime.datetime] = None,
+                          until: Optional[datetime.datetime] = None,
+                          gzip: bool = False):
+    """Stream sessions and their messages as NDJSON (see api.backup), all
+    of them or the given `session_id`s, created in [`since`, `until`).
+    Gzipped with `gzip`. The file is read back by POST /chat/import."""
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    filename = f"chatbot-export-{stamp}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(export_stream(session_id, since, until, compress=gzip),
+                             media_type="application/gzip" if gzip else "application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.post("/chat/import")
+async def import_sessions(request: Request):
+    """Import an export of GET /chat/export, plain or gzipped NDJSON in the
+    request body. It is written as it is read, in batches, and sessions and
+    messages already there are skipped: a file can be imported again, e.g.
+    after a failure, the batches written before are kept."""
+    try:
+        return await import_stream(request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.patch("/chat/{session_id}")
+async def rename_session(session_id: str, request: SessionRename):
+    """Rename a chat session"""
+    name = request.name.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Session name cannot be empty")
+    if not await run_db(crud.rename_session, session_id, name):
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return {"session_id": session_id, "name": name}
 
 @app.delete("/chat/{session_id}")
 async def end_session(session_id: str):
     """End a chat session"""
-    db = SessionLocal()
-    try:
-        session_obj = db.query(Session).filter(Session.id == session_id).first()
-        if not session_obj:
-            raise HTTPException(status_code=404, detail="Chat session not found")
-        
-        db.delete(session_obj)
-        db.commit()
-
-        return {"message": "Session ended succesfully"}
-    finally:
-        db.close()
+    if not await run_db(crud.delete_session, session_id):
+        raise HTTPException(status_code=404, detail="Chat session not found")
+
+    # drop the graph state of the session too
+    await app.state.graph.memory_saver.adelete_thread(session_id)
+
+    return {"message": "Session ended succesfully"}
 
 
 @app.get("/chat/{session_id}/history")
-async def get_history(session_id: str):
-    """Get full message history for a session"""
-    db = SessionLocal()
-    try:
-        messages = db.query(Message).filter(Message.session_id == session_id).order_by(Message.created_at).all()
+async def get_history(session_id: str, request: Request,
+                      limit: Optional[int] = Query(None, ge=1, le=1000),
+                      before: Optional[int] = None,
+                      after_id: Optional[int] = None,
+                      include_reasoning: bool = False,
+                      include_tools: bool = False,
+                      after_seq: Optional[int] = None):
+    """Get message history for a session.
+    Without parameters the full history is returned. `after_seq` returns
+    only the messages newer than the last one the client has (`after_id`
+    with its id, which changes when an archived session is restored: an id
+    not found is ignored), `before` with a
+    `limit` pages backwards. The <think> reasoning of ai messages is added
+    with `include_reasoning`, the tool calls and results of the turns with
+    `include_tools`. Returns 304 when the client ETag is current."""
+    version = await run_db(crud.history_version, session_id)
+    # no message: the session may be archived, it is restored on first read
+    if not version[0] and await run_db(restore_session, session_id):
+        version = await run_db(crud.history_version, session_id)
+    etag = make_etag("history", session_id, version, limit, before, after_id, include_reasoning, include_tools,
+                     after_seq)
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
 
-        return [
-            {"role": msg.role, "content": remove_think_tags(msg.content), "created_at": msg.created_at.isoformat()}
-            for msg in messages
-        ]
-    finally:
-        db.close()
+    history = await run_db(crud.get_messages_page, session_id, limit, before, after_id,
+                           include_reasoning, include_tools, after_seq)
+
+    return JSONResponse(history, headers={"ETag": etag})
@@ -0,0 +1,48 @@
+from utils.metrics import HTTP_REQUEST_SECONDS
+from utils.tracing import Trace, current_trace, trace_store
+
+REQUEST_ID_HEADER = "x-request-id"
+
+
+class TracingMiddleware:
+    """Open a trace for each HTTP request.
+
+    The request id comes from the X-Request-ID header, or is generated, and
+    is sent back in the response. Written as a plain ASGI middleware so the
+    trace and latency also cover the body of streaming responses.
+    """
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        # a client id is kept if it is reasonable, a new one is made otherwise
+        request_id = headers.get(REQUEST_ID_HEADER.encode(), b"").decode("latin-1")[:128] or None
+        trace = Trace(request_id, scope["method"], scope["path"])
+        token = current_trace.set(trace)
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.encode(), trace.request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            current_trace.reset(token)
+            trace.finish(status)
+            # routes with a session in their path, new sessions are set by the endpoint
+            trace.session_id = trace.session_id or scope.get("path_params", {}).get("session_id")
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], getattr(route, "path", "unmatched"),
+                                        str(status)).observe(trace.duration)
+            trace_store.add(trace)
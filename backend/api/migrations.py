@@ -0,0 +1,192 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+from api.models import Base, Message
+import logging
+
+logger = logging.getLogger(__name__)
+
+# full-text index of the user and ai messages, for /chat/search. It keeps
+# its own copy of the text so the messages of archived sessions stay
+# searchable: the delete trigger skips sessions being archived, and
+# api.archive drops their entries on restore and delete.
+FTS_TABLE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, session_id UNINDEXED, role UNINDEXED, created_at UNINDEXED,
+    tokenize = 'porter unicode61 remove_diacritics 2',
+    -- short prefixes (word*) expand to many terms, they get their own index
+    prefix = '2 3'
+)"""
+# the messages indexed, ai messages that only request tools have no text
+FTS_INDEXED = "{row}.role IN ('user', 'ai') AND coalesce({row}.display_content, '') != ''"
+FTS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+    WHEN {FTS_INDEXED.format(row="new")}
+    BEGIN
+        INSERT OR REPLACE INTO messages_fts (rowid, content, session_id, role, created_at)
+        VALUES (new.id, new.display_content, new.session_id, new.role, new.created_at);
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+    WHEN NOT EXISTS (SELECT 1 FROM session_archive WHERE session_id = old.session_id)
+    BEGIN
+        DELETE FROM messages_fts WHERE rowid = old.id;
+    END""",
+    # display_content filled by scripts/backfill_display_content.py
+    f"""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF display_content ON messages
+    BEGIN
+        DELETE FROM messages_fts WHERE rowid = old.id;
+        INSERT INTO messages_fts (rowid, content, session_id, role, created_at)
+        SELECT new.id, new.display_content, new.session_id, new.role, new.created_at
+        WHERE {FTS_INDEXED.format(row="new")};
+    END""",
+]
+FTS_BACKFILL = f"""
+INSERT INTO messages_fts (rowid, content, session_id, role, created_at)
+SELECT id, display_content, session_id, role, created_at FROM messages AS m
+WHERE {FTS_INDEXED.format(row="m")}"""
+
+
+def create_fts(conn, backfill: bool):
+    """create the full-text index and its triggers, filled from the
+    existing messages when new"""
+    try:
+        conn.execute(text(FTS_TABLE))
+    except OperationalError as e:
+        # sqlite built without FTS5, /chat/search answers 503
+        logger.warning(f"Full-text search disabled: {e.orig}")
+        return
+    for trigger in FTS_TRIGGERS:
+        conn.execute(text(trigger))
+    if backfill:
+        logger.info("Indexing existing messages for full-text search")
+        conn.execute(text(FTS_BACKFILL))
+
+
+# messages numbered in their session in insertion order, then the counter
+# of each session set past its messages, archived ones included
+SEQ_BACKFILL = """
+UPDATE messages SET seq = numbered.seq
+FROM (SELECT id, row_number() OVER (PARTITION BY session_id ORDER BY created_at, id) AS seq
+      FROM messages) AS numbered
+WHERE messages.id = numbered.id"""
+SESSION_SEQ_BACKFILL = """
+UPDATE sessions SET message_seq = max(
+    coalesce((SELECT max(seq) FROM messages WHERE session_id = sessions.id), 0),
+    coalesce((SELECT message_count FROM session_archive WHERE session_id = sessions.id), 0))"""
+
+
+def lock(conn):
+    """Hold the schema lock until the end of the transaction of conn, so
+    workers starting together migrate one after the other, each seeing
+    the schema left by the previous one."""
+    if conn.dialect.name == "sqlite":
+        # the write lock, taken now rather than at the first write
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("SELECT pg_advisory_xact_lock(hashtext('chatbot_migrations'))")
+
+def uses_autoincrement(conn, table: str) -> bool:
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                       {"name": table}).scalar()
+    return "AUTOINCREMENT" in (sql or "").upper()
+
+def rebuild_messages(conn):
+    """copy messages into a table with AUTOINCREMENT ids, the only way to
+    add it in sqlite"""
+    logger.info("Rebuilding messages with AUTOINCREMENT ids")
+    # the indexes follow the renamed table, they are made again on the new one
+    indexes = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                "AND tbl_name = 'messages' AND sql IS NOT NULL")).scalars().all()
+    for name in indexes:
+        conn.execute(text(f"DROP INDEX {name}"))
+    conn.execute(text("ALTER TABLE messages RENAME TO messages_old"))
+    Message.__table__.create(conn)
+    columns = ", ".join(column.name for column in Message.__table__.columns)
+    conn.execute(text(f"INSERT INTO messages ({columns}) SELECT {columns} FROM messages_old"))
+    conn.execute(text("DROP TABLE messages_old"))
+
+
+def upgrade(engine):
+    """Bring an existing database up to the current schema.
+    create_all only creates missing tables, so new indexes and columns of
+    existing tables are added here. Every step is idempotent. A server
+    database is created at the current schema, the steps of older SQLite
+    files do not run there."""
+    with engine.begin() as conn:
+        lock(conn)
+        inspector = inspect(conn)
+        tables = inspector.get_table_names()
+        Base.metadata.create_all(conn)
+        number_sessions = False
+
+        if "sessions" in tables:
+            indexes = {index["name"] for index in inspector.get_indexes("sessions")}
+            if "ix_sessions_created_at" not in indexes:
+                logger.info("Creating index ix_sessions_created_at")
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_sessions_created_at ON sessions (created_at)"
+                ))
+
+            # archival of idle sessions, session_archive itself is made by create_all
+            columns = {column["name"] for column in inspector.get_columns("sessions")}
+            for name in ("archived_at", "restored_at", "renamed_at"):
+                if name not in columns:
+                    logger.info(f"Adding column sessions.{name}")
+                    conn.execute(text(f"ALTER TABLE sessions ADD COLUMN {name} DATETIME"))
+
+            # session names, kept by the frontend in a local file before
+            if "name" not in columns:
+                logger.info("Adding column sessions.name")
+                conn.execute(text("ALTER TABLE sessions ADD COLUMN name VARCHAR"))
+
+            if "message_seq" not in columns:
+                logger.info("Adding column sessions.message_seq")
+                conn.execute(text("ALTER TABLE sessions ADD COLUMN message_seq INTEGER NOT NULL DEFAULT 0"))
+                number_sessions = True
+
+        if "messages" in tables:
+            indexes = {index["name"] for index in inspector.get_indexes("messages")}
+            if "ix_messages_session_created" not in indexes:
+                logger.info("Creating index ix_messages_session_created")
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_messages_session_created "
+                    "ON messages (session_id, created_at)"
+                ))
+
+            columns = {column["name"] for column in inspector.get_columns("messages")}
+            for name in ("display_content", "reasoning"):
+                if name not in columns:
+                    # existing rows are filled by scripts/backfill_display_content.py
+                    logger.info(f"Adding column messages.{name}")
+                    conn.execute(text(f"ALTER TABLE messages ADD COLUMN {name} TEXT"))
+
+            # tool calls and results, older turns simply have none
+            for name, kind in (("tool_calls", "TEXT"), ("tool_call_id", "VARCHAR"), ("tool_name", "VARCHAR")):
+                if name not in columns:
+                    logger.info(f"Adding column messages.{name}")
+                    conn.execute(text(f"ALTER TABLE messages ADD COLUMN {name} {kind}"))
+
+            # order of the messages in their session, numbered once from the
+            # insertion order
+            if "seq" not in columns:
+                logger.info("Adding column messages.seq")
+                conn.execute(text("ALTER TABLE messages ADD COLUMN seq INTEGER"))
+                conn.execute(text(SEQ_BACKFILL))
+            if "ux_messages_session_seq" not in indexes:
+                logger.info("Creating index ux_messages_session_seq")
+                conn.execute(text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS ux_messages_session_seq "
+                    "ON messages (session_id, seq)"
+                ))
+
+            if engine.dialect.name == "sqlite" and not uses_autoincrement(conn, "messages"):
+                rebuild_messages(conn)
+
+        if number_sessions:
+            conn.execute(text(SESSION_SEQ_BACKFILL))
+
+        # the messages written before the index existed are indexed once
+        if engine.dialect.name == "sqlite":
+            create_fts(conn, backfill="messages_fts" not in tables)
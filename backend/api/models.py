@@ -1,7 +1,8 @@
 
 from pydantic import BaseModel, Field
+from typing import List, Optional
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, String, Integer, Text, DateTime, ForeignKey
+from sqlalchemy import Column, String, Integer, Text, DateTime, ForeignKey, Index, LargeBinary
 from sqlalchemy.orm import relationship
 import datetime
 
@@ -14,11 +15,34 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     session_id: str
+    cached: bool = False # answer served from the response cache
+
+class BatchItem(BaseModel):
+    user_input: str
+    id: Optional[str] = None # echoed back with the result, e.g. an eval case id
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(min_length=1, max_length=10000)
+    persist: bool = True # False: nothing is written, no session is created
+    max_concurrency: Optional[int] = Field(default=None, ge=1)
+    recursion_limit: int = Field(default=25)
+
+class SessionRename(BaseModel):
+    name: str = Field(min_length=1, max_length=200)
 
 class Session(Base):
     __tablename__ = "sessions"
     id = Column(String, primary_key=True, index=True)
-    created_at = Column(DateTime, default=datetime.datetime.now)
+    created_at = Column(DateTime, default=datetime.datetime.now, index=True)
+    # set while the messages of the session are in session_archive
+    archived_at = Column(DateTime, nullable=True)
+    # a restored session counts as active from then on, its messages are old
+    restored_at = Column(DateTime, nullable=True)
+    # last seq given to a message of the session, see crud.save_turns
+    message_seq = Column(Integer, nullable=False, default=0, server_default="0")
+    # name given by the user, None until renamed: clients show a default one
+    name = Column(String, nullable=True)
+    renamed_at = Column(DateTime, nullable=True)
     messages = relationship("Message", back_populates="session", cascade="all, delete-orphan")
 
 class Message(Base):
@@ -27,5 +51,42 @@ class Message(Base):
     session_id = Column(String, ForeignKey("sessions.id"))
     role = Column(String)
     content = Column(Text)
+    # filled at insert time from content: the text shown to users without
+    # the <think> blocks, and the reasoning trace taken out of it
+    display_content = Column(Text)
+    reasoning = Column(Text, nullable=True)
+    # tool use of a turn: the calls requested by an ai message (JSON list),
+    # and on "tool" messages the call they answer
+    tool_calls = Column(Text, nullable=True)
+    tool_call_id = Column(String, nullable=True)
+    tool_name = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.now)
+    # position in the session, 1, 2, ... in the order the turns ran: a
+    # clock or an id sequence shared by several workers does not give it
+    seq = Column(Integer, nullable=True)
     session = relationship("Session", back_populates="messages")
+
+    # history reads filter on session_id and sort by seq, the archival job
+    # looks for recent messages by created_at. Ids are never reused
+    # (AUTOINCREMENT): the full-text index of archived messages relies on it
+    __table_args__ = (
+        Index("ix_messages_session_created", "session_id", "created_at"),
+        Index("ux_messages_session_seq", "session_id", "seq", unique=True),
+        {"sqlite_autoincrement": True},
+    )
+
+class ArchivedSession(Base):
+    """messages of an idle session, as one compressed JSON list (see api.archive)"""
+    __tablename__ = "session_archive"
+    session_id = Column(String, ForeignKey("sessions.id"), primary_key=True)
+    codec = Column(String) # "zstd" or "gzip"
+    data = Column(LargeBinary)
+    message_count = Column(Integer)
+    archived_at = Column(DateTime, default=datetime.datetime.now)
+
+class SessionLock(Base):
+    """lease of a session held by the worker running one of its turns (see api.locks)"""
+    __tablename__ = "session_locks"
+    session_id = Column(String, primary_key=True)
+    owner = Column(String) # one id per acquisition
+    expires_at = Column(DateTime)
@@ -0,0 +1,172 @@
+from api.database import run_db
+from api import crud
+from core.context import message_text
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from utils.metrics import WRITE_BATCH_TURNS
+from typing import List, Optional, Sequence, Set
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# how chat turns reach the DB:
+#  "direct"   one transaction per turn, done before the response is sent
+#  "group"    turns of concurrent requests share a transaction, each request
+#             still waits for the commit of its turn (same durability)
+#  "buffered" the response does not wait, a crash may lose the turns of
+#             the last WRITE_FLUSH_MS
+WRITE_MODE = os.getenv("CHATBOT_WRITE_MODE", "direct")
+# "group" and "buffered" wait this long to gather turns in one transaction
+WRITE_FLUSH_MS = float(os.getenv("CHATBOT_WRITE_FLUSH_MS", "5"))
+WRITE_MAX_BATCH = int(os.getenv("CHATBOT_WRITE_MAX_BATCH", "256"))
+
+
+def new_turn_messages(messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+    """messages of the last turn that follow its user message: the ai
+    messages, with their tool calls, and the tool results"""
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            return list(messages[index + 1:])
+    return list(messages)
+
+def message_rows(session_id: str, messages: Sequence[BaseMessage]) -> List[dict]:
+    rows = []
+    for message in messages:
+        if isinstance(message, ToolMessage):
+            rows.append(crud.message_row(session_id, "tool", message_text(message),
+                                         tool_call_id=message.tool_call_id, tool_name=message.name))
+        elif isinstance(message, AIMessage):
+            tool_calls = [{"id": tc["id"], "name": tc["name"], "args": tc["args"]}
+                          for tc in message.tool_calls]
+            rows.append(crud.message_row(session_id, "ai", message_text(message),
+                                         tool_calls=json.dumps(tool_calls) if tool_calls else None))
+    return rows
+
+def turn_record(session_id: str, user_input: str, messages: Sequence[BaseMessage],
+                new_session: bool = False) -> dict:
+    """everything a turn writes, see crud.save_turns"""
+    return {"session_id": session_id, "new_session": new_session,
+            "rows": [crud.message_row(session_id, "user", user_input)] + message_rows(session_id, messages)}
+
+
+class TurnWriter:
+    """Write chat turns: the session when new, the user message, the ai
+    messages with their tool calls and the tool results, in one transaction.
+
+    In "group" and "buffered" mode the turns go through a queue and a
+    background task writes what arrived within WRITE_FLUSH_MS in a single
+    transaction. The queue is flushed on close().
+    """
+    def __init__(self, mode: str = WRITE_MODE, flush_interval: float = WRITE_FLUSH_MS / 1000,
+                 max_batch: int = WRITE_MAX_BATCH):
+        if mode not in ("direct", "group", "buffered"):
+            raise ValueError(f"Unknown write mode {mode!r}")
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.pending_sessions: Set[str] = set()  # new sessions queued, not written yet
+        self.batches = 0
+        self.turns = 0
+        self.errors = 0
+
+    async def start(self):
+        if self.mode != "direct" and self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """write what is queued and stop the background task"""
+        task, self.task = self.task, None
+        if task is not None:
+            # turns saved from now on are written directly
+            await self.queue.put(None)
+            await task
+
+    def is_pending(self, session_id: str) -> bool:
+        """whether a new session is queued but not in the DB yet"""
+        return session_id in self.pending_sessions
+
+    async def save(self, session_id: str, user_input: str, messages: Sequence[BaseMessage],
+                   new_session: bool = False):
+        record = turn_record(session_id, user_input, messages, new_session)
+        if self.task is None:
+            await self._write([record])
+            return
+
+        if new_session:
+            self.pending_sessions.add(session_id)
+        done = asyncio.get_running_loop().create_future()
+        await self.queue.put((record, done))
+        if self.mode == "group":
+            await done
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                try:
+                    item = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._write_batch(batch)
+
+    async def _write(self, records: List[dict]):
+        await run_db(crud.save_turns, records)
+        self.batches += 1
+        self.turns += len(records)
+        WRITE_BATCH_TURNS.observe(len(records))
+
+    async def _write_batch(self, batch: list):
+        records = [record for record, _ in batch]
+        try:
+            await self._write(records)
+            results = [None] * len(batch)
+        except Exception:
+            # one bad turn must not lose the others, they are written one by one
+            logger.exception(f"Writing {len(batch)} turns failed, retrying them one by one")
+            results = []
+            for record in records:
+                try:
+                    await self._write([record])
+                    results.append(None)
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Turn of session {record['session_id']} was not saved: {e!r}")
+                    results.append(e)
+
+        for (record, done), error in zip(batch, results):
+            self.pending_sessions.discard(record["session_id"])
+            if done.done():
+                continue
+            if error is None:
+                done.set_result(None)
+            else:
+                done.set_exception(error)
+                if self.mode == "buffered":
+                    # nobody waits for it, the error was logged
+                    done.exception()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "transactions": self.batches,
+            "turns": self.turns,
+            "avg_turns_per_transaction": round(self.turns / self.batches, 2) if self.batches else 0.0,
+            "errors": self.errors,
+        }
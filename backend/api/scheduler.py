@@ -0,0 +1,218 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional, Set
+from api.locks import SessionLocks, Lease
+from utils.model_params import MODEL_URLS, MODEL_BACKEND_MAX_CONCURRENCY
+from utils.metrics import QUEUE_WAIT_SECONDS, QUEUE_REJECTIONS, QUEUED_TURNS, ACTIVE_TURNS
+from utils import tracing
+import asyncio
+import math
+import os
+import time
+
+# turns running the graph at once, by default what the Ollama servers accept
+MAX_CONCURRENT_TURNS = int(os.getenv("CHATBOT_MAX_CONCURRENT_TURNS",
+                                     str(MODEL_BACKEND_MAX_CONCURRENCY * len(MODEL_URLS))))
+# turns waiting for a slot, requests above it are rejected with a 429
+MAX_QUEUED_TURNS = int(os.getenv("CHATBOT_MAX_QUEUED_TURNS", "64"))
+# seconds a turn may wait for a slot before it is rejected with a 503
+QUEUE_TIMEOUT = float(os.getenv("CHATBOT_QUEUE_TIMEOUT", "60"))
+
+
+class SchedulerBusy(RuntimeError):
+    """the turn was not admitted, retry_after is a hint in seconds"""
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(SchedulerBusy):
+    status_code = 429
+
+
+class QueueTimeout(SchedulerBusy):
+    status_code = 503
+
+
+class Turn:
+    """slot held by a running turn, release() may be called more than once"""
+    def __init__(self, scheduler: "TurnScheduler", session_id: str):
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.lease: Optional[Lease] = None
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            if self.lease is not None:
+                self.lease.release()
+            self.scheduler._finish(time.perf_counter() - self.started)
+            self.scheduler._release(self.session_id)
+
+
+class TurnScheduler:
+    """Admission control in front of the graph.
+
+    At most max_concurrent turns run at once and at most max_queued wait
+    for a slot. Turns of one session run one after the other, in arrival
+    order, and free slots go round-robin to the sessions with waiting
+    turns, so a session sending many messages cannot starve the others.
+
+    With locks, an admitted turn also takes the lease of its session in the
+    database, which orders the turns of a session across workers.
+    """
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_TURNS,
+                 max_queued: int = MAX_QUEUED_TURNS, queue_timeout: float = QUEUE_TIMEOUT,
+                 locks: Optional[SessionLocks] = None):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.locks = locks
+        self.active = 0
+        self.queued = 0
+        self.running: Set[str] = set()  # sessions with a running turn
+        self.waiting: Dict[str, Deque[asyncio.Future]] = {}  # waiting turns per session
+        self.ready: Deque[str] = deque()  # sessions whose next turn can start, in turn order
+        # metrics
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+        self.completed = 0
+        QUEUED_TURNS.set_function(lambda: self.queued)
+        ACTIVE_TURNS.set_function(lambda: self.active)
+
+    def retry_after(self) -> int:
+        """rough seconds until a slot frees up for a new turn"""
+        avg_run = self.total_run / self.completed if self.completed else 1.0
+        return max(1, math.ceil(avg_run * (self.queued + 1) / self.max_concurrent))
+
+    def _dispatch(self):
+        while self.active < self.max_concurrent and self.ready:
+            session_id = self.ready.popleft()
+            waiters = self.waiting[session_id]
+            waiter = waiters.popleft()
+            if not waiters:
+                del self.waiting[session_id]
+            self.queued -= 1
+            self.active += 1
+            self.running.add(session_id)
+            waiter.set_result(time.perf_counter())
+
+    def _remove(self, session_id: str, waiter: asyncio.Future):
+        waiters = self.waiting.get(session_id)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        self.queued -= 1
+        if not waiters:
+            del self.waiting[session_id]
+            if session_id in self.ready:
+                self.ready.remove(session_id)
+
+    def _release(self, session_id: str):
+        self.active -= 1
+        self.running.discard(session_id)
+        # the next turn of the session goes to the back of the line
+        if session_id in self.waiting and session_id not in self.ready:
+            self.ready.append(session_id)
+        self._dispatch()
+
+    async def acquire(self, session_id: str) -> Turn:
+        """wait for a slot for a turn of the session, then for its lease"""
+        start = time.perf_counter()
+        turn = await self._admit(session_id, start)
+        if self.locks is None:
+            return turn
+        try:
+            turn.lease = await self.locks.acquire(session_id, max(0.0, start + self.queue_timeout - time.perf_counter()))
+        finally:
+            if turn.lease is None:
+                # the slot is given back, the turn never ran
+                turn.released = True
+                self._release(session_id)
+        if turn.lease is None:
+            self.timed_out += 1
+            QUEUE_REJECTIONS.labels("lock_timeout").inc()
+            raise QueueTimeout("Timed out waiting for the previous turn of the session", self.retry_after())
+        return turn
+
+    async def _admit(self, session_id: str, start: float) -> Turn:
+        if (self.active < self.max_concurrent and not self.ready
+                and session_id not in self.running):
+            self.active += 1
+            self.running.add(session_id)
+            self._record_wait(0.0)
+            return Turn(self, session_id)
+
+        if self.queued >= self.max_queued:
+            self.rejected += 1
+            QUEUE_REJECTIONS.labels("full").inc()
+            raise QueueFull("Too many chats waiting, retry later", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(session_id, deque()).append(waiter)
+        self.queued += 1
+        if session_id not in self.running and session_id not in self.ready:
+            self.ready.append(session_id)
+        self._dispatch()
+
+        try:
+            admitted_at = await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except BaseException as e:
+            if waiter.done():
+                # the slot was given just before the cancellation
+                self._release(session_id)
+            else:
+                waiter.cancel()
+                self._remove(session_id, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                QUEUE_REJECTIONS.labels("timeout").inc()
+                tracing.record_span("queue_wait", time.perf_counter() - start, status="timeout")
+                raise QueueTimeout("Timed out waiting for a free slot", self.retry_after())
+            raise
+        self._record_wait(admitted_at - start)
+        return Turn(self, session_id)
+
+    def _record_wait(self, wait: float):
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        QUEUE_WAIT_SECONDS.observe(wait)
+        tracing.record_span("queue_wait", wait, queued=self.queued, active=self.active)
+
+    @asynccontextmanager
+    async def turn(self, session_id: str):
+        """run the body as one turn of the session"""
+        turn = await self.acquire(session_id)
+        try:
+            yield turn
+        finally:
+            turn.release()
+
+    def _finish(self, seconds: float):
+        self.completed += 1
+        self.total_run += seconds
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "sessions_waiting": len(self.waiting),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_seconds": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            "max_wait_seconds": round(self.max_wait, 4),
+            "avg_run_seconds": round(self.total_run / self.completed, 4) if self.completed else 0.0,
+            "session_locks": self.locks.stats() if self.locks is not None else None,
+        }
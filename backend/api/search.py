@@ -0,0 +1,110 @@
+from sqlalchemy import bindparam, text
+from typing import Iterable, Optional
+import base64
+import json
+import os
+import re
+
+# matches ranked per query: the latest ones, found by walking the index
+# backwards, so a word present in most messages costs the same as a rare
+# one. Rarer words have all their matches ranked.
+SEARCH_CANDIDATES = int(os.getenv("CHATBOT_SEARCH_CANDIDATES", "1000"))
+# snippet of the matched text around the hits, in words, with the hits in
+# markdown bold
+SNIPPET_WORDS = 16
+SNIPPET_MARKERS = ("**", "**")
+
+RANK_QUERY = text("""
+SELECT rowid, score FROM (
+    SELECT rowid, bm25(messages_fts) AS score
+    FROM messages_fts
+    WHERE messages_fts MATCH :query
+    ORDER BY rowid DESC
+    LIMIT :candidates
+)
+ORDER BY score, rowid DESC
+LIMIT :limit OFFSET :offset""")
+
+RESULTS_QUERY = text(f"""
+SELECT rowid, session_id, role, created_at,
+       snippet(messages_fts, 0, '{SNIPPET_MARKERS[0]}', '{SNIPPET_MARKERS[1]}', '…', {SNIPPET_WORDS}) AS snippet
+FROM messages_fts
+WHERE messages_fts MATCH :query AND rowid IN :ids""").bindparams(bindparam("ids", expanding=True))
+
+DROP_ENTRIES = text(
+    "DELETE FROM messages_fts WHERE rowid IN :ids AND session_id = :session_id"
+).bindparams(bindparam("ids", expanding=True))
+
+
+def match_query(q: str) -> Optional[str]:
+    """FTS5 query matching every word of q, a word ending with * as a
+    prefix. User text never reaches the FTS5 syntax: each word is quoted.
+    None when q has no word."""
+    terms = [f'"{word}"{star}' for word, star in re.findall(r"(\w+)(\*?)", q)]
+    if not terms:
+        return None
+    return " ".join(terms)
+
+def encode_cursor(query: str, offset: int) -> str:
+    raw = json.dumps([query, offset])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str, query: str) -> int:
+    """offset of the next page, raises ValueError on a malformed cursor or
+    one of another query"""
+    try:
+        cursor_query, offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if cursor_query != query or not isinstance(offset, int) or offset < 0:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return offset
+
+def search_messages(db, q: str, limit: int = 20, cursor: Optional[str] = None) -> dict:
+    """Messages matching q, best bm25 rank first among the latest
+    SEARCH_CANDIDATES matches, with a snippet of each. Pages follow each
+    other with next_cursor. The index holds the user and ai messages of
+    every session, archived ones included."""
+    query = match_query(q)
+    if query is None:
+        return {"results": [], "next_cursor": None}
+    offset = decode_cursor(cursor, query) if cursor else 0
+
+    ranked = db.execute(RANK_QUERY, {"query": query, "candidates": SEARCH_CANDIDATES,
+                                     "limit": limit + 1, "offset": offset}).all()
+    page = ranked[:limit]
+    # snippets only for the returned page
+    rows = {row.rowid: row for row in db.execute(
+        RESULTS_QUERY, {"query": query, "ids": [rowid for rowid, _ in page]})} if page else {}
+    results = [
+        {
+            "message_id": rowid,
+            "session_id": rows[rowid].session_id,
+            "role": rows[rowid].role,
+            "created_at": rows[rowid].created_at.replace(" ", "T", 1), # as stored by sqlalchemy
+            "snippet": rows[rowid].snippet,
+            "score": round(-score, 4), # bm25() is lower for better matches
+        }
+        for rowid, score in page if rowid in rows
+    ]
+    return {
+        "results": results,
+        "next_cursor": encode_cursor(query, offset + limit) if len(ranked) > limit else None,
+    }
+
+def has_index(db) -> bool:
+    """whether the full-text index exists, sqlite may lack FTS5 and other
+    databases have none"""
+    if db.get_bind().dialect.name != "sqlite":
+        return False
+    return db.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")).first() is not None
+
+def drop_index_entries(db, session_id: str, message_ids: Iterable[int]):
+    """remove messages of a session from the index, e.g. archived ones
+    whose rows are gone, in the transaction of db"""
+    ids = [message_id for message_id in message_ids if message_id is not None]
+    if not ids or not has_index(db):
+        return
+    # below the bound parameters limit of sqlite
+    for start in range(0, len(ids), 10000):
+        db.execute(DROP_ENTRIES, {"session_id": session_id, "ids": ids[start:start + 10000]})
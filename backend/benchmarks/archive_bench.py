@@ -0,0 +1,165 @@
+"""Session deletion and archival benchmark.
+
+A temporary SQLite file is seeded with sessions, most of them idle for a
+year, then measured:
+ - delete: ORM cascade (the session and every message loaded, deleted one
+   by one) against the set-based statements of crud.delete_session
+ - before/after archival of the idle sessions and an incremental vacuum:
+   database size and history fetch latency of the active sessions, and
+   the latency of the first read of an archived session (restore)
+
+    cd backend
+    python -m benchmarks.archive_bench --messages 1000000 --sessions 20000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import uuid
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from api.models import Base, Session
+from api.database import tune_sqlite
+from api import archive, crud
+from benchmarks.db_bench import percentiles
+
+
+def seed(path: str, n_messages: int, n_sessions: int, idle: float) -> tuple:
+    engine = create_engine(f"sqlite:///{path}")
+    tune_sqlite(engine) # a new database, created with auto_vacuum=INCREMENTAL
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    now = datetime.datetime.now()
+    session_ids = [str(uuid.uuid4()) for _ in range(n_sessions)]
+    n_idle = int(n_sessions * idle)
+    idle_ids, active_ids = session_ids[:n_idle], session_ids[n_idle:]
+    starts = {sid: now - datetime.timedelta(days=365) for sid in idle_ids}
+    starts.update({sid: now - datetime.timedelta(days=1) for sid in active_ids})
+
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO sessions (id, created_at) VALUES (?, ?)",
+                     [(sid, starts[sid]) for sid in session_ids])
+    batch = []
+    seqs = dict.fromkeys(session_ids, 0)
+    for i in range(n_messages):
+        sid = random.choice(session_ids)
+        seqs[sid] += 1
+        content = f"message {i} " + "lorem ipsum " * 20
+        batch.append((sid, "user" if i % 2 else "ai", content, content,
+                      starts[sid] + datetime.timedelta(seconds=i % 3600), seqs[sid]))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO messages (session_id, role, content, display_content, created_at, seq) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO messages (session_id, role, content, display_content, created_at, seq) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", batch)
+    conn.executemany("UPDATE sessions SET message_seq = ? WHERE id = ?", [(seq, sid) for sid, seq in seqs.items()])
+    conn.commit()
+    conn.close()
+    return idle_ids, active_ids
+
+def db_size(engine, path: str) -> float:
+    """size in MB, with the WAL written back to the file"""
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return round(os.path.getsize(path) / 2**20, 1)
+
+def fetch_history(SessionLocal, session_ids: list) -> dict:
+    times = []
+    for sid in session_ids:
+        db = SessionLocal()
+        t = time.perf_counter()
+        crud.get_messages_page(db, sid)
+        times.append(time.perf_counter() - t)
+        db.close()
+    return percentiles(times)
+
+def orm_delete(db, session_id: str):
+    """deletion as done before: the ORM cascade loads every message"""
+    db.delete(db.query(Session).filter(Session.id == session_id).first())
+    db.commit()
+
+def time_deletes(SessionLocal, fn, session_ids: list) -> dict:
+    times = []
+    for sid in session_ids:
+        db = SessionLocal()
+        t = time.perf_counter()
+        fn(db, sid)
+        times.append(time.perf_counter() - t)
+        db.close()
+    return percentiles(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=20_000)
+    parser.add_argument("--idle", type=float, default=0.9, help="share of sessions idle for a year")
+    parser.add_argument("--after-days", type=float, default=30)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--deletes", type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    t = time.perf_counter()
+    idle_ids, active_ids = seed(path, args.messages, args.sessions, args.idle)
+    print(f"seeded {args.messages} messages in {time.perf_counter() - t:.1f}s")
+
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    tune_sqlite(engine)
+    SessionLocal = sessionmaker(bind=engine)
+
+    # deletion of active sessions, half each way
+    doomed = random.sample(active_ids, min(2 * args.deletes, len(active_ids)))
+    active_ids = [sid for sid in active_ids if sid not in set(doomed)]
+    delete = {"orm_cascade": time_deletes(SessionLocal, orm_delete, doomed[::2]),
+              "set_based": time_deletes(SessionLocal, crud.delete_session, doomed[1::2])}
+
+    reads = random.sample(active_ids, min(args.reads, len(active_ids)))
+    before = {"db_mb": db_size(engine, path), "history_fetch": fetch_history(SessionLocal, reads)}
+
+    # archival, as run by the background job
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=args.after_days)
+    db = SessionLocal()
+    t = time.perf_counter()
+    archived = 0
+    while True:
+        session_ids = archive.archive_idle_sessions(db, cutoff)
+        archived += len(session_ids)
+        if len(session_ids) < archive.ARCHIVE_BATCH_SIZE:
+            break
+    archive_seconds = time.perf_counter() - t
+    t = time.perf_counter()
+    freed = archive.incremental_vacuum(db)
+    vacuum_seconds = time.perf_counter() - t
+    packed = db.execute(text("SELECT sum(length(data)) FROM session_archive")).scalar()
+    db.close()
+
+    after = {"db_mb": db_size(engine, path), "history_fetch": fetch_history(SessionLocal, reads)}
+
+    restores = []
+    for sid in random.sample(idle_ids, min(args.reads, len(idle_ids))):
+        db = SessionLocal()
+        t = time.perf_counter()
+        archive.restore_session(db, sid)
+        crud.get_messages_page(db, sid)
+        restores.append(time.perf_counter() - t)
+        db.close()
+    engine.dispose()
+
+    print(json.dumps({"messages": args.messages, "sessions": args.sessions, "idle_share": args.idle,
+                      "codec": archive.ARCHIVE_CODEC, "delete": delete,
+                      "archival": {"sessions": archived, "seconds": round(archive_seconds, 2),
+                                   "vacuum_seconds": round(vacuum_seconds, 2), "freed_pages": freed,
+                                   "archive_mb": round((packed or 0) / 2**20, 1)},
+                      "before": before, "after": after,
+                      "archived_first_read": percentiles(restores) if restores else None}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
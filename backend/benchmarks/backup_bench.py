@@ -0,0 +1,142 @@
+"""Export/import benchmark.
+
+A temporary SQLite file is seeded with sessions and messages, then the
+code paths of GET /chat/export and POST /chat/import are timed:
+ - export to a file, plain and gzipped
+ - import of the gzipped file into the same database: every line is
+   skipped (idempotent re-import)
+ - import of the gzipped file after deleting everything, i.e. a restore
+Reported as JSON: seconds, messages per second, file size and the peak
+memory growth of the process during each phase (Linux): at most the
+SQLite page cache (cache_size) and one batch, whatever the size of the
+database.
+
+    cd backend
+    python -m benchmarks.backup_bench --messages 1000000 --sessions 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "backup_bench.db")
+os.environ.setdefault("CHATBOT_DATABASE_URL", f"sqlite:///{DB_PATH}")
+
+from sqlalchemy import text
+from api.backup import export_stream, import_stream
+from api.database import SessionLocal, engine
+from api import migrations
+from benchmarks.archive_bench import seed, db_size
+
+CHUNK = 1 << 16
+
+
+def rss_mb() -> float:
+    """anonymous resident memory: the heap, without the pages of the
+    database file mapped by sqlite (mmap_size)"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+class PeakMemory:
+    """growth of the resident memory over a block, sampled, None where
+    /proc is not available"""
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.growth = None
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        if not os.path.exists("/proc/self/status"):
+            return self
+        self.start = self.peak = rss_mb()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if hasattr(self, "thread"):
+            self.stopped.set()
+            self.thread.join()
+            self.growth = round(max(self.peak, rss_mb()) - self.start, 1)
+
+
+async def export_to(path: str, compress: bool) -> dict:
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        with open(path, "wb") as f:
+            async for chunk in export_stream(compress=compress):
+                f.write(chunk)
+        seconds = time.perf_counter() - start
+    return {"seconds": round(seconds, 2), "file_mb": round(os.path.getsize(path) / 2**20, 1),
+            "rss_growth_mb": memory.growth}
+
+async def read_file(path: str):
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK):
+            yield chunk
+
+async def import_from(path: str) -> dict:
+    with PeakMemory() as memory:
+        counts = await import_stream(read_file(path))
+    return {**counts, "rss_growth_mb": memory.growth}
+
+def rate(messages: int, seconds: float) -> int:
+    return round(messages / seconds) if seconds else 0
+
+def clear():
+    """empty the database: its tables dropped and made again by the
+    migration, as in a new one"""
+    with engine.begin() as conn:
+        for table in ("messages_fts", "messages", "session_archive", "session_locks", "sessions"):
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    migrations.upgrade(engine)
+
+def count_messages() -> int:
+    db = SessionLocal()
+    try:
+        return db.execute(text("SELECT count(*) FROM messages")).scalar()
+    finally:
+        db.close()
+
+async def run(args) -> dict:
+    tmp = os.path.dirname(DB_PATH)
+    plain = await export_to(os.path.join(tmp, "export.ndjson"), False)
+    packed = await export_to(os.path.join(tmp, "export.ndjson.gz"), True)
+    plain["messages_per_s"] = rate(args.messages, plain["seconds"])
+    packed["messages_per_s"] = rate(args.messages, packed["seconds"])
+
+    reimport = await import_from(os.path.join(tmp, "export.ndjson.gz"))
+    reimport["messages_per_s"] = rate(args.messages, reimport["seconds"])
+
+    clear()
+    restore = await import_from(os.path.join(tmp, "export.ndjson.gz"))
+    restore["messages_per_s"] = rate(args.messages, restore["seconds"])
+    restore["messages_in_db"] = count_messages()
+    return {"export": plain, "export_gzip": packed, "reimport_skipped": reimport, "import_into_empty": restore}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=20_000)
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    seed(DB_PATH, args.messages, args.sessions, idle=0)
+    print(f"seeded {args.messages} messages in {time.perf_counter() - t:.1f}s")
+    report = {"messages": args.messages, "sessions": args.sessions, "db_mb": db_size(engine, DB_PATH),
+              **asyncio.run(run(args))}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Cold start benchmark.
+
+Each run is a fresh interpreter, as a new worker process would be, with a
+temporary database and the fake model (no Ollama server needed):
+ - import: time to import api.main
+ - startup: time of the lifespan startup (checkpointer, graph build)
+The modules with the largest cumulative import time are listed from
+python -X importtime.
+
+    cd backend
+    python -m benchmarks.cold_start --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RUN = """
+import asyncio, json, time
+start = time.perf_counter()
+import api.main
+imported = time.perf_counter() - start
+
+async def startup():
+    start = time.perf_counter()
+    async with api.main.app.router.lifespan_context(api.main.app):
+        return time.perf_counter() - start
+
+print(json.dumps({"import": imported, "startup": asyncio.run(startup())}))
+"""
+
+
+def env(tmp: str) -> dict:
+    return {**os.environ,
+            "CHATBOT_MODEL_PROVIDER": "fake",
+            "CHATBOT_MODEL_WARMUP": "0",
+            "CHATBOT_ARCHIVE_AFTER_DAYS": "0",
+            "CHATBOT_DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'sessions.db')}",
+            "CHATBOT_CHECKPOINT_DB_PATH": os.path.join(tmp, "checkpoints.db")}
+
+def run_once() -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        out = subprocess.run([sys.executable, "-c", RUN], env=env(tmp), capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def import_profile(top: int) -> list:
+    """modules with the largest cumulative import time, in seconds"""
+    with tempfile.TemporaryDirectory() as tmp:
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import api.main"],
+                             env=env(tmp), capture_output=True, text=True, check=True)
+    modules = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative) / 1e6, name.strip()))
+    modules.sort(reverse=True)
+    return [{"module": name, "seconds": round(seconds, 3)} for seconds, name in modules[:top]]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    print(json.dumps({
+        "runs": args.runs,
+        "import_seconds": round(statistics.median(run["import"] for run in runs), 3),
+        "startup_seconds": round(statistics.median(run["startup"] for run in runs), 3),
+        "slowest_imports": import_profile(args.top),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Check that concurrent chats run in parallel within one worker.
+
+N chats are sent at once to the app, backed by a model that answers after
+a fixed delay. If the event loop is not blocked they all finish in roughly
+the time of a single chat, and a sessions read sent meanwhile answers at
+once. The script exits 1 when a check fails, so CI can run it.
+
+    cd backend
+    python -m benchmarks.concurrency --chats 10 --delay 1.0
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# isolated database, set before the app is imported
+_tmp_dir = tempfile.mkdtemp()
+os.environ.setdefault("CHATBOT_DATABASE_URL", f"sqlite:///{_tmp_dir}/concurrency.db")
+
+import httpx
+from api.main import app
+from api.scheduler import TurnScheduler
+from api.persistence import TurnWriter
+from core.graph import ChatGraph
+from utils.fakes import FakeChatModel
+
+
+async def run_chats(client: httpx.AsyncClient, n: int) -> float:
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[
+        client.post("/chat/start", json={"user_input": f"question {i}"})
+        for i in range(n)
+    ])
+    elapsed = time.perf_counter() - start
+    for resp in responses:
+        resp.raise_for_status()
+    return elapsed
+
+async def main(chats: int, delay: float, tolerance: float) -> int:
+    app.state.graph = ChatGraph(use_memory=False, model=FakeChatModel(delay=delay))
+    app.state.scheduler = TurnScheduler(max_concurrent=chats)
+    app.state.writer = TurnWriter()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        single = await run_chats(client, 1)
+
+        # a sessions read issued while the chats run must not wait for them
+        chats_task = asyncio.create_task(run_chats(client, chats))
+        await asyncio.sleep(delay / 4)
+        read_start = time.perf_counter()
+        (await client.get("/chat/sessions")).raise_for_status()
+        read_time = time.perf_counter() - read_start
+        concurrent = await chats_task
+
+    print(f"1 chat: {single:.2f}s | {chats} concurrent chats: {concurrent:.2f}s "
+          f"| sessions read during chats: {read_time * 1000:.1f}ms")
+    checks = {
+        "chats ran in parallel": concurrent < single * tolerance,
+        "sessions read not blocked by the chats": read_time < delay / 2,
+    }
+    for name, passed in checks.items():
+        print(f"{'OK' if passed else 'FAIL'}: {name}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=1.0, help="fake model latency in seconds")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="max ratio between N concurrent chats and one chat")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.chats, args.delay, args.tolerance)))
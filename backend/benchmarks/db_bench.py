@@ -0,0 +1,140 @@
+"""Sessions database benchmark: history fetch and insert latency.
+
+A temporary SQLite file is seeded with messages spread over many sessions,
+then measured twice:
+ - before: default SQLite engine, no (session_id, created_at) index
+ - after: tuned pragmas (WAL, synchronous, cache) and the index, created
+   by the same migration path used by the app
+
+    cd backend
+    python -m benchmarks.db_bench --messages 1000000 --sessions 20000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from api.models import Base
+from api.database import tune_sqlite
+from api import crud, migrations
+
+
+def seed(path: str, n_messages: int, n_sessions: int) -> list:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.execute("DROP INDEX IF EXISTS ix_messages_session_created")
+    conn.execute("DROP INDEX IF EXISTS ux_messages_session_seq")
+    session_ids = [str(uuid.uuid4()) for _ in range(n_sessions)]
+    start = datetime.datetime.now() - datetime.timedelta(days=365)
+    conn.executemany("INSERT INTO sessions (id, created_at) VALUES (?, ?)",
+                     [(sid, start) for sid in session_ids])
+
+    batch = []
+    seqs = dict.fromkeys(session_ids, 0)
+    for i in range(n_messages):
+        # messages of a session are interleaved with the others, as in production
+        created_at = start + datetime.timedelta(seconds=i)
+        sid = random.choice(session_ids)
+        seqs[sid] += 1
+        batch.append((sid, "user" if i % 2 else "ai", f"message {i} " + "lorem ipsum " * 20, created_at, seqs[sid]))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO messages (session_id, role, content, created_at, seq) VALUES (?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO messages (session_id, role, content, created_at, seq) VALUES (?, ?, ?, ?, ?)", batch)
+    conn.executemany("UPDATE sessions SET message_seq = ? WHERE id = ?", [(seq, sid) for sid, seq in seqs.items()])
+    conn.commit()
+    conn.close()
+    return session_ids
+
+def percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+    pick = lambda q: samples[min(int(q * len(samples)), len(samples) - 1)] * 1000
+    return {"p50_ms": round(pick(0.50), 3), "p95_ms": round(pick(0.95), 3),
+            "p99_ms": round(pick(0.99), 3), "mean_ms": round(statistics.mean(samples) * 1000, 3)}
+
+def measure(SessionLocal, session_ids: list, reads: int, writes: int, writers: int) -> dict:
+    read_times = []
+    for sid in random.sample(session_ids, min(reads, len(session_ids))):
+        db = SessionLocal()
+        t = time.perf_counter()
+        crud.get_messages(db, sid)
+        read_times.append(time.perf_counter() - t)
+        db.close()
+
+    write_times = []
+    errors = []
+    lock = threading.Lock()
+
+    def writer():
+        for _ in range(writes // writers):
+            db = SessionLocal()
+            t = time.perf_counter()
+            try:
+                crud.save_turn(db, random.choice(session_ids), "question", "answer")
+                with lock:
+                    write_times.append(time.perf_counter() - t)
+            except OperationalError as e:
+                db.rollback()
+                with lock:
+                    errors.append(str(e.orig))
+            finally:
+                db.close()
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    return {"history_fetch": percentiles(read_times),
+            "insert_turn": percentiles(write_times) if write_times else None,
+            "write_errors": len(errors)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=20_000)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--writes", type=int, default=400)
+    parser.add_argument("--writers", type=int, default=4, help="concurrent writer threads")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    t = time.perf_counter()
+    session_ids = seed(path, args.messages, args.sessions)
+    print(f"seeded {args.messages} messages in {time.perf_counter() - t:.1f}s")
+
+    # before: default engine and no index
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    before = measure(sessionmaker(bind=engine), session_ids, args.reads, args.writes, args.writers)
+    engine.dispose()
+
+    # after: tuned engine, schema upgraded by the app migration
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    tune_sqlite(engine)
+    t = time.perf_counter()
+    migrations.upgrade(engine)
+    migration_seconds = time.perf_counter() - t
+    after = measure(sessionmaker(bind=engine), session_ids, args.reads, args.writes, args.writers)
+    engine.dispose()
+
+    print(json.dumps({"messages": args.messages, "sessions": args.sessions,
+                      "migration_seconds": round(migration_seconds, 2),
+                      "before": before, "after": after}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""Load test of the chat API with latency percentiles as JSON.
+
+At each concurrency level, that many virtual users run sessions side by
+side. A session starts a chat, continues it --turns times, then reads its
+history and the session list. The report gives, per level, the throughput
+and the p50/p95/p99 latency of each endpoint, the time to first token
+with --stream, and the server side stages from /health (queue wait, tool
+and search times, counted since the server started).
+
+By default the app runs in process with the fake model and fake search of
+utils/fakes.py and a temporary database. With --url the requests
+go to a running server instead, e.g. one started with
+
+    CHATBOT_MODEL_PROVIDER=fake CHATBOT_FAKE_SEARCH=1 uvicorn api.main:app
+
+    cd backend
+    python -m benchmarks.load_test --concurrency 1,8,32 --output run.json
+    python -m benchmarks.load_test --baseline run.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+# isolated database, set before the app is imported
+_tmp_dir = tempfile.mkdtemp()
+os.environ.setdefault("CHATBOT_DATABASE_URL", f"sqlite:///{_tmp_dir}/load_test.db")
+
+import httpx
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """nearest-rank percentile"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(1000 * sum(values) / len(values), 2),
+        "p50_ms": round(1000 * percentile(values, 50), 2),
+        "p95_ms": round(1000 * percentile(values, 95), 2),
+        "p99_ms": round(1000 * percentile(values, 99), 2),
+        "max_ms": round(1000 * max(values), 2),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def add(self, stage: str, seconds: float, ok: bool = True):
+        if ok:
+            self.latencies[stage].append(seconds)
+        else:
+            self.errors[stage] += 1
+
+
+async def timed(recorder: Recorder, stage: str, request) -> Optional[httpx.Response]:
+    start = time.perf_counter()
+    try:
+        resp = await request
+    except httpx.HTTPError:
+        recorder.add(stage, 0, ok=False)
+        return None
+    recorder.add(stage, time.perf_counter() - start, resp.status_code < 400)
+    return resp if resp.status_code < 400 else None
+
+async def stream_turn(client: httpx.AsyncClient, recorder: Recorder, stage: str,
+                      path: str, user_input: str) -> Optional[str]:
+    """send a turn to a streaming endpoint, return the session id"""
+    start = time.perf_counter()
+    first_token = None
+    session_id = None
+    event = None
+    try:
+        async with client.stream("POST", path, json={"user_input": user_input}) as resp:
+            if resp.status_code >= 400:
+                recorder.add(stage, 0, ok=False)
+                return None
+            async for line in resp.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    if event == "token" and first_token is None:
+                        first_token = time.perf_counter() - start
+                    elif event == "done":
+                        session_id = json.loads(line[len("data: "):])["session_id"]
+    except httpx.HTTPError:
+        session_id = None
+    recorder.add(stage, time.perf_counter() - start, session_id is not None)
+    if first_token is not None:
+        recorder.add("ttft", first_token)
+    return session_id
+
+async def run_session(client: httpx.AsyncClient, recorder: Recorder, user: int, index: int,
+                      turns: int, stream: bool):
+    question = f"user {user} session {index} question"
+    if stream:
+        session_id = await stream_turn(client, recorder, "start", "/chat/start/stream", question)
+    else:
+        resp = await timed(recorder, "start", client.post("/chat/start", json={"user_input": question}))
+        session_id = resp.json()["session_id"] if resp is not None else None
+    if session_id is None:
+        return
+
+    for turn in range(turns):
+        follow_up = f"{question} follow up {turn}"
+        if stream:
+            await stream_turn(client, recorder, "continue", f"/chat/{session_id}/continue/stream", follow_up)
+        else:
+            await timed(recorder, "continue",
+                        client.post(f"/chat/{session_id}/continue", json={"user_input": follow_up}))
+
+    await timed(recorder, "history", client.get(f"/chat/{session_id}/history"))
+    await timed(recorder, "sessions", client.get("/chat/sessions", params={"limit": 50}))
+
+async def run_user(client: httpx.AsyncClient, recorder: Recorder, user: int,
+                   sessions: int, turns: int, stream: bool):
+    for index in range(sessions):
+        await run_session(client, recorder, user, index, turns, stream)
+
+def server_stages(health: dict) -> dict:
+    """the server side timings reported by /health"""
+    return {
+        "scheduler": health.get("scheduler"),
+        "tools": health.get("tools"),
+        "search": health.get("search"),
+        "writer": health.get("writer"),
+    }
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, sessions: int,
+                    turns: int, stream: bool) -> dict:
+    recorder = Recorder()
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        run_user(client, recorder, user, sessions, turns, stream) for user in range(concurrency)
+    ])
+    duration = time.perf_counter() - start
+    health = (await client.get("/health")).json()
+
+    # ttft is a part of a streamed turn, not a request of its own
+    everything = [t for stage, values in recorder.latencies.items() if stage != "ttft" for t in values]
+    requests = len(everything) + sum(recorder.errors.values())
+    chat_turns = len(recorder.latencies.get("start", [])) + len(recorder.latencies.get("continue", []))
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(duration, 3),
+        "requests": requests,
+        "errors": dict(recorder.errors),
+        "throughput_rps": round(requests / duration, 2),
+        "turns_per_s": round(chat_turns / duration, 2),
+        "latency": {"all": summarize(everything),
+                    **{stage: summarize(values) for stage, values in sorted(recorder.latencies.items())}},
+        "server": server_stages(health),
+    }
+
+async def setup_in_process(args):
+    """the app with the fake model and fake search, no Ollama needed"""
+    from api.main import app
+    from api.scheduler import TurnScheduler
+    from api.persistence import TurnWriter
+    from api.archive import ArchiveJob
+    from core.graph import ChatGraph
+    from tools.web_search import search_service
+    from utils.fakes import FakeChatModel, install_fake_search
+
+    model = FakeChatModel(delay=args.delay, token_delay=args.token_delay,
+                          response_tokens=args.response_tokens, tool_rate=args.tool_rate)
+    install_fake_search(search_service, args.search_delay)
+    app.state.graph = ChatGraph(model=model)
+    app.state.graph_build_seconds = 0.0
+    app.state.scheduler = TurnScheduler(**({"max_concurrent": args.max_concurrent_turns}
+                                           if args.max_concurrent_turns else {}))
+    app.state.writer = TurnWriter(args.write_mode)
+    await app.state.writer.start()
+    app.state.archiver = ArchiveJob(after_days=0) # not started, only for /health
+    return httpx.ASGITransport(app=app)
+
+def compare(report: dict, baseline: dict):
+    """print the p95 change per endpoint against a previous run"""
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in report["levels"]:
+        old = previous.get(level["concurrency"])
+        if old is None:
+            continue
+        for stage, stats in level["latency"].items():
+            before = old["latency"].get(stage, {}).get("p95_ms")
+            if before and stats.get("p95_ms"):
+                change = 100 * (stats["p95_ms"] - before) / before
+                print(f"c={level['concurrency']:<4} {stage:<9} p95 {before:>9.1f}ms -> "
+                      f"{stats['p95_ms']:>9.1f}ms ({change:+.1f}%)", file=sys.stderr)
+
+async def main(args) -> int:
+    transport = None if args.url else await setup_in_process(args)
+    base_url = args.url or "http://test"
+    levels = [int(c) for c in args.concurrency.split(",")]
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+        results = [await run_level(client, c, args.sessions, args.turns, args.stream) for c in levels]
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "levels": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+    return 0 if not any(level["errors"] for level in results) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated virtual users per level")
+    parser.add_argument("--sessions", type=int, default=3, help="sessions per virtual user")
+    parser.add_argument("--turns", type=int, default=2, help="continue calls per session")
+    parser.add_argument("--stream", action="store_true", help="use the streaming endpoints, reports ttft")
+    parser.add_argument("--url", help="running server to test instead of the in-process app")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--delay", type=float, default=0.2, help="fake model time to first token")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="fake model seconds per token")
+    parser.add_argument("--response-tokens", type=int, default=50)
+    parser.add_argument("--tool-rate", type=float, default=0.3, help="share of turns calling the search tool")
+    parser.add_argument("--search-delay", type=float, default=0.1, help="fake search latency")
+    parser.add_argument("--max-concurrent-turns", type=int, help="scheduler limit, its default when omitted")
+    parser.add_argument("--write-mode", default="direct", choices=["direct", "group", "buffered"],
+                        help="how the in-process app writes turns, see api/persistence.py")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="previous JSON report to compare the p95 latencies with")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))
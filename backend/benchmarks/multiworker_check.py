@@ -0,0 +1,189 @@
+"""Turn ordering check across uvicorn workers and hosts.
+
+Starts the API with `uvicorn --workers N` on the fake model and temporary
+databases, --hosts times on as many ports, starts one session, then fires
+concurrent turns at it spread over the hosts, which their workers pick up
+side by side. Checks afterwards:
+ - every turn succeeded
+ - the history is numbered 1, 2, ... (seq) with no gap or duplicate, and
+   alternates user and ai messages: no two turns interleaved
+ - the graph checkpoint of the session has the user messages of the
+   history, in the same order: each turn ran on the state left by the
+   previous one, none was lost
+
+With --no-locks the session leases are disabled to show what they prevent,
+the checkpoint check is then expected to fail. The script exits non-zero
+when a check fails.
+
+The hosts share a SQLite file by default, which only works on one machine.
+Several machines share a server database: --database-url runs the check
+against one (postgresql+psycopg://..., the sessions, leases and
+checkpoints then all live there, in a database left to the check), and
+--pgserver stands one in locally, a throwaway PostgreSQL started with the
+pgserver package (pip install pgserver psycopg[binary]
+langgraph-checkpoint-postgres).
+
+    cd backend
+    python -m benchmarks.multiworker_check --workers 4 --turns 40
+    python -m benchmarks.multiworker_check --pgserver --hosts 2 --workers 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+os.environ.setdefault("CHATBOT_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/multiworker_check.db")
+
+from api.checkpoints import open_checkpointer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_pgserver(tmp: str) -> str:
+    """a local PostgreSQL in tmp, stopped when this process exits, returns
+    the URL of an empty database"""
+    import pgserver
+    server = pgserver.get_server(os.path.join(tmp, "pgdata"), cleanup_mode="stop")
+    server.psql("CREATE DATABASE chatbot;")
+    return server.get_uri("chatbot").replace("postgresql://", "postgresql+psycopg://", 1)
+
+def start_server(tmp: str, database_url: str, checkpoint_url: str, port: int, workers: int,
+                 locks: bool) -> subprocess.Popen:
+    env = {**os.environ,
+           "CHATBOT_MODEL_PROVIDER": "fake",
+           "CHATBOT_FAKE_SEARCH": "1",
+           "CHATBOT_MODEL_WARMUP": "0",
+           "CHATBOT_SESSION_LOCKS": "1" if locks else "0",
+           "CHATBOT_DATABASE_URL": database_url,
+           "CHATBOT_CHECKPOINT_URL": checkpoint_url,
+           "CHATBOT_RESPONSE_CACHE_DB_PATH": os.path.join(tmp, f"response_cache_{port}.db"),
+           "FAKE_LLM_DELAY": "0.05",
+           "FAKE_LLM_TOKEN_DELAY": "0",
+           "FAKE_LLM_RESPONSE_TOKENS": "5"}
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(port),
+                             "--workers", str(workers), "--log-level", "warning"],
+                            cwd=BACKEND_DIR, env=env)
+
+async def wait_ready(client: httpx.AsyncClient, workers: int, timeout: float = 60) -> set:
+    """wait until the workers answer, returns the pids seen on /health"""
+    deadline = time.monotonic() + timeout
+    pids = set()
+    while time.monotonic() < deadline:
+        try:
+            replies = await asyncio.gather(*(client.get("/health") for _ in range(4 * workers)))
+            pids |= {reply.json()["worker"] for reply in replies if reply.status_code == 200}
+            if len(pids) >= workers:
+                return pids
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    return pids
+
+async def fire_turns(urls: list, session_id: str, turns: int) -> list:
+    async def turn(i: int):
+        # one connection per turn, over the hosts in turn, then over the
+        # workers of a host by the kernel
+        async with httpx.AsyncClient(base_url=urls[i % len(urls)], timeout=120) as client:
+            reply = await client.post(f"/chat/{session_id}/continue", json={"user_input": f"turn {i}"})
+            return reply.status_code
+    return await asyncio.gather(*(turn(i) for i in range(turns)))
+
+async def checkpoint_inputs(url: str, session_id: str) -> list:
+    async with open_checkpointer(url) as checkpointer:
+        saved = await checkpointer.aget_tuple({"configurable": {"thread_id": session_id}})
+    messages = saved.checkpoint["channel_values"].get("messages", []) if saved else []
+    return [message.content for message in messages if message.type == "human"]
+
+async def check(args) -> dict:
+    tmp = tempfile.mkdtemp()
+    if args.pgserver:
+        database_url = start_pgserver(tmp)
+    else:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'sessions.db')}"
+    # the sessions server keeps the checkpoints too
+    checkpoint_url = database_url if not database_url.startswith("sqlite") else os.path.join(tmp, "checkpoints.db")
+
+    ports = [free_port() for _ in range(args.hosts)]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    servers = []
+    try:
+        for port in ports:
+            servers.append(start_server(tmp, database_url, checkpoint_url, port, args.workers,
+                                        not args.no_locks))
+            # the first host creates the schema, the others start on it
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+                pids = await wait_ready(client, args.workers)
+        async with httpx.AsyncClient(base_url=urls[0], timeout=120) as client:
+            reply = await client.post("/chat/start", json={"user_input": "start"})
+            reply.raise_for_status()
+            session_id = reply.json()["session_id"]
+
+            start = time.perf_counter()
+            statuses = await fire_turns(urls, session_id, args.turns)
+            seconds = time.perf_counter() - start
+
+            history = (await client.get(f"/chat/{session_id}/history")).json()
+        locks = []
+        for url in urls:
+            async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+                locks.append((await client.get("/health")).json()["scheduler"]["session_locks"])
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.wait(30)
+
+    seqs = [message["seq"] for message in history]
+    roles = [message["role"] for message in history]
+    user_inputs = [message["content"] for message in history if message["role"] == "user"]
+    checkpoint = await checkpoint_inputs(checkpoint_url, session_id)
+    checks = {
+        "all_turns_ok": all(status == 200 for status in statuses),
+        "all_turns_saved": len(user_inputs) == args.turns + 1,
+        "seq_contiguous": seqs == list(range(1, len(seqs) + 1)),
+        "turns_not_interleaved": roles == ["user", "ai"] * (len(roles) // 2),
+        # the oldest messages may have been summarized away
+        "checkpoint_matches_history": bool(checkpoint) and user_inputs[-len(checkpoint):] == checkpoint,
+    }
+    return {
+        "database": database_url.split(":", 1)[0],
+        "hosts": args.hosts,
+        "workers": args.workers,
+        "workers_seen_on_last_host": len(pids),
+        "session_locks": not args.no_locks,
+        "turns": args.turns,
+        "seconds": round(seconds, 2),
+        "statuses": {str(status): statuses.count(status) for status in sorted(set(statuses))},
+        "lock_stats_of_a_worker_per_host": locks,
+        "checks": checks,
+        "ok": all(checks.values()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="workers per host")
+    parser.add_argument("--hosts", type=int, default=1, help="uvicorn servers sharing the databases")
+    parser.add_argument("--database-url", help="server database shared by the hosts, SQLite files by default")
+    parser.add_argument("--pgserver", action="store_true", help="run on a throwaway local PostgreSQL")
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--no-locks", action="store_true", help="run without session leases")
+    args = parser.parse_args()
+
+    report = asyncio.run(check(args))
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Check the Ollama pool against local stub servers.
+
+ - concurrent calls are spread over the backends within their limits
+ - a session keeps using the same backend
+ - when a backend goes down, calls fail over to the others
+ - the health check brings it back once it is up again
+
+The script exits 1 when a check fails, so CI can run it.
+
+    cd backend
+    python -m benchmarks.pool_check --backends 3 --calls 30
+"""
+import argparse
+import asyncio
+import sys
+import time
+from langchain_core.messages import HumanMessage
+from utils.model_pool import OllamaPool, PooledChatOllama, session_affinity
+from benchmarks.stub_ollama import StubOllama
+
+
+async def call(model: PooledChatOllama, session_id: str):
+    session_affinity.set(session_id)
+    return await model.ainvoke([HumanMessage(content=f"hello from {session_id}")])
+
+async def main(backends: int, calls: int, delay: float, max_concurrency: int) -> int:
+    stubs = [StubOllama(delay=delay).start() for _ in range(backends)]
+    pool = OllamaPool([s.url for s in stubs], "stub", 0.0,
+                      max_concurrency=max_concurrency, health_interval=0.5)
+    pool.start()
+    model = PooledChatOllama(pool=pool)
+    checks = {}
+
+    # spread and concurrency limits
+    start = time.perf_counter()
+    await asyncio.gather(*[call(model, f"session-{i}") for i in range(calls)])
+    elapsed = time.perf_counter() - start
+    spread = [s.requests for s in stubs]
+    expected = delay * calls / (backends * max_concurrency)
+    print(f"{calls} calls in {elapsed:.2f}s (limit-bound minimum {expected:.2f}s), per backend: {spread}")
+    checks["calls spread within the limits"] = min(spread) > 0 and elapsed >= expected * 0.9
+
+    # session affinity
+    before = [s.requests for s in stubs]
+    for _ in range(5):
+        await call(model, "session-0")
+    used = [s.requests - b for s, b in zip(stubs, before)]
+    print(f"5 turns of one session, per backend: {used}")
+    checks["session kept on its backend"] = sorted(used) == [0] * (backends - 1) + [5]
+
+    # failover
+    stubs[0].stop()
+    results = await asyncio.gather(*[call(model, f"session-{i}") for i in range(calls)], return_exceptions=True)
+    failures = [r for r in results if isinstance(r, Exception)]
+    print(f"backend {stubs[0].url} stopped: {len(failures)} failed calls, pool: {pool.stats()}")
+    checks["calls failed over"] = not failures and not pool.stats()[0]["healthy"]
+
+    # recovery by the health check, within a few of its rounds
+    revived = StubOllama(port=int(stubs[0].url.rsplit(":", 1)[1]), delay=delay).start()
+    start = time.perf_counter()
+    while not pool.stats()[0]["healthy"] and time.perf_counter() - start < 5.0:
+        await asyncio.sleep(0.1)
+    print(f"backend restarted, healthy: {pool.stats()[0]['healthy']} "
+          f"after {time.perf_counter() - start:.1f}s")
+    checks["backend back once up"] = pool.stats()[0]["healthy"]
+
+    pool.stop()
+    revived.stop()
+    for stub in stubs[1:]:
+        stub.stop()
+    for name, passed in checks.items():
+        print(f"{'OK' if passed else 'FAIL'}: {name}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--calls", type=int, default=30)
+    parser.add_argument("--delay", type=float, default=0.2)
+    parser.add_argument("--max-concurrency", type=int, default=2)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.backends, args.calls, args.delay, args.max_concurrency)))
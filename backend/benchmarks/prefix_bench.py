@@ -0,0 +1,255 @@
+"""Prompt prefix benchmark: prompt tokens evaluated again at every turn.
+
+A stub Ollama server keeps the evaluated prompt of its last requests, as
+the KV cache of its slots, and only evaluates a new prompt from the first
+token where it differs from the closest of them; a prompt over the
+context window (num_ctx, 2048 when the request has none, as Ollama) is
+truncated from its start first, and a request with other options reloads
+the model and empties the slots. Tokens are 4 characters of the rendered
+tools and messages, each evaluated token costs --prompt-token-delay.
+
+Sessions of several turns (questions, searches with long results,
+follow-ups) run interleaved through the graph with a real ChatOllama:
+ - before: the tool results trimmed in a sliding window of the last
+   messages, a direct path with its own system prompt and no tool
+   schemas, and no num_ctx nor keep_alive in the calls
+ - after: the current context policy, prompts and model options
+Reported as JSON per run: prompt tokens sent and evaluated per turn, the
+share reused from the cache, turn latency, model reloads and the prefix
+results counted by the graph. The run fails when a prompt of the after
+run does not extend the previous one of its session ("changed" above 0),
+whatever the router sends each turn to.
+
+    cd backend
+    python -m benchmarks.prefix_bench --sessions 4 --turns 12
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("CHATBOT_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/prefix_bench.db")
+
+from langchain_core.messages import BaseMessage, SystemMessage, ToolMessage
+from langchain_ollama import ChatOllama
+from benchmarks.db_bench import percentiles
+from benchmarks.stub_ollama import StubOllama
+from core.context import ContextPolicy
+from core.graph import ChatGraph
+from core.nodes import ChatNode
+from tools.web_search import search_service
+from utils.model_provider import load_model
+from typing import List, Optional, Sequence
+
+CHARS_PER_TOKEN = 4
+OLLAMA_DEFAULT_NUM_CTX = 2048
+NUM_KEEP = 4  # tokens kept at the start of a truncated prompt
+
+# the direct path had its own system prompt before
+LEGACY_DIRECT_PROMPT = """You are a helpful assistant that interact with users. 
+Answer from the conversation and your own knowledge. Stay consistent and 
+respond effectively and efficiently to users need."""
+
+QUERIES = [
+    "tell me about topic {i}",
+    "search for recent news about topic {i}",
+    "what does it mean for the people working on it",
+    "why?",
+    "search for the history of topic {i}",
+    "explain the second point in more detail",
+    "and how does it compare with its alternatives",
+    "summarize it",
+]
+
+
+class KVCacheStub(StubOllama):
+    """StubOllama with a prompt cache per slot"""
+    def __init__(self, slots: int = 4, prompt_token_delay: float = 0.0002, load_delay: float = 0.5,
+                 answer_words: int = 80, **kwargs):
+        super().__init__(**kwargs)
+        self.slots: List[List[str]] = []  # most recently used last
+        self.max_slots = slots
+        self.prompt_token_delay = prompt_token_delay
+        self.load_delay = load_delay
+        self.answer_words = answer_words
+        self.options = None
+        self.loads = 0
+        self.calls: List[dict] = []
+        self.cache_lock = threading.Lock()
+
+    def answer(self, body: dict) -> str:
+        if self.tool_calls(body):
+            return ""
+        seed = len(body.get("messages", []))
+        return " ".join(f"word{(seed * 7 + i) % 97}" for i in range(self.answer_words))
+
+    def tool_calls(self, body: dict) -> list:
+        messages = body.get("messages", [])
+        if not body.get("tools") or not messages or messages[-1].get("role") != "user":
+            return []
+        query = messages[-1].get("content", "")
+        if "search" not in query.lower():
+            return []
+        return [{"function": {"name": "ddg_search_tool", "arguments": {"query": query}}}]
+
+    @staticmethod
+    def tokens(body: dict) -> List[str]:
+        """the prompt as the chat template renders it, cut in tokens"""
+        text = json.dumps(body.get("tools") or [], sort_keys=True)
+        for message in body.get("messages", []):
+            text += f"<|{message.get('role')}|>{message.get('content', '')}"
+            if message.get("tool_calls"):
+                text += json.dumps(message["tool_calls"], sort_keys=True)
+        return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+    def prompt_eval(self, body: dict) -> dict:
+        tokens = self.tokens(body)
+        options = body.get("options") or {}
+        num_ctx = options.get("num_ctx") or OLLAMA_DEFAULT_NUM_CTX
+        sent = len(tokens)
+        if len(tokens) > num_ctx:
+            # context shift: the oldest tokens after the first ones are dropped
+            tokens = tokens[:NUM_KEEP] + tokens[len(tokens) - num_ctx + NUM_KEEP:]
+
+        key = json.dumps(options, sort_keys=True)
+        with self.cache_lock:
+            reload = self.options is not None and key != self.options
+            if self.options is None or reload:
+                self.loads += 1
+                self.slots = []
+            self.options = key
+            best, reused = None, 0
+            for slot in self.slots:
+                common = 0
+                for a, b in zip(slot, tokens):
+                    if a != b:
+                        break
+                    common += 1
+                if common > reused:
+                    best, reused = slot, common
+            if best is not None and reused == len(best):
+                # extended: the slot goes on from its prompt
+                self.slots.remove(best)
+            elif len(self.slots) >= self.max_slots:
+                # the common prefix is copied to the least recently used slot
+                self.slots.pop(0)
+            self.slots.append(tokens)
+        # the last token is always evaluated, to sample the answer
+        evaluated = len(tokens) - min(reused, len(tokens) - 1)
+        seconds = evaluated * self.prompt_token_delay + (self.load_delay if reload else 0.0)
+        time.sleep(seconds)
+        with self.cache_lock:
+            self.calls.append({"sent": sent, "evaluated": evaluated, "truncated": sent > len(tokens)})
+        return {"prompt_eval_count": evaluated, "prompt_eval_duration": int(seconds * 1e9)}
+
+
+class LongSearch:
+    """offline search answering with a long result, which the context
+    policy trims at a later turn"""
+    def __init__(self, chars: int = 4000):
+        self.chars = chars
+
+    def __call__(self, query: str) -> str:
+        line = f"Result about {query}: a long paragraph of search snippets. "
+        return (line * (self.chars // len(line) + 1))[:self.chars]
+
+
+class WindowContextPolicy(ContextPolicy):
+    """the earlier policy: tool results trimmed once they left the window
+    of the last `recent_messages` messages, which moves at every turn"""
+    def build_prompt(self, system_message: SystemMessage, summary: Optional[str],
+                     messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        prompt = [system_message]
+        if summary:
+            prompt.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
+        recent_start = self._recent_start(messages)
+        for i, message in enumerate(messages):
+            if isinstance(message, SystemMessage):
+                continue
+            if isinstance(message, ToolMessage) and i < recent_start:
+                message = self.trim_tool_result(message)
+            prompt.append(message)
+        return prompt
+
+
+def build_graph(stub: KVCacheStub, before: bool) -> ChatGraph:
+    if before:
+        model = ChatOllama(base_url=stub.url, model="stub", temperature=0.0)
+        graph = ChatGraph(model=model)
+        policy = WindowContextPolicy(token_budget=graph.context_policy.token_budget)
+        # the nodes are called through the compiled graph, the direct one
+        # is updated in place
+        legacy = ChatNode(system_prompt=LEGACY_DIRECT_PROMPT, tools=[], model=model,
+                          context_policy=policy, prefix_tracker=graph.prefix_tracker)
+        graph.direct_node.__dict__.update(legacy.__dict__)
+        for node in (graph.chat_node, graph.summary_node):
+            node.context_policy = policy
+        return graph
+    return ChatGraph(model=load_model(stub.url, "stub", 0.0))
+
+async def run(args, before: bool) -> dict:
+    stub = KVCacheStub(slots=args.slots, prompt_token_delay=args.prompt_token_delay,
+                       answer_words=args.answer_words, delay=0.0).start()
+    try:
+        graph = build_graph(stub, before)
+        turns, times = [], []
+        for turn in range(args.turns):
+            for i in range(args.sessions):
+                config = {"configurable": {"thread_id": f"session-{i}"}, "recursion_limit": 50}
+                query = QUERIES[turn % len(QUERIES)].format(i=i)
+                first_call = len(stub.calls)
+                start = time.perf_counter()
+                await graph.ainvoke({"messages": [{"role": "user", "content": query}]}, config)
+                times.append(time.perf_counter() - start)
+                calls = stub.calls[first_call:]
+                turns.append({"sent": sum(c["sent"] for c in calls),
+                              "evaluated": sum(c["evaluated"] for c in calls),
+                              "truncated": any(c["truncated"] for c in calls)})
+    finally:
+        stub.stop()
+
+    sent = sum(t["sent"] for t in turns)
+    evaluated = sum(t["evaluated"] for t in turns)
+    # the first turn of a session has nothing to reuse
+    later = turns[args.sessions:]
+    return {
+        "router": graph.router.mode,
+        "turns": len(turns),
+        "model_calls": len(stub.calls),
+        "prompt_tokens_sent_per_turn": round(sent / len(turns)),
+        "prompt_tokens_evaluated_per_turn": round(evaluated / len(turns)),
+        "evaluated_per_later_turn": round(sum(t["evaluated"] for t in later) / max(len(later), 1)),
+        "reused_share": round(1 - evaluated / sent, 3) if sent else 0.0,
+        "truncated_turns": sum(t["truncated"] for t in turns),
+        "model_loads": stub.loads,
+        "turn_latency": percentiles(times),
+        "prefix_tracker": graph.prefix_tracker.stats(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=4, help="sessions run side by side")
+    parser.add_argument("--turns", type=int, default=12, help="turns per session")
+    parser.add_argument("--slots", type=int, default=4, help="prompt caches of the stub server (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--prompt-token-delay", type=float, default=0.0002, help="prefill seconds per evaluated token")
+    parser.add_argument("--answer-words", type=int, default=80)
+    parser.add_argument("--search-chars", type=int, default=4000, help="size of a search result")
+    args = parser.parse_args()
+
+    for name in ("ddg", "google"):
+        search_service.register(name, lambda: LongSearch(args.search_chars))
+    report = {"before": asyncio.run(run(args, before=True)),
+              "after": asyncio.run(run(args, before=False))}
+    print(json.dumps(report, indent=2))
+    changed = report["after"]["prefix_tracker"]["results"]["changed"]
+    if changed:
+        print(f"FAIL: {changed} prompts of the after run changed their prefix", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Router benchmark: turn latency and tool calls with and without the router.
+
+Offline, with the fake model (simulated prefill, so the tool schemas in
+the prompt cost time, and a share of the agent turns calling a search)
+and the fake search. Each session starts with an opening question, then
+sends a query of one class: small talk, follow-up, self-contained task,
+fresh facts or open question. The second turn is timed, with the router
+off (every turn through the agent with tools) and with the heuristic
+router, and reported per class as JSON with the tool calls per turn.
+
+    cd backend
+    python -m benchmarks.router_bench --sessions 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault("CHATBOT_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/router_bench.db")
+
+from langchain_core.messages import AIMessage, HumanMessage
+from benchmarks.db_bench import percentiles
+from utils.fakes import FakeChatModel, install_fake_search
+from core.graph import ChatGraph
+from core.router import QueryRouter
+from tools.web_search import search_service
+
+QUERIES = {
+    "small_talk": ["hello!", "thanks a lot", "ok", "good morning", "perfect, thank you"],
+    "follow_up": ["why?", "can you explain that again?", "shorter please", "summarize it", "go on"],
+    "self_contained": ["write a poem about the sea", "solve 3x + 5 = 20", "write a python function to reverse a list",
+                       "draft an email to my landlord", "12 * 37 + 5"],
+    "fresh_facts": ["what is the latest news about the elections?", "weather in Paris tomorrow",
+                    "who won the match yesterday?", "current price of bitcoin", "search for the best laptops of 2025"],
+    "open": ["tell me about pelicans", "how do solar panels work", "what makes a good cup of coffee",
+             "ideas for a birthday party", "how do vaccines train the immune system"],
+}
+
+
+def turn_tool_calls(messages) -> int:
+    calls = 0
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, AIMessage):
+            calls += len(message.tool_calls)
+    return calls
+
+async def run(mode: str, model: FakeChatModel, sessions: int) -> dict:
+    graph = ChatGraph(model=model, router=QueryRouter(mode=mode))
+    report = {}
+    for name, queries in QUERIES.items():
+        times, calls = [], []
+        for i in range(sessions):
+            config = {"configurable": {"thread_id": f"{mode}-{name}-{i}"}, "recursion_limit": 50}
+            await graph.ainvoke({"messages": [{"role": "user", "content": f"tell me about topic {i}"}]}, config)
+            start = time.perf_counter()
+            output = await graph.ainvoke({"messages": [{"role": "user", "content": queries[i % len(queries)]}]},
+                                         config)
+            times.append(time.perf_counter() - start)
+            calls.append(turn_tool_calls(output["messages"]))
+        report[name] = {**percentiles(times), "tool_calls_per_turn": round(sum(calls) / len(calls), 2)}
+    report["decisions"] = graph.router.stats()["decisions"]
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="sessions per query class")
+    parser.add_argument("--delay", type=float, default=0.2, help="model time to first token, without prefill")
+    parser.add_argument("--prompt-token-delay", type=float, default=0.0005, help="prefill seconds per prompt token")
+    parser.add_argument("--tool-rate", type=float, default=0.5, help="share of agent turns calling a search")
+    parser.add_argument("--search-delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    install_fake_search(search_service, args.search_delay)
+    model = FakeChatModel(delay=args.delay, token_delay=0.005, response_tokens=40,
+                          tool_rate=args.tool_rate, prompt_token_delay=args.prompt_token_delay)
+    tool_schema_tokens = model.bind_tools(ChatGraph(model=model).tools).tool_schema_tokens
+    report = {"tool_schema_tokens": tool_schema_tokens,
+              "router_off": asyncio.run(run("off", model, args.sessions)),
+              "heuristic": asyncio.run(run("heuristic", model, args.sessions))}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Check the admission control of the chat endpoints.
+
+Chats are sent to the app, backed by a model that answers after a fixed
+delay, with a small scheduler in front of the graph. The script checks
+that:
+- no more than --max-concurrent turns run at once
+- requests above the queue size get a 429 with a Retry-After header
+- two messages sent at once to one session run one after the other
+- a session sending many messages does not delay the other sessions
+
+The script exits 1 when a check fails, so CI can run it.
+
+    cd backend
+    python -m benchmarks.scheduler_check --delay 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# isolated database, set before the app is imported
+_tmp_dir = tempfile.mkdtemp()
+os.environ.setdefault("CHATBOT_DATABASE_URL", f"sqlite:///{_tmp_dir}/scheduler.db")
+
+import httpx
+from pydantic import Field
+from api.main import app
+from api.scheduler import TurnScheduler
+from api.persistence import TurnWriter
+from core.graph import ChatGraph
+from utils.fakes import FakeChatModel
+
+
+class Concurrency:
+    """calls running at once, shared by a model and its copies"""
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+
+class CountingModel(FakeChatModel):
+    """fake model recording how many calls run at once, bind_tools returns
+    a copy which counts on the same Concurrency"""
+    concurrency: Concurrency = Field(default_factory=Concurrency)
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    @property
+    def peak(self) -> int:
+        return self.concurrency.peak
+
+    async def _agenerate(self, *args, **kwargs):
+        self.concurrency.running += 1
+        self.concurrency.peak = max(self.concurrency.peak, self.concurrency.running)
+        try:
+            return await super()._agenerate(*args, **kwargs)
+        finally:
+            self.concurrency.running -= 1
+
+
+async def check_limit(client, model, max_concurrent: int, max_queued: int) -> bool:
+    n = max_concurrent + max_queued + 3
+    responses = await asyncio.gather(*[
+        client.post("/chat/start", json={"user_input": f"question {i}"}) for i in range(n)
+    ])
+    codes = [r.status_code for r in responses]
+    rejected = [r for r in responses if r.status_code == 429]
+    ok = (0 < model.peak <= max_concurrent
+          and codes.count(200) == max_concurrent + max_queued
+          and len(rejected) == 3
+          and all(r.headers.get("retry-after") for r in rejected))
+    print(f"limit: peak {model.peak}/{max_concurrent} running, {codes.count(200)} served, "
+          f"{len(rejected)} rejected with Retry-After {rejected[0].headers.get('retry-after') if rejected else None}")
+    return ok
+
+async def reached_scheduler(scheduler: TurnScheduler, turns: int, timeout: float = 5.0):
+    """wait until this many turns were admitted or queued"""
+    deadline = time.perf_counter() + timeout
+    while scheduler.admitted + scheduler.queued < turns and time.perf_counter() < deadline:
+        await asyncio.sleep(0.001)
+
+async def check_session_order(client, delay: float) -> bool:
+    session_id = (await client.post("/chat/start", json={"user_input": "hello"})).json()["session_id"]
+    scheduler = app.state.scheduler
+    start = time.perf_counter()
+    turns = []
+    for i in range(3):
+        # sent while the previous ones are still running, each once the
+        # previous one is in the scheduler: the order checked is the one
+        # they arrived in, not the one of their requests
+        arrived = scheduler.admitted + scheduler.queued
+        turns.append(asyncio.create_task(
+            client.post(f"/chat/{session_id}/continue", json={"user_input": f"message {i}"})))
+        await reached_scheduler(scheduler, arrived + 1)
+    await asyncio.gather(*turns)
+    elapsed = time.perf_counter() - start
+    history = (await client.get(f"/chat/{session_id}/history")).json()
+    users = [m["content"] for m in history if m["role"] == "user"]
+    ok = users == ["hello", "message 0", "message 1", "message 2"] and elapsed >= 3 * delay
+    print(f"session order: {users} in {elapsed:.2f}s (3 turns of {delay}s)")
+    return ok
+
+async def check_fairness(client, delay: float) -> bool:
+    """a burst from one session, then one message from another session"""
+    busy = (await client.post("/chat/start", json={"user_input": "hello"})).json()["session_id"]
+    burst = [asyncio.create_task(client.post(f"/chat/{busy}/continue", json={"user_input": f"burst {i}"}))
+             for i in range(4)]
+    await asyncio.sleep(delay / 4)
+    start = time.perf_counter()
+    await client.post("/chat/start", json={"user_input": "other session"})
+    other = time.perf_counter() - start
+    await asyncio.gather(*burst)
+    ok = other < 2 * delay
+    print(f"fairness: other session answered in {other:.2f}s while a session had 4 turns queued")
+    return ok
+
+async def main(delay: float, max_concurrent: int, max_queued: int) -> int:
+    model = CountingModel(delay=delay)
+    app.state.graph = ChatGraph(model=model)
+    app.state.scheduler = TurnScheduler(max_concurrent=max_concurrent, max_queued=max_queued)
+    app.state.writer = TurnWriter()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        checks = {
+            "limit and rejections": await check_limit(client, model, max_concurrent, max_queued),
+            "turns of a session in order": await check_session_order(client, delay),
+            "fairness between sessions": await check_fairness(client, delay),
+        }
+    print(f"scheduler: {app.state.scheduler.stats()}")
+    for name, passed in checks.items():
+        print(f"{'OK' if passed else 'FAIL'}: {name}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delay", type=float, default=0.2, help="fake model latency in seconds")
+    parser.add_argument("--max-concurrent", type=int, default=2)
+    parser.add_argument("--max-queued", type=int, default=4)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.delay, args.max_concurrent, args.max_queued)))
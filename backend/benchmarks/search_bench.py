@@ -0,0 +1,140 @@
+"""Full-text search benchmark.
+
+A temporary SQLite file is seeded with messages made of words drawn from
+a Zipf-like vocabulary, indexed by the app migration (backfill), then
+/chat/search queries are timed: a rare word, a common word, two words,
+a prefix, and the second page of a common word. The cost of the index
+triggers on the write path is measured with crud.save_turn.
+
+    cd backend
+    python -m benchmarks.search_bench --messages 1000000 --sessions 20000
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import uuid
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from api.models import Base
+from api.database import tune_sqlite
+from api import crud, migrations, search
+from benchmarks.db_bench import percentiles
+
+VOCABULARY = [f"w{i}" for i in range(20000)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(VOCABULARY))))
+
+
+def sentence(n_words: int) -> str:
+    return " ".join(random.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=n_words))
+
+def seed(path: str, n_messages: int, n_sessions: int):
+    engine = create_engine(f"sqlite:///{path}")
+    tune_sqlite(engine)
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    session_ids = [str(uuid.uuid4()) for _ in range(n_sessions)]
+    start = datetime.datetime.now() - datetime.timedelta(days=1)
+    conn.executemany("INSERT INTO sessions (id, created_at) VALUES (?, ?)",
+                     [(sid, start) for sid in session_ids])
+    batch = []
+    seqs = dict.fromkeys(session_ids, 0)
+    for i in range(n_messages):
+        sid = random.choice(session_ids)
+        seqs[sid] += 1
+        content = sentence(random.randint(5, 60))
+        batch.append((sid, "user" if i % 2 else "ai", content, content,
+                      start + datetime.timedelta(seconds=i), seqs[sid]))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO messages (session_id, role, content, display_content, created_at, seq) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO messages (session_id, role, content, display_content, created_at, seq) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", batch)
+    conn.executemany("UPDATE sessions SET message_seq = ? WHERE id = ?", [(seq, sid) for sid, seq in seqs.items()])
+    conn.commit()
+    conn.close()
+    return session_ids
+
+def time_queries(SessionLocal, queries: list, pages: int = 1) -> dict:
+    times, hits = [], []
+    for q in queries:
+        db = SessionLocal()
+        t = time.perf_counter()
+        page = search.search_messages(db, q, 20)
+        for _ in range(pages - 1):
+            if not page["next_cursor"]:
+                break
+            page = search.search_messages(db, q, 20, page["next_cursor"])
+        times.append(time.perf_counter() - t)
+        hits.append(len(page["results"]))
+        db.close()
+    return {**percentiles(times), "avg_results": round(sum(hits) / len(hits), 1)}
+
+def time_writes(SessionLocal, session_ids: list, writes: int) -> dict:
+    times = []
+    for _ in range(writes):
+        db = SessionLocal()
+        t = time.perf_counter()
+        crud.save_turn(db, random.choice(session_ids), sentence(20), sentence(60))
+        times.append(time.perf_counter() - t)
+        db.close()
+    return percentiles(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--writes", type=int, default=200)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    t = time.perf_counter()
+    session_ids = seed(path, args.messages, args.sessions)
+    print(f"seeded {args.messages} messages in {time.perf_counter() - t:.1f}s")
+
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    tune_sqlite(engine)
+    SessionLocal = sessionmaker(bind=engine)
+    # writes without the index, as before the migration
+    without_index = time_writes(SessionLocal, session_ids, args.writes)
+    size = os.path.getsize(path)
+
+    t = time.perf_counter()
+    migrations.upgrade(engine)
+    index_seconds = time.perf_counter() - t
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    index_mb = (os.path.getsize(path) - size) / 2**20
+
+    n = args.queries
+    rare = random.choices(VOCABULARY[5000:], k=n)
+    common = random.choices(VOCABULARY[:20], k=n)
+    report = {
+        "messages": args.messages,
+        "index": {"build_seconds": round(index_seconds, 1), "size_mb": round(index_mb, 1)},
+        "search": {
+            "rare_word": time_queries(SessionLocal, rare),
+            "common_word": time_queries(SessionLocal, common),
+            "two_words": time_queries(SessionLocal, [f"{a} {b}" for a, b in zip(common, rare)]),
+            "prefix": time_queries(SessionLocal, [word[:-1] + "*" for word in random.choices(VOCABULARY[100:1000], k=n)]),
+            "common_word_page_2": time_queries(SessionLocal, common, pages=2),
+        },
+        "save_turn": {"without_index": without_index,
+                      "with_index": time_writes(SessionLocal, session_ids, args.writes)},
+    }
+    engine.dispose()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
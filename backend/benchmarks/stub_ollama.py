@@ -0,0 +1,143 @@
+"""Stub Ollama HTTP server for offline runs.
+
+It implements the endpoints used by the backend (/api/tags, /api/chat,
+/api/generate) and answers every chat with a fixed text, streamed word by
+word after a configurable delay. It can also run in a thread from a script:
+
+    server = StubOllama(port=0, delay=0.2).start()
+    server.url  # http://127.0.0.1:<port>
+    server.stop()
+
+    cd backend
+    python -m benchmarks.stub_ollama --port 11434 --delay 0.5
+"""
+import argparse
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOllama:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.1,
+                 token_delay: float = 0.0, response: str = "This is a stub answer."):
+        self.delay = delay
+        self.token_delay = token_delay
+        self.response = response
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubOllama":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def answer(self, body: dict) -> str:
+        """text of the answer, can be overridden"""
+        return self.response
+
+    def tool_calls(self, body: dict) -> list:
+        """tool calls of the answer, in the Ollama format, can be overridden"""
+        return []
+
+    def prompt_eval(self, body: dict) -> dict:
+        """prompt token counts reported in the final chunk, can be overridden"""
+        prompt = json.dumps(body.get("messages", []))
+        return {"prompt_eval_count": len(prompt) // 4, "prompt_eval_duration": 1000 * len(prompt)}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, payload: dict, status: int = 200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._json({"models": [{"name": "stub"}]})
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with stub.lock:
+                    stub.requests += 1
+
+                if self.path == "/api/generate":
+                    # model preload / keep alive
+                    self._json({"model": body.get("model"), "response": "", "done": True})
+                    return
+                if self.path != "/api/chat":
+                    self._json({"error": "not found"}, 404)
+                    return
+
+                time.sleep(stub.delay)
+                text = stub.answer(body)
+                tool_calls = stub.tool_calls(body)
+                words = text.split(" ")
+                created_at = datetime.datetime.utcnow().isoformat() + "Z"
+                final = {
+                    "model": body.get("model"), "created_at": created_at,
+                    "message": {"role": "assistant", "content": ""},
+                    "done": True, "done_reason": "stop",
+                    "total_duration": int((stub.delay + stub.token_delay * len(words)) * 1e9),
+                    "load_duration": 0,
+                    "eval_count": len(words), "eval_duration": int(stub.token_delay * len(words) * 1e9),
+                    **stub.prompt_eval(body),
+                }
+
+                if tool_calls:
+                    final["message"]["tool_calls"] = tool_calls
+
+                if not body.get("stream", True):
+                    final["message"]["content"] = text
+                    self._json(final)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                for i, word in enumerate(words):
+                    chunk = {"model": body.get("model"), "created_at": created_at, "done": False,
+                             "message": {"role": "assistant", "content": word if i == 0 else " " + word}}
+                    self.wfile.write((json.dumps(chunk) + "\n").encode())
+                    self.wfile.flush()
+                    time.sleep(stub.token_delay)
+                self.wfile.write((json.dumps(final) + "\n").encode())
+                self.wfile.flush()
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between tokens")
+    args = parser.parse_args()
+    stub = StubOllama(args.host, args.port, args.delay, args.token_delay)
+    print(f"Stub Ollama listening on {stub.url}")
+    stub.server.serve_forever()
@@ -0,0 +1,77 @@
+"""Compare the ways chat turns are written to SQLite.
+
+N concurrent turns, each with a tool call and its result, are saved
+through the TurnWriter of the app in each write mode, with SQLite
+synchronous NORMAL or FULL. The report gives the turns per second and
+the number of transactions (commits) used.
+
+    cd backend
+    python -m benchmarks.write_bench --turns 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# isolated database, set before the app is imported
+_tmp_dir = tempfile.mkdtemp()
+os.environ.setdefault("CHATBOT_DATABASE_URL", f"sqlite:///{_tmp_dir}/write_bench.db")
+
+from langchain_core.messages import AIMessage, ToolMessage
+from sqlalchemy import text
+from api.database import engine, tune_sqlite, SQLITE_PRAGMAS
+from api.persistence import TurnWriter
+
+
+def turn_messages(i: int):
+    call = {"id": f"call_{i}", "name": "ddg_search_tool", "args": {"query": f"question {i}"}}
+    return [
+        AIMessage(content="", tool_calls=[call]),
+        ToolMessage(content="search results " * 20, tool_call_id=call["id"], name=call["name"]),
+        AIMessage(content="the answer " * 30),
+    ]
+
+async def run(mode: str, turns: int, concurrency: int) -> dict:
+    writer = TurnWriter(mode)
+    await writer.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            await writer.save(f"{mode}-{i}", f"question {i}", turn_messages(i), new_session=True)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(turns)])
+    await writer.close()  # buffered turns are only on disk once flushed
+    elapsed = time.perf_counter() - start
+    stats = writer.stats()
+    return {"mode": mode, "seconds": round(elapsed, 3), "turns_per_s": round(turns / elapsed, 1),
+            "transactions": stats["transactions"], "errors": stats["errors"]}
+
+async def main(turns: int, concurrency: int) -> int:
+    ok = True
+    for synchronous in ("NORMAL", "FULL"):
+        engine.dispose()
+        tune_sqlite(engine, {**SQLITE_PRAGMAS, "synchronous": synchronous})
+        for mode in ("direct", "group", "buffered"):
+            with engine.begin() as conn:
+                conn.execute(text("DELETE FROM messages"))
+                conn.execute(text("DELETE FROM sessions"))
+            result = await run(mode, turns, concurrency)
+            with engine.connect() as conn:
+                rows = conn.execute(text("SELECT count(*) FROM messages")).scalar()
+            ok = ok and rows == 4 * turns and not result["errors"]
+            print(f"synchronous={synchronous:<6} {result['mode']:<8} {result['turns_per_s']:>8} turns/s "
+                  f"{result['transactions']:>6} transactions  {rows} rows")
+    print("OK" if ok else "FAIL: rows are missing")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.turns, args.concurrency)))
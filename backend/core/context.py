@@ -0,0 +1,175 @@
+from langchain_core.messages import BaseMessage, AIMessage, HumanMessage, SystemMessage, ToolMessage
+from utils.model_params import (MODEL_NAME, CONTEXT_TOKEN_BUDGETS, DEFAULT_CONTEXT_TOKEN_BUDGET,
+                                CONTEXT_RECENT_MESSAGES, CONTEXT_TOOL_RESULT_TOKENS, PROMPT_PREFIX_SESSIONS)
+from utils.metrics import PROMPT_PREFIX
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+import hashlib
+import json
+import threading
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4 # role and separators added by the chat template
+TOKEN_COUNT_KEY = "token_count"
+
+
+def count_text_tokens(text: str) -> int:
+    """cheap token estimate, no tokenizer is needed"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return " ".join(part.get("text", "") if isinstance(part, dict) else str(part)
+                    for part in message.content)
+
+def count_message_tokens(message: BaseMessage) -> int:
+    """Token count of a message, cached on the message itself so it is
+    computed once and persisted with the checkpoint"""
+    cached = message.additional_kwargs.get(TOKEN_COUNT_KEY)
+    if cached is not None:
+        return cached
+
+    usage = getattr(message, "usage_metadata", None)
+    if isinstance(message, AIMessage) and usage and usage.get("output_tokens"):
+        tokens = usage["output_tokens"]
+    else:
+        tokens = count_text_tokens(message_text(message))
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            tokens += count_text_tokens(f"{tool_call['name']}{tool_call['args']}")
+    tokens += MESSAGE_OVERHEAD_TOKENS
+
+    message.additional_kwargs[TOKEN_COUNT_KEY] = tokens
+    return tokens
+
+
+class ContextPolicy:
+    """Decide what part of the conversation is sent to the model.
+
+    The system prompt and the last `recent_messages` messages are always
+    sent. When the prompt is over `token_budget` the older turns are
+    replaced by a rolling summary (see SummaryNode), their tool results
+    trimmed in its input.
+
+    Between two summaries, the prompt of a turn starts with the prompt of
+    the previous one, byte for byte, so the model server only evaluates
+    what was added: nothing sent before is changed, tool results included,
+    until the next summary.
+    """
+    def __init__(self, token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+                 recent_messages: int = CONTEXT_RECENT_MESSAGES,
+                 tool_result_tokens: int = CONTEXT_TOOL_RESULT_TOKENS):
+        self.token_budget = token_budget
+        self.recent_messages = recent_messages
+        self.tool_result_tokens = tool_result_tokens
+
+    @classmethod
+    def for_model(cls, model_name: str = MODEL_NAME, **kwargs) -> "ContextPolicy":
+        budget = CONTEXT_TOKEN_BUDGETS.get(model_name, DEFAULT_CONTEXT_TOKEN_BUDGET)
+        return cls(token_budget=budget, **kwargs)
+
+    def _recent_start(self, messages: Sequence[BaseMessage]) -> int:
+        return max(len(messages) - self.recent_messages, 0)
+
+    def trim_tool_result(self, message: ToolMessage) -> ToolMessage:
+        text = message_text(message)
+        max_chars = self.tool_result_tokens * CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return message
+        return message.model_copy(update={
+            "content": text[:max_chars] + "\n[... tool result trimmed ...]",
+            "additional_kwargs": {}
+        })
+
+    def build_prompt(self, system_message: SystemMessage, summary: Optional[str],
+                     messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        """model input: system prompt, summary of older turns, then the
+        messages as they are"""
+        prompt = [system_message]
+        if summary:
+            prompt.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
+        prompt.extend(message for message in messages if not isinstance(message, SystemMessage))
+        return prompt
+
+    def prompt_tokens(self, prompt: Sequence[BaseMessage]) -> int:
+        return sum(count_message_tokens(message) for message in prompt)
+
+    def split(self, messages: Sequence[BaseMessage]) -> Tuple[List[BaseMessage], List[BaseMessage]]:
+        """Split messages into (older, kept). The kept part starts on a user
+        message, so tool calls are never separated from their results, and
+        it always holds the recent window and the current turn."""
+        cut = self._recent_start(messages)
+        last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+        cut = min(cut, last_human)
+        while cut > 0 and not isinstance(messages[cut], HumanMessage):
+            cut -= 1
+        return list(messages[:cut]), list(messages[cut:])
+
+    def needs_summary(self, system_message: SystemMessage, summary: Optional[str],
+                      messages: Sequence[BaseMessage]) -> bool:
+        older, _ = self.split(messages)
+        if not older:
+            return False
+        prompt = self.build_prompt(system_message, summary, messages)
+        return self.prompt_tokens(prompt) > self.token_budget
+
+
+def message_digest(message: BaseMessage) -> str:
+    """digest of what the model server sees of a message"""
+    data = [message.type, message_text(message), getattr(message, "tool_calls", None) or [],
+            getattr(message, "tool_call_id", None)]
+    return hashlib.blake2b(json.dumps(data, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+class PrefixTracker:
+    """Check that the prompts of a session extend each other.
+
+    The model server keeps the evaluated prompt of a session (its KV cache)
+    and only evaluates a new prompt from the first token that differs. The
+    digests of the last prompt of each session are kept, and each new
+    prompt is counted as "new", "extended" (it starts with the previous
+    one), "summarized" (a new summary replaced the older turns, which is
+    expected to change it) or "changed", with the number of its messages
+    that were reused.
+    """
+    def __init__(self, max_sessions: int = PROMPT_PREFIX_SESSIONS):
+        self.max_sessions = max_sessions
+        # session -> (summary, digests of the prompt)
+        self.prompts: "OrderedDict[str, Tuple[Optional[str], List[str]]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.results = {"new": 0, "extended": 0, "summarized": 0, "changed": 0}
+        self.reused_messages = 0
+
+    def observe(self, session_id: Optional[str], prompt: Sequence[BaseMessage],
+                tool_names: Sequence[str] = (), summary: Optional[str] = None) -> Tuple[str, int]:
+        """(result, messages in common with the previous prompt)"""
+        if not session_id:
+            return "new", 0
+        # the tool schemas come first in the chat templates
+        digests = [",".join(tool_names)] + [message_digest(message) for message in prompt]
+        with self.lock:
+            previous = self.prompts.pop(session_id, None)
+            self.prompts[session_id] = (summary, digests)
+            if len(self.prompts) > self.max_sessions:
+                self.prompts.popitem(last=False)
+        if previous is None:
+            result, common = "new", 0
+        else:
+            previous_summary, previous = previous
+            common = next((i for i, (a, b) in enumerate(zip(previous, digests)) if a != b),
+                          min(len(previous), len(digests)))
+            if common == len(previous):
+                result = "extended"
+            else:
+                result = "summarized" if summary != previous_summary else "changed"
+        common = max(common - 1, 0)
+        PROMPT_PREFIX.labels(result).inc()
+        with self.lock:
+            self.results[result] += 1
+            self.reused_messages += common
+        return result, common
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"sessions": len(self.prompts), "results": dict(self.results),
+                    "reused_messages": self.reused_messages}
@@ -1,50 +1,125 @@
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from core.state import ChatState
-from core.nodes import ChatNode
-from tools.web_search import ddg_search_tool
-from tools.web_search import google_search_tool
-from IPython.display import Image, display
+from core.nodes import ChatNode, SummaryNode
+from core.context import ContextPolicy, PrefixTracker
+from core.tool_executor import ToolExecutor
+from core.response_cache import ResponseCache
+from core.router import QueryRouter
+from utils.model_params import (MODEL_URL, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_DB_PATH, RESPONSE_CACHE_TTL,
+                                RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_EMBEDDING_MODEL, RESPONSE_CACHE_SIMILARITY)
+from tools.registry import load_tools
 from typing import Optional
-from langchain_core.runnables import RunnableConfig
-from langgraph.prebuilt import ToolNode, tools_condition
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.language_models import BaseChatModel
+from langgraph.prebuilt import tools_condition
+
+# nodes whose output is the answer of a turn
+AGENT_NODES = ("chat_agent", "direct_agent")
 
 class ChatGraph:
-    def __init__(self):
-        # tools
-        self.tools = [ddg_search_tool, google_search_tool]
+    def __init__(self, use_memory: bool = True, model: Optional[BaseChatModel] = None,
+                 checkpointer: Optional[BaseCheckpointSaver] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 router: Optional[QueryRouter] = None):
+        # tools, enabled in utils/tool_params.py
+        self.tools = load_tools()
+
+        # response cache in front of the agent
+        if response_cache is None and RESPONSE_CACHE_ENABLED:
+            response_cache = self.load_response_cache()
+        self.response_cache = response_cache
 
         # nodes
-        self.chat_node = ChatNode(tools=self.tools)      
+        self.context_policy = ContextPolicy.for_model()
+        # both agents send their prompts to the same model server
+        self.prefix_tracker = PrefixTracker()
+        self.chat_node = ChatNode(tools=self.tools, model=model, context_policy=self.context_policy,
+                                  response_cache=self.response_cache, prefix_tracker=self.prefix_tracker)
+        # same prompt, tool schemas included, for turns that need no tool:
+        # the tool calls are not run, and a session switching between the
+        # two keeps its evaluated prompt on the model server
+        self.direct_node = ChatNode(tools=self.tools, model=model, context_policy=self.context_policy,
+                                    response_cache=self.response_cache, prefix_tracker=self.prefix_tracker,
+                                    allow_tool_calls=False)
+        self.router = router or QueryRouter(has_tools=bool(self.tools))
+        self.summary_node = SummaryNode(model=model, context_policy=self.context_policy)
+        self.tool_executor = ToolExecutor(self.tools)
 
-        # memory saver
-        self.memory_saver = MemorySaver()
+        # memory saver, a durable checkpointer can be given instead
+        if checkpointer is None and use_memory:
+            checkpointer = MemorySaver()
+        self.memory_saver = checkpointer
 
-    def graph_builder(self):
+    def graph_builder(self, checkpointer: Optional[BaseCheckpointSaver] = None):
         graph_builder = StateGraph(ChatState)
 
         # Nodes
-        graph_builder.add_node("chat_agent", self.chat_node)
-        graph_builder.add_node("tools", ToolNode(self.tools))
+        graph_builder.add_node("router", RunnableLambda(self.router, afunc=self.router.acall))
+        graph_builder.add_node("chat_agent", RunnableLambda(self.chat_node, afunc=self.chat_node.acall))
+        graph_builder.add_node("direct_agent", RunnableLambda(self.direct_node, afunc=self.direct_node.acall))
+        graph_builder.add_node("tools", RunnableLambda(self.tool_executor, afunc=self.tool_executor.acall))
+        graph_builder.add_node("summarize", RunnableLambda(self.summary_node, afunc=self.summary_node.acall))
 
-        # Edges
-        graph_builder.add_edge(START, "chat_agent")
+        # Edges: the router picks the direct path or the agent with tools,
+        # the context is summarized before either when over budget, and the
+        # agent answers without tools once it used its tool rounds
+        agents = ["summarize", *AGENT_NODES]
+        graph_builder.add_edge(START, "router")
+        graph_builder.add_conditional_edges("router", self.context_condition, agents)
+        graph_builder.add_conditional_edges("summarize", self.router.agent_for, list(AGENT_NODES))
         graph_builder.add_conditional_edges("chat_agent", tools_condition)
-        graph_builder.add_edge("tools", "chat_agent")
+        graph_builder.add_edge("direct_agent", END)
+        graph_builder.add_conditional_edges("tools", self.context_condition, agents)
 
         # return compiled graph
-        return graph_builder.compile(checkpointer=self.memory_saver)
+        return graph_builder.compile(checkpointer=checkpointer)
     
+    @staticmethod
+    def load_response_cache() -> ResponseCache:
+        embeddings = None
+        if RESPONSE_CACHE_EMBEDDING_MODEL:
+            from langchain_ollama import OllamaEmbeddings
+            embeddings = OllamaEmbeddings(base_url=MODEL_URL, model=RESPONSE_CACHE_EMBEDDING_MODEL)
+        return ResponseCache(RESPONSE_CACHE_DB_PATH, ttl=RESPONSE_CACHE_TTL,
+                             max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                             embeddings=embeddings, similarity=RESPONSE_CACHE_SIMILARITY)
+
+    def context_condition(self, state: ChatState) -> str:
+        return "summarize" if self.chat_node.needs_summary(state) else self.router.agent_for(state)
+
     @property
     def graph(self):
         if hasattr(self, "_graph"):
             return self._graph
-        self._graph = self.graph_builder()
+        self._graph = self.graph_builder(self.memory_saver)
         return self._graph
+
+    @property
+    def stateless_graph(self):
+        """same graph without checkpointer, for runs that keep no state"""
+        if not hasattr(self, "_stateless_graph"):
+            self._stateless_graph = self.graph_builder()
+        return self._stateless_graph
     
     def display(self):
+        # notebooks only, IPython is not needed by the API
+        from IPython.display import Image, display
         display(Image(self.graph.get_graph(xray=True).draw_mermaid_png()))
 
     def invoke(self, input:str, config: Optional[RunnableConfig]=None):
         return self.graph.invoke(input, config)
+
+    def stream(self, input:str, config: Optional[RunnableConfig]=None, **kwargs):
+        return self.graph.stream(input, config, **kwargs)
+
+    async def ainvoke(self, input:str, config: Optional[RunnableConfig]=None):
+        return await self.graph.ainvoke(input, config)
+
+    def astream(self, input:str, config: Optional[RunnableConfig]=None, **kwargs):
+        return self.graph.astream(input, config, **kwargs)
+
+    async def aget_state(self, config: RunnableConfig):
+        return await self.graph.aget_state(config)
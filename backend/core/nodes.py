@@ -1,30 +1,187 @@
 
 from core.state import ChatState
-from utils.model_provider import load_model
-from utils.model_params import MODEL_URL, MODEL_NAME, MODEL_TEMP, SYSTEM_PROMPT
-from langchain_core.messages import SystemMessage, AIMessage
-from langchain_community.tools import tool
-from typing import Optional, List
+from core.context import ContextPolicy, PrefixTracker, message_text
+from core.response_cache import ResponseCache, is_cacheable
+from utils.model_provider import get_model
+from utils.model_params import MODEL_URLS, MODEL_NAME, MODEL_TEMP, SYSTEM_PROMPT, SUMMARY_PROMPT
+from utils.model_pool import session_affinity
+from utils.metrics import RESPONSE_CACHE_LOOKUPS
+from utils import tracing
+from utils.text_utils import remove_think_tags
+from langchain_core.messages import (SystemMessage, AIMessage, HumanMessage, ToolMessage,
+                                     RemoveMessage, BaseMessage)
+from langchain_core.tools import BaseTool
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import RunnableConfig
+from typing import Optional, List, Sequence, Union
+import asyncio
+
+
+def session_of(config: Optional[RunnableConfig]) -> Optional[str]:
+    return (config or {}).get("configurable", {}).get("thread_id")
+
+def set_session_affinity(config: Optional[RunnableConfig]):
+    """route the model calls of this node to the backend of the session,
+    which holds its evaluated prompt"""
+    session_affinity.set(session_of(config))
 
 
 class ChatNode:
-    def __init__(self, url:str=MODEL_URL,
+    def __init__(self, url:Union[str, Sequence[str]]=MODEL_URLS,
                  model_name:str=MODEL_NAME,
                  temperature:float=MODEL_TEMP,
                  system_prompt:str=SYSTEM_PROMPT,
-                 tools : Optional[List[tool]] = []):
+                 tools : Optional[List[BaseTool]] = [],
+                 model: Optional[BaseChatModel] = None,
+                 context_policy: Optional[ContextPolicy] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 prefix_tracker: Optional[PrefixTracker] = None,
+                 allow_tool_calls: bool = True):
         self.systeme_message = SystemMessage(content=system_prompt)
+        self.context_policy = context_policy or ContextPolicy.for_model(model_name)
+        self.model_name = model_name
+        self.temperature = temperature
+        self.tool_names = [t.name for t in tools or []]
+        # answers are only reused when the model is deterministic
+        self.response_cache = response_cache if temperature == 0 else None
+        self.prefix = prefix_tracker or PrefixTracker()
 
-        model = load_model(url, model_name, temperature)
+        model = model or get_model(url, model_name, temperature)
         self.model = model.bind_tools(tools) if tools else model
+        # without tool calls the tool schemas are still sent, so the prompt
+        # is the one of the agent with tools, byte for byte, and the tool
+        # calls the model asks for are dropped
+        self.allow_tool_calls = allow_tool_calls
+        self.plain_model = model
+
+    def _prepare(self, state: ChatState):
+        # the system prompt and summary are only added to the model input,
+        # they are not written back to the state that the checkpointer persists
+        return self.context_policy.build_prompt(
+            self.systeme_message, state.get("summary"), state["messages"]
+        )
+
+    def _observe_prefix(self, state: ChatState, messages: List[BaseMessage], config: Optional[RunnableConfig]):
+        """whether the prompt sent to the model extends the previous one of the session"""
+        result, common = self.prefix.observe(session_of(config), messages, self.tool_names, state.get("summary"))
+        tracing.record_span("prompt_prefix", 0.0, result=result, reused_messages=common,
+                            messages=len(messages))
+
+    def needs_summary(self, state: ChatState) -> bool:
+        return self.context_policy.needs_summary(
+            self.systeme_message, state.get("summary"), state["messages"]
+        )
+
+    def _use_cache(self, messages: List[BaseMessage]) -> bool:
+        return self.response_cache is not None and is_cacheable(messages)
+
+    def _cache_lookup(self, messages: List[BaseMessage]) -> Optional[AIMessage]:
+        with tracing.span("response_cache") as attrs:
+            hit = self.response_cache.lookup(self.model_name, self.temperature, self.tool_names, messages)
+            attrs["result"] = hit["tier"] if hit else "miss"
+        RESPONSE_CACHE_LOOKUPS.labels(attrs["result"]).inc()
+        if hit is None:
+            return None
+        return AIMessage(content=hit["response"],
+                         response_metadata={"cache_hit": True, "cache_tier": hit["tier"]})
+
+    def _cache_store(self, messages: List[BaseMessage], response: AIMessage):
+        # answers that call tools depend on fresh results, they are not kept
+        if not response.tool_calls:
+            self.response_cache.store(self.model_name, self.temperature, self.tool_names,
+                                      messages, message_text(response))
+
+    def _without_tool_calls(self, response: AIMessage) -> Optional[AIMessage]:
+        """the answer with its tool calls dropped, None when it has no text"""
+        if self.allow_tool_calls or not response.tool_calls:
+            return response
+        if not remove_think_tags(message_text(response)).strip():
+            return None
+        return response.model_copy(update={"tool_calls": [], "invalid_tool_calls": []})
+
+    def __call__(self, state: ChatState, config: Optional[RunnableConfig] = None) -> ChatState:
+        set_session_affinity(config)
+        messages = self._prepare(state)
+        use_cache = self._use_cache(messages)
+        if use_cache:
+            cached = self._cache_lookup(messages)
+            if cached is not None:
+                return {"messages": [cached]}
+
+        self._observe_prefix(state, messages, config)
+        response = self._without_tool_calls(self.model.invoke(messages))
+        if response is None:
+            # only a tool call came back, the model is asked again without tools
+            response = self.plain_model.invoke(messages)
+
+        if use_cache:
+            self._cache_store(messages, response)
+        return {"messages": [response]}
+
+    async def acall(self, state: ChatState, config: Optional[RunnableConfig] = None) -> ChatState:
+        """async version, it uses the model async client"""
+        set_session_affinity(config)
+        messages = self._prepare(state)
+        use_cache = self._use_cache(messages)
+        if use_cache:
+            cached = await asyncio.to_thread(self._cache_lookup, messages)
+            if cached is not None:
+                return {"messages": [cached]}
+
+        self._observe_prefix(state, messages, config)
+        response = self._without_tool_calls(await self.model.ainvoke(messages))
+        if response is None:
+            # only a tool call came back, the model is asked again without tools
+            response = await self.plain_model.ainvoke(messages)
+
+        if use_cache:
+            await asyncio.to_thread(self._cache_store, messages, response)
+        return {"messages": [response]}
+
+
+class SummaryNode:
+    """Replace the older turns of the conversation by a rolling summary"""
+    def __init__(self, url:Union[str, Sequence[str]]=MODEL_URLS,
+                 model_name:str=MODEL_NAME,
+                 temperature:float=MODEL_TEMP,
+                 summary_prompt:str=SUMMARY_PROMPT,
+                 model: Optional[BaseChatModel] = None,
+                 context_policy: Optional[ContextPolicy] = None):
+        self.summary_message = SystemMessage(content=summary_prompt)
+        self.context_policy = context_policy or ContextPolicy.for_model(model_name)
+        # no tools are bound, the summary is plain text
+        self.model = model or get_model(url, model_name, temperature)
+
+    def _prepare(self, state: ChatState):
+        older, _ = self.context_policy.split(state["messages"])
+        lines = []
+        if state.get("summary"):
+            lines.append(f"Previous summary:\n{state['summary']}\n")
+        for message in older:
+            if isinstance(message, HumanMessage):
+                lines.append(f"User: {message_text(message)}")
+            elif isinstance(message, ToolMessage):
+                trimmed = self.context_policy.trim_tool_result(message)
+                lines.append(f"Tool result ({message.name}): {message_text(trimmed)}")
+            elif isinstance(message, AIMessage) and message_text(message):
+                lines.append(f"Assistant: {remove_think_tags(message_text(message))}")
+        prompt = [self.summary_message, HumanMessage(content="\n".join(lines))]
+        return older, prompt
 
-    def __call__(self, state: ChatState) -> ChatState:
-        messages = state["messages"]
+    def _update(self, older: List[BaseMessage], response: AIMessage) -> ChatState:
+        return {
+            "summary": remove_think_tags(message_text(response)),
+            "messages": [RemoveMessage(id=message.id) for message in older]
+        }
 
-        if not messages or type(messages[0]) != SystemMessage:
-            messages.insert(0, self.systeme_message)
+    def __call__(self, state: ChatState, config: Optional[RunnableConfig] = None) -> ChatState:
+        set_session_affinity(config)
+        older, prompt = self._prepare(state)
+        response = self.model.invoke(prompt)
+        return self._update(older, response)
 
-        response = self.model.invoke(messages)
-        
-        state["messages"].append(response)
-        return state
+    async def acall(self, state: ChatState, config: Optional[RunnableConfig] = None) -> ChatState:
+        set_session_affinity(config)
+        older, prompt = self._prepare(state)
+        response = await self.model.ainvoke(prompt)
+        return self._update(older, response)
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Sequence
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import BaseMessage, AIMessage, ToolMessage, HumanMessage
+from core.context import message_text
+from utils.text_utils import remove_think_tags
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: Sequence[BaseMessage]) -> str:
+    """role and normalized text of each prompt message, one per line"""
+    lines = []
+    for message in prompt:
+        text = message_text(message)
+        if isinstance(message, AIMessage):
+            text = remove_think_tags(text)
+        text = re.sub(r"\s+", " ", text).strip().lower()
+        lines.append(f"{message.type}: {text}")
+    return "\n".join(lines)
+
+def is_cacheable(prompt: Sequence[BaseMessage]) -> bool:
+    """only plain conversations: no tool call or tool result in the prompt"""
+    for message in prompt:
+        if isinstance(message, ToolMessage) or getattr(message, "tool_calls", None):
+            return False
+    return bool(prompt) and isinstance(prompt[-1], HumanMessage)
+
+
+class ResponseCache:
+    """Cache of model answers keyed on the conversation prefix.
+
+    The exact tier matches a hash of the model name, temperature, tools and
+    normalized prompt (system prompt included). The optional similarity tier
+    embeds the last user message and matches entries of the same namespace
+    (model, temperature, tools and earlier messages) above a cosine threshold.
+    Entries expire after `ttl` and the least recently used are evicted above
+    `max_entries`. Everything is stored in SQLite.
+    """
+    def __init__(self, db_path: str, ttl: float, max_entries: int,
+                 embeddings: Optional[Embeddings] = None, similarity: float = 0.95):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embeddings = embeddings
+        self.similarity = similarity
+        self.lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0}
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                response TEXT NOT NULL,
+                embedding BLOB,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_response_cache_namespace ON response_cache (namespace);
+            CREATE INDEX IF NOT EXISTS ix_response_cache_last_used ON response_cache (last_used_at);
+        """)
+        self.db.commit()
+
+    @staticmethod
+    def _hash(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    def keys(self, model_name: str, temperature: float, tools: List[str], prompt: Sequence[BaseMessage]):
+        """(exact key, namespace) of a prompt"""
+        key = self._hash(model_name, temperature, sorted(tools), normalize_prompt(prompt))
+        namespace = self._hash(model_name, temperature, sorted(tools), normalize_prompt(prompt[:-1]))
+        return key, namespace
+
+    def _embed(self, prompt: Sequence[BaseMessage]) -> "np.ndarray":
+        # numpy is only needed by the similarity tier, imported by its first use
+        import numpy as np
+        vector = np.asarray(self.embeddings.embed_query(message_text(prompt[-1])), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, model_name: str, temperature: float, tools: List[str],
+               prompt: Sequence[BaseMessage]) -> Optional[dict]:
+        """cached answer as {"response", "tier"}, None on a miss"""
+        key, namespace = self.keys(model_name, temperature, tools, prompt)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT response FROM response_cache WHERE key = ? AND created_at > ?",
+                                  (key, now - self.ttl)).fetchone()
+            if row:
+                self.db.execute("UPDATE response_cache SET last_used_at = ? WHERE key = ?", (now, key))
+                self.db.commit()
+                self.counters["exact_hits"] += 1
+                return {"response": row[0], "tier": "exact"}
+
+        if self.embeddings is not None:
+            vector = self._embed(prompt)
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT key, response, embedding FROM response_cache "
+                    "WHERE namespace = ? AND embedding IS NOT NULL AND created_at > ?",
+                    (namespace, now - self.ttl)).fetchall()
+                if rows:
+                    import numpy as np
+                    matrix = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+                    scores = matrix @ vector
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.similarity:
+                        self.db.execute("UPDATE response_cache SET last_used_at = ? WHERE key = ?", (now, rows[best][0]))
+                        self.db.commit()
+                        self.counters["similar_hits"] += 1
+                        return {"response": rows[best][1], "tier": "similar",
+                                "similarity": float(scores[best])}
+
+        with self.lock:
+            self.counters["misses"] += 1
+        return None
+
+    def store(self, model_name: str, temperature: float, tools: List[str],
+              prompt: Sequence[BaseMessage], response: str):
+        key, namespace = self.keys(model_name, temperature, tools, prompt)
+        embedding = self._embed(prompt).tobytes() if self.embeddings is not None else None
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, namespace, response, embedding, now, now))
+            # expired entries first, then the least recently used above the limit
+            self.db.execute("DELETE FROM response_cache WHERE created_at <= ?", (now - self.ttl,))
+            self.db.execute(
+                "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache "
+                "ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self.db.commit()
+            self.counters["stores"] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.db.execute("SELECT count(*) FROM response_cache").fetchone()[0]
+            return {**self.counters, "entries": entries}
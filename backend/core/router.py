@@ -0,0 +1,164 @@
+from core.state import ChatState
+from core.context import message_text
+from utils.model_provider import get_model
+from utils.model_params import (MODEL_URLS, ROUTER_MODE, ROUTER_MODEL_NAME, ROUTER_DEFAULT_ROUTE,
+                                ROUTER_PROMPT, MAX_TOOL_ITERATIONS)
+from utils.metrics import ROUTER_DECISIONS
+from utils.text_utils import remove_think_tags
+from utils import tracing
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import RunnableConfig
+from typing import Dict, Optional, Sequence, Tuple
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# fresh or external facts: the agent with tools
+NEEDS_TOOLS = re.compile(
+    r"https?://|\b(latest|today|tonight|tomorrow|yesterday|this (week|month|year)|current(ly)?|right now|"
+    r"news|recent(ly)?|price[sd]?|stocks?|weather|forecast|scores?|results?|released?|"
+    r"search|look (it )?up|google|browse|who (is|are|was|won)|when (is|was|will|did)|"
+    r"where (is|are|can)|how much|20[2-9]\d)\b", re.IGNORECASE)
+# greetings, thanks and acknowledgements, the whole message
+SMALL_TALK = re.compile(
+    r"^(\W*(hi|hello|hey|yo|bonjour|salut|good (morning|afternoon|evening|night)|thanks?( you| a lot)?|"
+    r"thank you|thx|merci|ok(ay)?|cool|great|nice|perfect|bye|goodbye|see you|yes|no|sure|got it)\b)+\W*$",
+    re.IGNORECASE)
+# about the previous answer
+FOLLOW_UP = re.compile(
+    r"^\W*(why|how so|explain|rephrase|reformulate|summari[sz]e|translate|shorter|longer|simpler|"
+    r"more details?|continue|go on|what do you mean|(can|could) you (explain|clarify|elaborate|"
+    r"simplify|rewrite|expand|shorten))\b", re.IGNORECASE)
+# pure arithmetic
+ARITHMETIC = re.compile(r"^[\d\s.,+\-*/^%()=x]+\??$")
+# writing, code and reasoning tasks
+SELF_CONTAINED = re.compile(
+    r"\b(write|draft|rewrite|proofread|prove|solve|calculate|compute|convert|code|function|"
+    r"script|regex|sql|poem|story|essay|email|letter|joke)\b", re.IGNORECASE)
+
+
+def last_user_message(messages: Sequence[BaseMessage]) -> Tuple[str, bool]:
+    """text of the last user message, and whether an answer precedes it"""
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            answered = any(isinstance(message, AIMessage) for message in messages[:index])
+            return message_text(messages[index]), answered
+    return "", False
+
+def tool_rounds(messages: Sequence[BaseMessage]) -> int:
+    """agent messages of the current turn that requested tools"""
+    rounds = 0
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, AIMessage) and message.tool_calls:
+            rounds += 1
+    return rounds
+
+
+class QueryRouter:
+    """Pick the path of a turn from its user message: "direct", answered
+    without tools, or "agent", the tool-enabled agent loop.
+
+    Cheap rules decide the clear cases. In "model" mode a small classifier
+    model is asked about the others, the default route applies otherwise
+    and when the model fails. Without tools every turn goes direct.
+    """
+    def __init__(self, mode: str = ROUTER_MODE, has_tools: bool = True,
+                 default: str = ROUTER_DEFAULT_ROUTE, model: Optional[BaseChatModel] = None,
+                 max_tool_iterations: int = MAX_TOOL_ITERATIONS):
+        if mode not in ("heuristic", "model", "off"):
+            raise ValueError(f"Unknown router mode {mode!r}")
+        if default not in ("direct", "agent"):
+            raise ValueError(f"Unknown default route {default!r}")
+        self.mode = mode
+        self.has_tools = has_tools
+        self.default = default
+        self.max_tool_iterations = max_tool_iterations
+        self.prompt = SystemMessage(content=ROUTER_PROMPT)
+        self._model = model
+        self.lock = threading.Lock()
+        self.decisions: Dict[str, int] = {}
+
+    @property
+    def model(self) -> BaseChatModel:
+        if self._model is None:
+            self._model = get_model(MODEL_URLS, ROUTER_MODEL_NAME, 0.0)
+        return self._model
+
+    def rules(self, text: str, answered: bool) -> Optional[Tuple[str, str]]:
+        """(route, reason) for the clear cases, None otherwise"""
+        if NEEDS_TOOLS.search(text):
+            return "agent", "fresh_facts"
+        if SMALL_TALK.match(text):
+            return "direct", "small_talk"
+        if answered and FOLLOW_UP.match(text):
+            return "direct", "follow_up"
+        if ARITHMETIC.match(text.strip()):
+            return "direct", "arithmetic"
+        if SELF_CONTAINED.search(text):
+            return "direct", "self_contained"
+        return None
+
+    def _classifier_input(self, text: str):
+        return [self.prompt, HumanMessage(content=text)]
+
+    def _parse(self, response) -> Optional[Tuple[str, str]]:
+        answer = remove_think_tags(message_text(response)).upper()
+        if "SEARCH" in answer:
+            return "agent", "classifier"
+        if "DIRECT" in answer:
+            return "direct", "classifier"
+        return None
+
+    def _pre_route(self, state: ChatState) -> Tuple[Optional[Tuple[str, str]], str]:
+        text, answered = last_user_message(state["messages"])
+        if not self.has_tools:
+            return ("direct", "no_tools"), text
+        if self.mode == "off":
+            return ("agent", "router_off"), text
+        return self.rules(text, answered), text
+
+    def _record(self, route: str, reason: str) -> ChatState:
+        ROUTER_DECISIONS.labels(route, reason).inc()
+        tracing.record_span("route", 0.0, route=route, reason=reason)
+        with self.lock:
+            key = f"{route}:{reason}"
+            self.decisions[key] = self.decisions.get(key, 0) + 1
+        return {"route": route}
+
+    def __call__(self, state: ChatState, config: Optional[RunnableConfig] = None) -> ChatState:
+        decision, text = self._pre_route(state)
+        if decision is None and self.mode == "model":
+            try:
+                with tracing.span("router_model"):
+                    decision = self._parse(self.model.invoke(self._classifier_input(text)))
+            except Exception as e:
+                logger.warning(f"Router model failed, using the default route: {e!r}")
+        return self._record(*(decision or (self.default, "default")))
+
+    async def acall(self, state: ChatState, config: Optional[RunnableConfig] = None) -> ChatState:
+        decision, text = self._pre_route(state)
+        if decision is None and self.mode == "model":
+            try:
+                with tracing.span("router_model"):
+                    decision = self._parse(await self.model.ainvoke(self._classifier_input(text)))
+            except Exception as e:
+                logger.warning(f"Router model failed, using the default route: {e!r}")
+        return self._record(*(decision or (self.default, "default")))
+
+    def agent_for(self, state: ChatState) -> str:
+        """node answering the turn: the direct path, or the agent until it
+        used its tool rounds, then the direct path with the tool results"""
+        if state.get("route") == "direct" or tool_rounds(state["messages"]) >= self.max_tool_iterations:
+            return "direct_agent"
+        return "chat_agent"
+
+    def stats(self) -> dict:
+        with self.lock:
+            decisions = dict(self.decisions)
+        return {"mode": self.mode, "default": self.default,
+                "max_tool_iterations": self.max_tool_iterations, "decisions": decisions}
@@ -5,3 +5,5 @@ from langgraph.graph.message import add_messages
 class ChatState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
     session_id : Optional[str] = None
+    summary: Optional[str] # rolling summary of the turns removed from messages
+    route: Optional[str] # path of the current turn, "direct" or "agent" (core/router.py)
@@ -0,0 +1,196 @@
+import asyncio
+import contextvars
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import BaseTool
+from core.state import ChatState
+from core.context import CHARS_PER_TOKEN
+from utils.tool_params import (DEFAULT_TOOL_TIMEOUT, TOOL_TIMEOUTS, TOOL_FALLBACKS,
+                               TOOL_OUTPUT_MAX_TOKENS, SLOW_TOOL_SECONDS)
+from utils.metrics import TOOL_SECONDS
+from utils import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class ToolStats:
+    """per tool call counts and latency"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tools: Dict[str, dict] = {}
+
+    def record(self, name: str, seconds: float, status: str):
+        with self.lock:
+            entry = self.tools.setdefault(name, {"calls": 0, "errors": 0, "timeouts": 0,
+                                                 "total_seconds": 0.0, "max_seconds": 0.0})
+            entry["calls"] += 1
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            if status == "error":
+                entry["errors"] += 1
+            elif status == "timeout":
+                entry["timeouts"] += 1
+        TOOL_SECONDS.labels(name, status).observe(seconds)
+        tracing.record_span("tool", seconds, tool=name, status=status)
+        if seconds > SLOW_TOOL_SECONDS:
+            logger.warning(f"Slow tool call: {name} took {seconds:.2f}s ({status})")
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                name: {**entry, "avg_seconds": entry["total_seconds"] / entry["calls"]}
+                for name, entry in self.tools.items()
+            }
+
+
+def run_in_thread(fn, *args) -> Future:
+    """run fn(*args) on a new daemon thread. A call past its timeout cannot
+    be stopped: it only keeps its own thread until it returns, never a
+    worker of a shared pool that the next calls and fallbacks would wait for"""
+    future = Future()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, name="tool", daemon=True).start()
+    return future
+
+
+class ToolExecutor:
+    """Run the tool calls of the last ai message.
+
+    Independent calls run concurrently, each with its own timeout. When a
+    call fails or times out its fallback tool is tried once, and outputs are
+    cut to a token cap before going back into the state.
+    """
+    def __init__(self, tools: List[BaseTool],
+                 timeouts: Dict[str, float] = TOOL_TIMEOUTS,
+                 default_timeout: float = DEFAULT_TOOL_TIMEOUT,
+                 fallbacks: Dict[str, str] = TOOL_FALLBACKS,
+                 max_output_tokens: int = TOOL_OUTPUT_MAX_TOKENS):
+        self.tools = {t.name: t for t in tools}
+        self.timeouts = timeouts
+        self.default_timeout = default_timeout
+        # only fallbacks to registered tools are kept
+        self.fallbacks = {name: fb for name, fb in fallbacks.items() if fb in self.tools}
+        self.max_output_chars = max_output_tokens * CHARS_PER_TOKEN
+        self.stats = ToolStats()
+
+    def timeout(self, name: str) -> float:
+        return self.timeouts.get(name, self.default_timeout)
+
+    def cap_output(self, output) -> str:
+        text = re.sub(r"[ \t]+", " ", str(output)).strip()
+        if len(text) <= self.max_output_chars:
+            return text
+        return text[:self.max_output_chars] + "\n[... output truncated ...]"
+
+    def _tool_calls(self, state: ChatState) -> list:
+        message = state["messages"][-1]
+        if not isinstance(message, AIMessage):
+            return []
+        return message.tool_calls
+
+    def _message(self, tool_call: dict, content: str, status: str = "success") -> ToolMessage:
+        return ToolMessage(content=content, name=tool_call["name"],
+                           tool_call_id=tool_call["id"], status=status)
+
+    def _unknown(self, tool_call: dict) -> ToolMessage:
+        return self._message(tool_call, f"Error: {tool_call['name']} is not a valid tool, "
+                                        f"try one of [{', '.join(self.tools)}].", status="error")
+
+    # async path
+    def _ainvoke(self, tool: BaseTool, args: dict):
+        if getattr(tool, "coroutine", None) is not None:
+            return tool.ainvoke(args)
+        # sync tools run on their own thread, a timed out call keeps it
+        # until it returns but never holds the event loop
+        ctx = contextvars.copy_context()
+        return asyncio.wrap_future(run_in_thread(ctx.run, tool.invoke, args))
+
+    async def _arun(self, name: str, args: dict) -> str:
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return await asyncio.wait_for(self._ainvoke(self.tools[name], args), self.timeout(name))
+        except asyncio.TimeoutError:
+            status = "timeout"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.stats.record(name, time.perf_counter() - start, status)
+
+    async def _acall_one(self, tool_call: dict) -> ToolMessage:
+        name = tool_call["name"]
+        if name not in self.tools:
+            return self._unknown(tool_call)
+        try:
+            return self._message(tool_call, self.cap_output(await self._arun(name, tool_call["args"])))
+        except Exception as e:
+            error = e
+        fallback = self.fallbacks.get(name)
+        if fallback:
+            logger.warning(f"Tool {name} failed ({error!r}), falling back to {fallback}")
+            try:
+                return self._message(tool_call, self.cap_output(await self._arun(fallback, tool_call["args"])))
+            except Exception as e:
+                error = e
+        return self._message(tool_call, f"Error: {name} failed: {error!r}", status="error")
+
+    async def acall(self, state: ChatState) -> ChatState:
+        results = await asyncio.gather(*[self._acall_one(tc) for tc in self._tool_calls(state)])
+        return {"messages": list(results)}
+
+    # sync path
+    def _run(self, name: str, args: dict) -> str:
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            ctx = contextvars.copy_context()
+            return run_in_thread(ctx.run, self.tools[name].invoke, args).result(timeout=self.timeout(name))
+        except FutureTimeoutError:
+            status = "timeout"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.stats.record(name, time.perf_counter() - start, status)
+
+    def _call_one(self, tool_call: dict) -> ToolMessage:
+        name = tool_call["name"]
+        if name not in self.tools:
+            return self._unknown(tool_call)
+        try:
+            return self._message(tool_call, self.cap_output(self._run(name, tool_call["args"])))
+        except Exception as e:
+            error = e
+        fallback = self.fallbacks.get(name)
+        if fallback:
+            logger.warning(f"Tool {name} failed ({error!r}), falling back to {fallback}")
+            try:
+                return self._message(tool_call, self.cap_output(self._run(fallback, tool_call["args"])))
+            except Exception as e:
+                error = e
+        return self._message(tool_call, f"Error: {name} failed: {error!r}", status="error")
+
+    def __call__(self, state: ChatState) -> ChatState:
+        tool_calls = self._tool_calls(state)
+        # each call waits on its own worker, so they still run concurrently,
+        # and sees the context (trace) of the caller
+        ctx = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=max(len(tool_calls), 1)) as runner:
+            results = list(runner.map(lambda tc: ctx.copy().run(self._call_one, tc), tool_calls))
+        return {"messages": results}
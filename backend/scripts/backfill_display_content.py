@@ -0,0 +1,54 @@
+"""Backfill Message.display_content and Message.reasoning for rows written
+before the columns existed.
+
+Rows are processed in id order by batches, each batch in its own
+transaction, so the job can be stopped and run again at any time.
+
+    cd backend
+    python -m scripts.backfill_display_content --batch-size 1000
+"""
+import argparse
+import logging
+from sqlalchemy import update
+from api.database import SessionLocal
+from api.models import Message
+from utils.text_utils import split_think_tags
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def backfill(batch_size: int = 1000) -> int:
+    db = SessionLocal()
+    done = 0
+    last_id = 0
+    try:
+        while True:
+            rows = (db.query(Message.id, Message.content)
+                    .filter(Message.display_content.is_(None), Message.id > last_id)
+                    .order_by(Message.id)
+                    .limit(batch_size)
+                    .all())
+            if not rows:
+                break
+
+            params = []
+            for message_id, content in rows:
+                display_content, reasoning = split_think_tags(content or "")
+                params.append({"id": message_id, "display_content": display_content, "reasoning": reasoning})
+            db.execute(update(Message), params)
+            db.commit()
+
+            done += len(rows)
+            last_id = rows[-1][0]
+            logger.info(f"Backfilled {done} messages")
+    finally:
+        db.close()
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    backfill(args.batch_size)
@@ -0,0 +1,37 @@
+"""Switch an existing sessions database to auto_vacuum=INCREMENTAL.
+
+New databases are created with it (api.database.SQLITE_PRAGMAS), an
+existing one keeps its mode until rebuilt by a VACUUM. The VACUUM rewrites
+the whole file and locks the database meanwhile, so run it while the API
+is stopped. Afterwards the archival job (api.archive) gives the pages it
+frees back to the OS.
+
+    cd backend
+    python -m scripts.enable_incremental_vacuum
+"""
+import logging
+import os
+import time
+from api.database import engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def enable():
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        if mode == 2:
+            logger.info("auto_vacuum is already INCREMENTAL")
+            return
+        path = conn.exec_driver_sql("PRAGMA database_list").fetchone()[2]
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+        logger.info(f"auto_vacuum set to INCREMENTAL in {time.perf_counter() - start:.1f}s, "
+                    f"{size / 2**20:.1f}MB -> {os.path.getsize(path) / 2**20:.1f}MB")
+
+
+if __name__ == "__main__":
+    enable()
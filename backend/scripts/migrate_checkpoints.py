@@ -0,0 +1,49 @@
+"""One-off migration of existing sessions to the langgraph checkpointer.
+
+The state of each session found in the messages table is written as a
+checkpoint, so its next turn only sends the new user message instead of
+replaying the whole history. Sessions that already have a checkpoint are
+skipped, the script can be run again safely.
+
+    cd backend
+    python -m scripts.migrate_checkpoints
+"""
+import asyncio
+import logging
+from api.database import SessionLocal
+from api.checkpoints import open_checkpointer
+from api.models import Session
+from api import crud
+from core.graph import ChatGraph
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def migrate():
+    db = SessionLocal()
+    try:
+        session_ids = [sid for (sid,) in db.query(Session.id).order_by(Session.created_at)]
+
+        async with open_checkpointer() as checkpointer:
+            graph = ChatGraph(checkpointer=checkpointer)
+            migrated = skipped = 0
+            for session_id in session_ids:
+                config = {"configurable": {"thread_id": session_id}}
+                state = await graph.aget_state(config)
+                history = crud.load_history(db, session_id)
+                if state.values.get("messages") or not history:
+                    skipped += 1
+                    continue
+
+                # written as the agent output, so the next run starts from START
+                await graph.graph.aupdate_state(config, {"messages": history}, as_node="chat_agent")
+                migrated += 1
+
+        logger.info(f"Migrated {migrated} sessions, skipped {skipped}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -0,0 +1,16 @@
+import importlib
+from typing import List, Sequence
+from langchain_core.tools import BaseTool
+from utils.tool_params import ENABLED_TOOLS, TOOL_REGISTRY
+
+
+def load_tool(name: str) -> BaseTool:
+    """import a tool from its TOOL_REGISTRY entry"""
+    if name not in TOOL_REGISTRY:
+        raise ValueError(f"Unknown tool {name!r}, known tools: {', '.join(TOOL_REGISTRY)}")
+    module_name, attribute = TOOL_REGISTRY[name].split(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+def load_tools(names: Sequence[str] = ENABLED_TOOLS) -> List[BaseTool]:
+    """the enabled tools, the modules of the others are never imported"""
+    return [load_tool(name) for name in names]
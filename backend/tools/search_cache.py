@@ -0,0 +1,155 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, Tuple
+from utils.metrics import SEARCH_REQUESTS
+from utils import tracing
+
+
+def normalize_query(query: str) -> str:
+    """queries that differ only by case, spacing or trailing punctuation share a cache entry"""
+    return re.sub(r"\s+", " ", query).strip().strip("?!.").strip().lower()
+
+
+class SearchCache:
+    """TTL + LRU cache of search results.
+    Entries evicted from memory are spilled to SQLite when db_path is set,
+    and promoted back to memory on the next hit."""
+    def __init__(self, ttl: float, max_size: int, db_path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS search_cache "
+                            "(key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+            self.db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    return value
+                del self.entries[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT value, expires_at FROM search_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.db.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                    self.db.commit()
+                    value, expires_at = row
+                    if expires_at > now:
+                        self._put(key, value, expires_at)
+                        return value
+        return None
+
+    def set(self, key: str, value: str):
+        with self.lock:
+            self._put(key, value, time.time() + self.ttl)
+
+    def _put(self, key: str, value: str, expires_at: float):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            old_key, (old_expires_at, old_value) = self.entries.popitem(last=False)
+            if self.db is not None and old_expires_at > time.time():
+                self.db.execute("INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?)",
+                                (old_key, old_value, old_expires_at))
+                self.db.commit()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SearchService:
+    """Shared search layer used by the search tools.
+
+    Each provider is a callable query -> str, built once and reused. Results
+    are cached by normalized query, and identical queries running at the same
+    time are coalesced into a single call to the provider (single-flight).
+    """
+    def __init__(self, cache: SearchCache, providers: Optional[Dict[str, Callable[[], Callable[[str], str]]]] = None):
+        self.cache = cache
+        # provider name -> factory, the client is only built on first use
+        self.factories = dict(providers or {})
+        self.clients: Dict[str, Callable[[str], str]] = {}
+        self.inflight: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    def register(self, name: str, factory: Callable[[], Callable[[str], str]]):
+        """add or replace a provider, e.g. a fake one for offline runs"""
+        with self.lock:
+            self.factories[name] = factory
+            self.clients.pop(name, None)
+
+    def client(self, name: str) -> Callable[[str], str]:
+        with self.lock:
+            if name not in self.clients:
+                self.clients[name] = self.factories[name]()
+            return self.clients[name]
+
+    def search(self, provider: str, query: str) -> str:
+        with tracing.span("search", provider=provider) as attrs:
+            result, attrs["cache"] = self._search(provider, query)
+        SEARCH_REQUESTS.labels(provider, attrs["cache"]).inc()
+        return result
+
+    def _search(self, provider: str, query: str) -> Tuple[str, str]:
+        """the result and its cache status: hit, coalesced or miss"""
+        key = f"{provider}:{normalize_query(query)}"
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._count("hits")
+            return cached, "hit"
+
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                # a leader may have finished since the lookup above: it
+                # caches its result before leaving inflight
+                cached = self.cache.get(key)
+                if cached is not None:
+                    self.counters["hits"] += 1
+                    return cached, "hit"
+                future = Future()
+                self.inflight[key] = future
+                self.counters["misses"] += 1
+            else:
+                self.counters["coalesced"] += 1
+
+        if not leader:
+            return future.result(), "coalesced"
+
+        try:
+            result = self.client(provider)(query)
+            self.cache.set(key, result)
+            future.set_result(result)
+            return result, "miss"
+        except BaseException as e:
+            # errors are not cached, waiting callers get the same error
+            self._count("errors")
+            SEARCH_REQUESTS.labels(provider, "error").inc()
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def _count(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counters, "cached": len(self.cache), "inflight": len(self.inflight)}
@@ -1,18 +1,40 @@
-from langchain_community.tools import DuckDuckGoSearchRun
-from langchain_community.utilities import SerpAPIWrapper
 from langchain_core.tools import tool
-from dotenv import load_dotenv
-import os
+from tools.search_cache import SearchCache, SearchService
+from utils.tool_params import (SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE, SEARCH_CACHE_DB_PATH,
+                               FAKE_SEARCH, FAKE_SEARCH_DELAY, DOTENV_PATH)
 
-load_dotenv("/workspace/.env") # path to .env file
+
+# search clients, their libraries are only imported by the first search
+# that uses them
+def ddg_client():
+    from langchain_community.tools import DuckDuckGoSearchRun
+    return DuckDuckGoSearchRun().invoke
+
+def google_client():
+    from dotenv import load_dotenv
+    from langchain_community.utilities import SerpAPIWrapper
+    load_dotenv(DOTENV_PATH) # SERPAPI_API_KEY
+    return SerpAPIWrapper().run
+
+# shared search layer: clients are built once, results are cached
+search_service = SearchService(
+    cache=SearchCache(ttl=SEARCH_CACHE_TTL, max_size=SEARCH_CACHE_SIZE, db_path=SEARCH_CACHE_DB_PATH),
+    providers={
+        "ddg": ddg_client,
+        "google": google_client,
+    }
+)
+if FAKE_SEARCH:
+    from utils.fakes import install_fake_search
+    install_fake_search(search_service, FAKE_SEARCH_DELAY)
 
 # web search tool
 @tool
 def ddg_search_tool(query: str) -> str:
     """Use this tool to search on duckduckgo when up to date informations are needed"""
-    return DuckDuckGoSearchRun().invoke(query)
+    return search_service.search("ddg", query)
 
 @tool
 def google_search_tool(query: str) -> str:
     """Use this tool to search on google when up to date informations are needed"""
-    return SerpAPIWrapper().run(query)
+    return search_service.search("google", query)
@@ -0,0 +1,145 @@
+"""Deterministic offline chat model and search, for benchmarks and offline runs.
+
+It answers after `delay` seconds (time to first token) and then streams
+`response_tokens` words, `token_delay` seconds apart. With a `tool_rate`
+above 0 a share of the turns, picked from a hash of the user message,
+first call `tool_name` with the message as query, so the tool path of the
+graph is exercised too; only a model given tools calls them. With a
+`prompt_token_delay` the first token also waits for a simulated prefill
+of the prompt, tool schemas included. The same input always gives the
+same output.
+
+The app uses it instead of Ollama when CHATBOT_MODEL_PROVIDER=fake, the
+FAKE_LLM_* variables below set its parameters.
+"""
+import asyncio
+import json
+import os
+import time
+import zlib
+from typing import Any, AsyncIterator, Iterator, List, Optional
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+class FakeChatModel(BaseChatModel):
+    """Offline chat model with a fixed latency profile"""
+    delay: float = 1.0
+    token_delay: float = 0.0
+    response: str = "This is a fake answer."
+    response_tokens: Optional[int] = None  # words of the answer, `response` is used when None
+    tool_rate: float = 0.0  # share of the turns starting with a tool call
+    tool_name: str = "ddg_search_tool"
+    tools_bound: bool = False  # tool calls only come from a model given tools
+    # prefill: seconds per prompt token, the tool schemas of a model given
+    # tools count as prompt tokens
+    prompt_token_delay: float = 0.0
+    tool_schema_tokens: int = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeChatModel":
+        tokens = os.getenv("FAKE_LLM_RESPONSE_TOKENS")
+        return cls(
+            delay=float(os.getenv("FAKE_LLM_DELAY", "0.2")),
+            token_delay=float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0.01")),
+            response_tokens=int(tokens) if tokens else 50,
+            tool_rate=float(os.getenv("FAKE_LLM_TOOL_RATE", "0.0")),
+            prompt_token_delay=float(os.getenv("FAKE_LLM_PROMPT_TOKEN_DELAY", "0.0")),
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def bind_tools(self, tools, **kwargs):
+        # tool calls are decided by tool_rate
+        schemas = json.dumps([convert_to_openai_tool(tool) for tool in tools])
+        return self.model_copy(update={"tools_bound": True, "tool_schema_tokens": len(schemas) // 4})
+
+    def prompt_tokens(self, messages: List[BaseMessage]) -> int:
+        """rough prompt size, 4 characters per token"""
+        return sum(len(str(message.content)) for message in messages) // 4 + self.tool_schema_tokens
+
+    def _first_token_delay(self, messages: List[BaseMessage]) -> float:
+        return self.delay + self.prompt_token_delay * self.prompt_tokens(messages)
+
+    def _words(self) -> List[str]:
+        if self.response_tokens is None:
+            return self.response.split(" ")
+        return [f"word{i}" for i in range(self.response_tokens)]
+
+    def _tool_call(self, messages: List[BaseMessage]) -> Optional[dict]:
+        """a tool call for a turn that has not run a tool yet, or None"""
+        if not self.tools_bound or not self.tool_rate or not messages or not isinstance(messages[-1], HumanMessage):
+            return None
+        query = str(messages[-1].content)
+        if zlib.crc32(query.encode()) % 1000 >= self.tool_rate * 1000:
+            return None
+        call_id = f"call_{zlib.crc32((query + str(len(messages))).encode()):08x}"
+        return {"name": self.tool_name, "args": {"query": query}, "id": call_id, "type": "tool_call"}
+
+    def _message(self, messages: List[BaseMessage]) -> AIMessage:
+        tool_call = self._tool_call(messages)
+        if tool_call:
+            return AIMessage(content="", tool_calls=[tool_call])
+        return AIMessage(content=" ".join(self._words()))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        message = self._message(messages)
+        time.sleep(self._first_token_delay(messages) + self.token_delay * len(message.content.split()))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        message = self._message(messages)
+        await asyncio.sleep(self._first_token_delay(messages) + self.token_delay * len(message.content.split()))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, messages: List[BaseMessage]) -> Iterator[AIMessageChunk]:
+        tool_call = self._tool_call(messages)
+        if tool_call:
+            yield AIMessageChunk(content="", tool_call_chunks=[{
+                "name": tool_call["name"], "args": json.dumps(tool_call["args"]),
+                "id": tool_call["id"], "index": 0}])
+            return
+        for i, word in enumerate(self._words()):
+            yield AIMessageChunk(content=word if i == 0 else " " + word)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._first_token_delay(messages))
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                time.sleep(self.token_delay)
+            if run_manager and chunk.content:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._first_token_delay(messages))
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+
+class FakeSearch:
+    """Offline search provider answering after a fixed delay"""
+    def __init__(self, delay: float = 0.1):
+        self.delay = delay
+
+    def __call__(self, query: str) -> str:
+        time.sleep(self.delay)
+        return f"Fake search results for '{query}': nothing relevant was found."
+
+
+def install_fake_search(service, delay: float = 0.1, providers=("ddg", "google")):
+    """replace the providers of a SearchService with FakeSearch"""
+    for name in providers:
+        service.register(name, lambda: FakeSearch(delay))
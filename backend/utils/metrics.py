@@ -0,0 +1,80 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics, exposed on /metrics
+
+# latency buckets in seconds, from sub-millisecond DB queries to long model calls
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "chatbot_http_request_seconds", "HTTP request latency, streams included",
+    ["method", "route", "status"], buckets=SLOW_BUCKETS)
+
+NODE_SECONDS = Histogram(
+    "chatbot_graph_node_seconds", "Time spent in each graph node",
+    ["node", "status"], buckets=SLOW_BUCKETS)
+
+MODEL_CALL_SECONDS = Histogram(
+    "chatbot_model_call_seconds", "Model call latency",
+    ["node", "status"], buckets=SLOW_BUCKETS)
+MODEL_TTFT_SECONDS = Histogram(
+    "chatbot_model_ttft_seconds", "Time to first token of streamed model calls",
+    ["node"], buckets=SLOW_BUCKETS)
+MODEL_TOKENS = Counter(
+    "chatbot_model_tokens_total", "Tokens sent to and generated by the model",
+    ["node", "direction"])
+# durations reported by Ollama: load, prompt_eval (prefill) and eval (generation)
+MODEL_STAGE_SECONDS = Histogram(
+    "chatbot_model_stage_seconds", "Model time per Ollama stage",
+    ["stage"], buckets=SLOW_BUCKETS)
+# tokens Ollama evaluated: prompt_eval is the part of the prompt it could
+# not reuse from the session cache, eval the generated tokens
+MODEL_OLLAMA_TOKENS = Counter(
+    "chatbot_model_ollama_tokens_total", "Tokens evaluated by Ollama per stage",
+    ["node", "stage"])
+PROMPT_PREFIX = Counter(
+    "chatbot_prompt_prefix_total", "Prompts starting with the previous prompt of their session",
+    ["result"])
+ROUTER_DECISIONS = Counter(
+    "chatbot_router_decisions_total", "Turns routed to the direct and agent paths",
+    ["route", "reason"])
+TURN_SECONDS = Histogram(
+    "chatbot_turn_seconds", "Graph run latency of a turn by router path",
+    ["route", "status"], buckets=SLOW_BUCKETS)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "chatbot_response_cache_lookups_total", "Response cache lookups by result",
+    ["result"])
+
+TOOL_SECONDS = Histogram(
+    "chatbot_tool_seconds", "Tool call latency",
+    ["tool", "status"], buckets=SLOW_BUCKETS)
+SEARCH_REQUESTS = Counter(
+    "chatbot_search_requests_total", "Web searches by cache status",
+    ["provider", "cache"])
+
+DB_CALL_SECONDS = Histogram(
+    "chatbot_db_call_seconds", "DB calls run in the DB thread pool, waiting included",
+    ["operation"], buckets=FAST_BUCKETS)
+DB_QUERY_SECONDS = Histogram(
+    "chatbot_db_query_seconds", "SQL statement execution time",
+    ["statement"], buckets=FAST_BUCKETS)
+
+ARCHIVE_SESSIONS = Counter(
+    "chatbot_archive_sessions_total", "Idle sessions archived and restored",
+    ["action"])
+
+WRITE_BATCH_TURNS = Histogram(
+    "chatbot_write_batch_turns", "Chat turns written per DB transaction",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+QUEUE_WAIT_SECONDS = Histogram(
+    "chatbot_queue_wait_seconds", "Time a turn waited for a scheduler slot",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+QUEUE_REJECTIONS = Counter(
+    "chatbot_queue_rejections_total", "Turns rejected by the scheduler",
+    ["reason"])
+QUEUED_TURNS = Gauge("chatbot_queued_turns", "Turns waiting for a scheduler slot")
+ACTIVE_TURNS = Gauge("chatbot_active_turns", "Turns running the graph")
+LOCK_WAIT_SECONDS = Histogram(
+    "chatbot_lock_wait_seconds", "Time a turn waited for the lease of its session",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
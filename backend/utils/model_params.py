@@ -1,9 +1,68 @@
+import os
+
 # model variables
-MODEL_URL = "http://ollama:11434"
+# "ollama", or "fake" for offline benchmarks (utils/fakes.py)
+MODEL_PROVIDER = os.getenv("CHATBOT_MODEL_PROVIDER", "ollama")
+MODEL_URL = os.getenv("CHATBOT_MODEL_URL", "http://ollama:11434")
+# several Ollama servers can share the load, calls go to the least loaded one,
+# comma separated: CHATBOT_MODEL_URLS=http://ollama-1:11434,http://ollama-2:11434
+MODEL_URLS = tuple(url.strip() for url in os.getenv("CHATBOT_MODEL_URLS", MODEL_URL).split(",") if url.strip())
+# in-flight requests per Ollama server (its OLLAMA_NUM_PARALLEL)
+MODEL_BACKEND_MAX_CONCURRENCY = int(os.getenv("CHATBOT_MODEL_BACKEND_MAX_CONCURRENCY", "4"))
+MODEL_HEALTH_CHECK_INTERVAL = 10.0 # seconds
 MODEL_NAME = "qwen3" # "llama3.2" # "mistral" #
 MODEL_TEMP = 0.0
+# the model is loaded on each Ollama server at startup rather than by the first chat
+MODEL_WARMUP = os.getenv("CHATBOT_MODEL_WARMUP", "1") == "1"
+MODEL_KEEP_ALIVE = os.getenv("CHATBOT_MODEL_KEEP_ALIVE", "30m") # kept loaded this long once idle
+# context window of the model on the Ollama server, sent with every call
+# and the warm-up: a call with other options reloads the model, and a
+# prompt longer than the window loses its start, so the evaluated prompt
+# of the session (KV cache) cannot be reused. It holds the prompt token
+# budget below and the answer.
+MODEL_NUM_CTX = int(os.getenv("CHATBOT_MODEL_NUM_CTX", "8192"))
+MODEL_WARMUP_TIMEOUT = 300.0 # seconds, loading a large model from disk is slow
 #SYSTEM_PROMPT = "You are a helpful assistant."
 SYSTEM_PROMPT = """You are a helpful assistant that interact with users. 
 You are provided with some tools, like web search to fetch up to date 
 informations on internet and many other tools. Stay consistent and respond 
 effectively and efficiently to users need."""
+
+# router at the start of each turn, it sends queries that need no tool to
+# a direct answer, which runs no tool call (same prompt as the agent):
+#  "heuristic" rules on the user message (core/router.py)
+#  "model"     the rules, then a small classifier model for the undecided ones
+#  "off"       every turn goes to the agent with tools
+ROUTER_MODE = os.getenv("CHATBOT_ROUTER", "heuristic")
+ROUTER_MODEL_NAME = os.getenv("CHATBOT_ROUTER_MODEL", "qwen3:0.6b")
+ROUTER_DEFAULT_ROUTE = os.getenv("CHATBOT_ROUTER_DEFAULT", "agent") # when nothing decides
+ROUTER_PROMPT = """Decide if answering the last user message needs a web search for 
+fresh or external facts. Answer with one word: SEARCH or DIRECT."""
+# agent/tool round trips per turn, the agent then answers without tools
+MAX_TOOL_ITERATIONS = int(os.getenv("CHATBOT_MAX_TOOL_ITERATIONS", "3"))
+
+
+# context window variables
+# prompt token budget per model, older turns are summarized above it
+CONTEXT_TOKEN_BUDGETS = {"qwen3": 6144, "llama3.2": 6144, "mistral": 6144}
+DEFAULT_CONTEXT_TOKEN_BUDGET = 3072
+CONTEXT_TOKEN_BUDGET = CONTEXT_TOKEN_BUDGETS.get(MODEL_NAME, DEFAULT_CONTEXT_TOKEN_BUDGET)
+CONTEXT_RECENT_MESSAGES = 6 # last messages always sent as is
+CONTEXT_TOOL_RESULT_TOKENS = 300 # tool results are trimmed to this size in the input of a summary
+# sessions whose last prompt is kept (as digests) to check that the next
+# one extends it, see core.context.PrefixTracker
+PROMPT_PREFIX_SESSIONS = 10000
+SUMMARY_PROMPT = """Summarize the conversation below between a user and an assistant. 
+Keep the facts, names, numbers, decisions and open questions that may be needed 
+later. If a previous summary is given, update it with the new messages. Answer 
+with the summary only."""
+
+# response cache variables, only used when MODEL_TEMP is 0
+RESPONSE_CACHE_ENABLED = False
+# in the backend folder whatever the working directory, like the other databases
+RESPONSE_CACHE_DB_PATH = os.getenv("CHATBOT_RESPONSE_CACHE_DB_PATH", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "response_cache.db"))
+RESPONSE_CACHE_TTL = 24 * 3600 # seconds
+RESPONSE_CACHE_MAX_ENTRIES = 5000 # least recently used entries are evicted above it
+RESPONSE_CACHE_EMBEDDING_MODEL = None # e.g. "nomic-embed-text" to enable the similarity tier
+RESPONSE_CACHE_SIMILARITY = 0.95 # min cosine similarity for a similarity hit
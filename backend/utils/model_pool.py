@@ -0,0 +1,259 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Iterator, List, Optional, Sequence, Set
+import httpx
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_ollama import ChatOllama
+from pydantic import ConfigDict
+
+logger = logging.getLogger(__name__)
+
+# session of the current model call, used to route it to the same backend
+# as the previous turns so the prompt cache of that backend stays warm
+session_affinity: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("session_affinity", default=None)
+
+# errors meaning the backend could not be reached, the call is retried on another one
+CONNECTION_ERRORS = (ConnectionError, httpx.TransportError)
+
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+class OllamaBackend:
+    def __init__(self, url: str, model: ChatOllama, max_concurrency: int):
+        self.url = url
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.inflight = 0
+        self.healthy = True
+        self.failures = 0
+        self.served = 0
+
+    @property
+    def has_capacity(self) -> bool:
+        return self.inflight < self.max_concurrency
+
+
+class OllamaPool:
+    """Route model calls over several Ollama servers.
+
+    A call goes to the healthy backend with the fewest in-flight requests,
+    except that a session sticks to its previous backend while that one is
+    healthy and has capacity. Each backend has its own concurrency limit,
+    callers wait when all of them are full. Backends failing a connection
+    are taken out of the pool until the background health check sees them
+    answer again.
+    """
+    def __init__(self, urls: Sequence[str], model_name: str, temperature: float,
+                 max_concurrency: int = 4, health_interval: float = 10.0,
+                 acquire_timeout: float = 300.0, max_affinity: int = 10000, **kwargs):
+        self.backends = [
+            OllamaBackend(url, ChatOllama(base_url=url, model=model_name, temperature=temperature, **kwargs),
+                          max_concurrency)
+            for url in urls
+        ]
+        self.health_interval = health_interval
+        self.acquire_timeout = acquire_timeout
+        self.max_affinity = max_affinity
+        self.affinity: "OrderedDict[str, OllamaBackend]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.async_waiters: deque = deque()
+        self._health_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # backend selection
+    def _try_acquire(self, session_id: Optional[str], exclude: Set[str]) -> Optional[OllamaBackend]:
+        """called with the lock held"""
+        candidates = [b for b in self.backends if b.healthy and b.has_capacity and b.url not in exclude]
+        if not candidates:
+            return None
+        backend = self.affinity.get(session_id) if session_id else None
+        if backend not in candidates:
+            backend = min(candidates, key=lambda b: (b.inflight, b.served))
+        backend.inflight += 1
+        backend.served += 1
+        if session_id:
+            self.affinity[session_id] = backend
+            self.affinity.move_to_end(session_id)
+            while len(self.affinity) > self.max_affinity:
+                self.affinity.popitem(last=False)
+        return backend
+
+    def _check_available(self, exclude: Set[str]):
+        if not any(b.healthy and b.url not in exclude for b in self.backends):
+            raise NoBackendAvailable("No healthy Ollama backend available")
+
+    def acquire(self, session_id: Optional[str] = None, exclude: Set[str] = frozenset()) -> OllamaBackend:
+        deadline = time.monotonic() + self.acquire_timeout
+        with self.condition:
+            while True:
+                self._check_available(exclude)
+                backend = self._try_acquire(session_id, exclude)
+                if backend is not None:
+                    return backend
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise NoBackendAvailable("Timed out waiting for an Ollama backend")
+                self.condition.wait(remaining)
+
+    async def aacquire(self, session_id: Optional[str] = None, exclude: Set[str] = frozenset()) -> OllamaBackend:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.acquire_timeout
+        while True:
+            with self.lock:
+                self._check_available(exclude)
+                backend = self._try_acquire(session_id, exclude)
+                if backend is not None:
+                    return backend
+                # registered under the lock, so a release cannot be missed
+                waiter = loop.create_future()
+                self.async_waiters.append((loop, waiter))
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise NoBackendAvailable("Timed out waiting for an Ollama backend")
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                raise NoBackendAvailable("Timed out waiting for an Ollama backend")
+
+    def _wake_waiters(self):
+        """called with the lock held"""
+        self.condition.notify_all()
+        while self.async_waiters:
+            loop, waiter = self.async_waiters.popleft()
+            loop.call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+
+    def release(self, backend: OllamaBackend):
+        with self.lock:
+            backend.inflight -= 1
+            self._wake_waiters()
+
+    def mark_down(self, backend: OllamaBackend, error: BaseException):
+        with self.lock:
+            if backend.healthy:
+                logger.warning(f"Ollama backend {backend.url} removed from the pool: {error!r}")
+            backend.healthy = False
+            backend.failures += 1
+            # waiters may have to give up if no backend is left
+            self._wake_waiters()
+
+    # health checks
+    def check_health(self):
+        for backend in self.backends:
+            try:
+                httpx.get(f"{backend.url}/api/tags", timeout=2.0).raise_for_status()
+                healthy = True
+            except Exception:
+                healthy = False
+            with self.lock:
+                if healthy != backend.healthy:
+                    logger.info(f"Ollama backend {backend.url} is {'up' if healthy else 'down'}")
+                backend.healthy = healthy
+                self._wake_waiters()
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def start(self):
+        if self._health_thread is None:
+            self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+            self._health_thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> List[dict]:
+        with self.lock:
+            return [
+                {"url": b.url, "healthy": b.healthy, "inflight": b.inflight,
+                 "max_concurrency": b.max_concurrency, "served": b.served, "failures": b.failures}
+                for b in self.backends
+            ]
+
+
+class PooledChatOllama(BaseChatModel):
+    """ChatOllama over an OllamaPool, with failover on connection errors"""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    pool: OllamaPool
+
+    @property
+    def _llm_type(self) -> str:
+        return "chat-ollama-pool"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        tried: Set[str] = set()
+        while True:
+            backend = self.pool.acquire(session_affinity.get(), tried)
+            try:
+                return backend.model._generate(messages, stop, run_manager, **kwargs)
+            except CONNECTION_ERRORS as e:
+                self.pool.mark_down(backend, e)
+                tried.add(backend.url)
+            finally:
+                self.pool.release(backend)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        tried: Set[str] = set()
+        while True:
+            backend = await self.pool.aacquire(session_affinity.get(), tried)
+            try:
+                return await backend.model._agenerate(messages, stop, run_manager, **kwargs)
+            except CONNECTION_ERRORS as e:
+                self.pool.mark_down(backend, e)
+                tried.add(backend.url)
+            finally:
+                self.pool.release(backend)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        tried: Set[str] = set()
+        while True:
+            backend = self.pool.acquire(session_affinity.get(), tried)
+            started = False
+            try:
+                for chunk in backend.model._stream(messages, stop, run_manager, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except CONNECTION_ERRORS as e:
+                self.pool.mark_down(backend, e)
+                # a stream cut after its first chunk cannot be replayed
+                if started:
+                    raise
+                tried.add(backend.url)
+            finally:
+                self.pool.release(backend)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        tried: Set[str] = set()
+        while True:
+            backend = await self.pool.aacquire(session_affinity.get(), tried)
+            started = False
+            try:
+                async for chunk in backend.model._astream(messages, stop, run_manager, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except CONNECTION_ERRORS as e:
+                self.pool.mark_down(backend, e)
+                if started:
+                    raise
+                tried.add(backend.url)
+            finally:
+                self.pool.release(backend)
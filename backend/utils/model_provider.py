@@ -1,8 +1,73 @@
-import re
+import asyncio
+import logging
+import time
+from functools import lru_cache
+import httpx
 from langchain_ollama import ChatOllama
-from langchain_openai import ChatOpenAI
-from utils.model_params import MODEL_URL, MODEL_NAME, MODEL_TEMP
+from typing import Sequence, Union
+from utils.model_params import (MODEL_PROVIDER, MODEL_URLS, MODEL_NAME, MODEL_TEMP,
+                                MODEL_BACKEND_MAX_CONCURRENCY, MODEL_HEALTH_CHECK_INTERVAL,
+                                MODEL_KEEP_ALIVE, MODEL_NUM_CTX, MODEL_WARMUP_TIMEOUT)
+from utils.model_pool import OllamaPool, PooledChatOllama
 
-def load_model(url:str=MODEL_URL, model_name: str=MODEL_NAME, temperature:float=MODEL_TEMP, **kwargs):
-    """Load local ollama model"""
-    return ChatOllama(base_url=url, model=model_name, temperature=temperature, **kwargs)
+logger = logging.getLogger(__name__)
+
+def load_model(url:Union[str, Sequence[str]]=MODEL_URLS, model_name: str=MODEL_NAME, temperature:float=MODEL_TEMP,
+               provider: str=MODEL_PROVIDER, **kwargs):
+    """Load local ollama model, pooled over several servers when more than one url is given.
+    Every call keeps the model loaded (keep_alive) with the same context
+    window (num_ctx), so the server reuses the evaluated prompt of a session."""
+    if provider == "fake":
+        # deterministic offline model, see utils/fakes.py
+        from utils.fakes import FakeChatModel
+        return FakeChatModel.from_env()
+
+    kwargs = {"keep_alive": MODEL_KEEP_ALIVE, "num_ctx": MODEL_NUM_CTX, **kwargs}
+
+    urls = [url] if isinstance(url, str) else list(url)
+    if len(urls) == 1:
+        return ChatOllama(base_url=urls[0], model=model_name, temperature=temperature, **kwargs)
+
+    pool = OllamaPool(urls, model_name, temperature,
+                      max_concurrency=MODEL_BACKEND_MAX_CONCURRENCY,
+                      health_interval=MODEL_HEALTH_CHECK_INTERVAL, **kwargs)
+    pool.start()
+    return PooledChatOllama(pool=pool)
+
+
+@lru_cache(maxsize=None)
+def _get_model(url, model_name: str, temperature:float):
+    return load_model(url, model_name, temperature)
+
+def get_model(url:Union[str, Sequence[str]]=MODEL_URLS, model_name: str=MODEL_NAME, temperature:float=MODEL_TEMP):
+    """Get the process-wide ollama model, its http client is reused across requests"""
+    return _get_model(url if isinstance(url, str) else tuple(url), model_name, temperature)
+
+
+async def warm_up(urls: Sequence[str] = MODEL_URLS, model_name: str = MODEL_NAME,
+                  keep_alive: str = MODEL_KEEP_ALIVE, provider: str = MODEL_PROVIDER,
+                  timeout: float = MODEL_WARMUP_TIMEOUT, num_ctx: int = MODEL_NUM_CTX) -> dict:
+    """Load the model on every Ollama server with a generate call without
+    prompt, which Ollama answers once the model is in memory. It has the
+    options of the chat calls, which would reload it otherwise. Returns the
+    load time, or the error, per server."""
+    if provider != "ollama":
+        return {}
+
+    async def load(client: httpx.AsyncClient, url: str) -> dict:
+        start = time.perf_counter()
+        try:
+            response = await client.post(f"{url}/api/generate",
+                                         json={"model": model_name, "keep_alive": keep_alive,
+                                               "options": {"num_ctx": num_ctx}})
+            response.raise_for_status()
+            result = {"status": "ok"}
+        except Exception as e:
+            logger.warning(f"Warm-up of {model_name} on {url} failed: {e!r}")
+            result = {"status": "error", "error": repr(e)}
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        results = await asyncio.gather(*(load(client, url) for url in urls))
+    return dict(zip(urls, results))
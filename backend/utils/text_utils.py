@@ -0,0 +1,83 @@
+import re
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def remove_think_tags(raw: str) -> str:
+    # Remove <think>...</think> block
+    cleaned = re.sub(r"<think>.*?</think>", "", raw, flags=re.DOTALL).strip()
+    return cleaned
+
+
+def split_think_tags(raw: str):
+    """split a raw answer into (display content, reasoning trace)
+    the reasoning is None when there is no <think> block"""
+    thoughts = [t.strip() for t in re.findall(r"<think>(.*?)</think>", raw, flags=re.DOTALL)]
+    reasoning = "\n\n".join(t for t in thoughts if t) or None
+    return remove_think_tags(raw), reasoning
+
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """length of the longest suffix of text that is a prefix of tag"""
+    for size in range(min(len(text), len(tag) - 1), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+class ThinkTagFilter:
+    """Remove <think>...</think> blocks from a stream of text chunks.
+
+    Tags may be split across chunks, so a possible partial tag at the end
+    of a chunk is held back until the next chunk arrives. A block is held
+    back until it is closed: like remove_think_tags, a stream ending in an
+    unclosed <think> shows it as text.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.in_think = False
+        self.started = False
+        # start of the search for the closing tag in the held back block
+        self.scanned = 0
+
+    def feed(self, chunk: str) -> str:
+        """add a chunk and return the text that can be displayed"""
+        self.buffer += chunk
+        visible = []
+        while True:
+            if self.in_think:
+                # the buffer starts with the opening tag
+                idx = self.buffer.find(THINK_CLOSE, max(self.scanned, len(THINK_OPEN)))
+                if idx == -1:
+                    self.scanned = max(len(self.buffer) - len(THINK_CLOSE) + 1, 0)
+                    break
+                self.buffer = self.buffer[idx + len(THINK_CLOSE):]
+            else:
+                idx = self.buffer.find(THINK_OPEN)
+                if idx == -1:
+                    break
+                visible.append(self.buffer[:idx])
+                self.buffer = self.buffer[idx:]
+                self.scanned = 0
+            self.in_think = not self.in_think
+
+        if not self.in_think:
+            keep = _partial_tag_length(self.buffer, THINK_OPEN)
+            visible.append(self.buffer[:len(self.buffer) - keep])
+            self.buffer = self.buffer[len(self.buffer) - keep:]
+        return self._lstrip("".join(visible))
+
+    def flush(self) -> str:
+        """return what is left once the stream is over"""
+        remaining = self.buffer
+        self.buffer = ""
+        self.in_think = False
+        return self._lstrip(remaining)
+
+    def _lstrip(self, text: str) -> str:
+        # like remove_think_tags, drop the leading whitespace of the answer
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
@@ -0,0 +1,28 @@
+import os
+
+# tools given to the agent, by name (CHATBOT_TOOLS="ddg_search_tool" for one)
+ENABLED_TOOLS = [name.strip() for name in
+                 os.getenv("CHATBOT_TOOLS", "ddg_search_tool,google_search_tool").split(",") if name.strip()]
+# where each tool is defined, as "module:attribute", only the enabled ones are imported
+TOOL_REGISTRY = {
+    "ddg_search_tool": "tools.web_search:ddg_search_tool",
+    "google_search_tool": "tools.web_search:google_search_tool",
+}
+
+# web search variables
+# .env with the search API keys (SERPAPI_API_KEY), read by the first google search
+DOTENV_PATH = os.getenv("CHATBOT_DOTENV_PATH", "/workspace/.env")
+# offline benchmarks answer searches with utils/fakes.FakeSearch
+FAKE_SEARCH = os.getenv("CHATBOT_FAKE_SEARCH", "0") == "1"
+FAKE_SEARCH_DELAY = float(os.getenv("CHATBOT_FAKE_SEARCH_DELAY", "0.1"))
+SEARCH_CACHE_TTL = 15 * 60 # seconds a search result is reused
+SEARCH_CACHE_SIZE = 1024 # results kept in memory (LRU)
+SEARCH_CACHE_DB_PATH = None # e.g. "./search_cache.db" to spill evicted results to SQLite
+
+# tool execution variables
+DEFAULT_TOOL_TIMEOUT = 15.0 # seconds
+TOOL_TIMEOUTS = {"ddg_search_tool": 10.0, "google_search_tool": 10.0}
+# tool run instead when a call fails or times out
+TOOL_FALLBACKS = {"google_search_tool": "ddg_search_tool", "ddg_search_tool": "google_search_tool"}
+TOOL_OUTPUT_MAX_TOKENS = 1000 # tool outputs are cut to this size before going back to the model
+SLOW_TOOL_SECONDS = 5.0 # calls slower than this are logged
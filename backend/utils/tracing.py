@@ -0,0 +1,239 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import ChatGeneration, LLMResult
+from utils.metrics import (NODE_SECONDS, MODEL_CALL_SECONDS, MODEL_TTFT_SECONDS,
+                           MODEL_TOKENS, MODEL_STAGE_SECONDS, MODEL_OLLAMA_TOKENS, TURN_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+# finished traces kept in memory for /traces
+TRACE_STORE_SIZE = int(os.getenv("CHATBOT_TRACE_STORE_SIZE", "1000"))
+# also log every finished trace as one JSON line
+TRACE_LOG = os.getenv("CHATBOT_TRACE_LOG", "0") == "1"
+
+
+class Trace:
+    """Spans of one API request.
+
+    The trace of the running request is in a context variable, so the
+    graph nodes, tools and DB threads started from it add their spans to
+    it without passing it around.
+    """
+    def __init__(self, request_id: Optional[str] = None, method: str = "", path: str = "",
+                 session_id: Optional[str] = None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.session_id = session_id
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status: Optional[int] = None
+        self.spans: List[dict] = []
+        self.lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, duration: float, **attrs):
+        """start is a time.perf_counter() value"""
+        span = {"name": name,
+                "start_ms": round(1000 * (start - self.start), 3),
+                "duration_ms": round(1000 * duration, 3), **attrs}
+        with self.lock:
+            self.spans.append(span)
+
+    def finish(self, status: Optional[int] = None):
+        self.duration = time.perf_counter() - self.start
+        self.status = status
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        # every span is tied to the session of the request
+        spans = [{**span, "session_id": self.session_id} for span in spans]
+        return {
+            "request_id": self.request_id,
+            "session_id": self.session_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(1000 * self.duration, 3) if self.duration is not None else None,
+            "spans": spans,
+        }
+
+
+class TraceStore:
+    """the last finished traces, looked up by request id or session"""
+    def __init__(self, max_traces: int = TRACE_STORE_SIZE):
+        self.max_traces = max_traces
+        self.traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, trace: Trace):
+        with self.lock:
+            self.traces[trace.request_id] = trace
+            while len(self.traces) > self.max_traces:
+                self.traces.popitem(last=False)
+        if TRACE_LOG:
+            logger.info(json.dumps(trace.to_dict()))
+
+    def get(self, request_id: str) -> Optional[Trace]:
+        with self.lock:
+            return self.traces.get(request_id)
+
+    def for_session(self, session_id: str, limit: int = 20) -> List[Trace]:
+        """latest traces of a session, newest first"""
+        with self.lock:
+            traces = [t for t in reversed(self.traces.values()) if t.session_id == session_id]
+        return traces[:limit]
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+trace_store = TraceStore()
+
+
+def set_session(session_id: str):
+    """tie the current trace to a session, e.g. once a new session id is made"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.session_id = session_id
+
+def record_span(name: str, seconds: float, **attrs):
+    """add a span that just ended to the current trace, if any"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(name, time.perf_counter() - seconds, seconds, **attrs)
+
+@contextmanager
+def span(name: str, **attrs):
+    """time the body as a span of the current trace, attrs can be set inside"""
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs.setdefault("error", repr(e))
+        raise
+    finally:
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span(name, start, time.perf_counter() - start, **attrs)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Time the graph nodes and model calls of a run.
+
+    Given in the run config, it sees the node runs (chains named after
+    their node) and the chat model calls, with the first streamed token
+    and the token usage reported by the model. The whole graph run is
+    timed per router path (the route set by the router node).
+    """
+    run_inline = True  # called in the context of the run, where the trace is
+
+    def __init__(self):
+        self.runs: Dict[Any, dict] = {}
+
+    # graph nodes
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None,
+                       tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        if parent_run_id is None:
+            # the graph run of a turn
+            self.runs[run_id] = {"turn": True, "route": "unrouted", "start": time.perf_counter()}
+        # node runs are named after their node, __start__ is only the input
+        elif name and not name.startswith("__") and metadata and metadata.get("langgraph_node") == name:
+            self.runs[run_id] = {"node": name, "parent": parent_run_id, "start": time.perf_counter()}
+
+    def _end_turn(self, run: dict, status: str):
+        seconds = time.perf_counter() - run["start"]
+        TURN_SECONDS.labels(run["route"], status).observe(seconds)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span("turn", run["start"], seconds, route=run["route"], status=status)
+
+    def _end_node(self, run_id, status: str, outputs=None):
+        run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+        if run.get("turn"):
+            self._end_turn(run, status)
+            return
+        if run["node"] == "router" and isinstance(outputs, dict) and run["parent"] in self.runs:
+            self.runs[run["parent"]]["route"] = outputs.get("route") or "unrouted"
+        seconds = time.perf_counter() - run["start"]
+        NODE_SECONDS.labels(run["node"], status).observe(seconds)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span(f"node:{run['node']}", run["start"], seconds, status=status)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_node(run_id, "ok", outputs)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_node(run_id, "error")
+
+    # model calls
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None,
+                            tags=None, metadata=None, **kwargs):
+        self.runs[run_id] = {"node": (metadata or {}).get("langgraph_node", ""),
+                             "start": time.perf_counter(), "ttft": None}
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self.runs.get(run_id)
+        if run is not None and run["ttft"] is None:
+            run["ttft"] = time.perf_counter() - run["start"]
+            MODEL_TTFT_SECONDS.labels(run["node"]).observe(run["ttft"])
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs):
+        run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+        seconds = time.perf_counter() - run["start"]
+        MODEL_CALL_SECONDS.labels(run["node"], "ok").observe(seconds)
+        attrs = {"node": run["node"], "status": "ok"}
+        if run["ttft"] is not None:
+            attrs["ttft_ms"] = round(1000 * run["ttft"], 3)
+
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        if isinstance(generation, ChatGeneration):
+            usage = getattr(generation.message, "usage_metadata", None) or {}
+            for direction, key in (("input", "input_tokens"), ("output", "output_tokens")):
+                if usage.get(key):
+                    MODEL_TOKENS.labels(run["node"], direction).inc(usage[key])
+                    attrs[key] = usage[key]
+            # Ollama reports its stage durations in nanoseconds, and the
+            # tokens it evaluated: prompt_eval_count leaves out the start of
+            # the prompt it reused from the session cache
+            metadata = generation.message.response_metadata or {}
+            for stage in ("load", "prompt_eval", "eval"):
+                duration = metadata.get(f"{stage}_duration")
+                if duration:
+                    MODEL_STAGE_SECONDS.labels(stage).observe(duration / 1e9)
+                    attrs[f"{stage}_ms"] = round(duration / 1e6, 3)
+            for stage in ("prompt_eval", "eval"):
+                count = metadata.get(f"{stage}_count")
+                if count is not None:
+                    MODEL_OLLAMA_TOKENS.labels(run["node"], stage).inc(count)
+                    attrs[f"{stage}_count"] = count
+
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span("model", run["start"], seconds, **attrs)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+        seconds = time.perf_counter() - run["start"]
+        MODEL_CALL_SECONDS.labels(run["node"], "error").observe(seconds)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span("model", run["start"], seconds, node=run["node"], status="error",
+                           error=repr(error))
@@ -1,43 +1,132 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import json
+import time
 
 # FastAPI server Url
 API_URL = "http://127.0.0.1:8000" # To change when deployed
+# session names of older versions, kept here before the backend stored them
 NAMES_PATH = "session_names.json"
+# seconds the session list and the histories are reused without asking the
+# backend, changes made from this page refresh them at once
+SESSIONS_TTL = 30
+HISTORY_TTL = 30
+# messages shown at first, older ones are loaded on demand
+HISTORY_PAGE = 50
+TIMEOUT = (3.05, 30) # connect, read
+STREAM_TIMEOUT = (3.05, 300)
 
 st.title("Smart chatbot")
 
 # util functions
-def load_session_names():
-    """load session names from persisted file in frontend"""
-    if os.path.exists(NAMES_PATH):
-        with open(NAMES_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def save_session_names(mapping):
-    """save session names to persisted file in frontend"""
-    with open(NAMES_PATH, "w", encoding="utf-8") as f:
-        json.dump(mapping, f)
+@st.cache_resource
+def http_client():
+    """one HTTP session shared by every run and user of the app, its
+    connections to the backend are kept open and reused"""
+    client = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=20)
+    client.mount("http://", adapter)
+    client.mount("https://", adapter)
+    return client
+
+def sessions_cache():
+    return st.session_state.setdefault("sessions_cache", {"etag": None, "sessions": None, "fetched_at": 0.0})
 
 def fetch_sessions():
-    """get all persisted sessions from the backend"""
+    """get all persisted sessions from the backend, reused for SESSIONS_TTL
+    seconds, then only downloaded again when they changed (ETag)"""
+    cache = sessions_cache()
+    if cache["sessions"] is not None and time.monotonic() - cache["fetched_at"] < SESSIONS_TTL:
+        return cache["sessions"]
+    headers = {"If-None-Match": cache["etag"]} if cache["etag"] else {}
     try:
-        resp = requests.get(f"{API_URL}/chat/sessions")
-        if resp.status_code == 200:
-            data = resp.json()
-            return data.get("sessions", [])
+        resp = http_client().get(f"{API_URL}/chat/sessions", headers=headers, timeout=TIMEOUT)
+        if resp.status_code == 304:
+            cache["fetched_at"] = time.monotonic()
+            return cache["sessions"]
+        elif resp.status_code == 200:
+            cache["etag"] = resp.headers.get("ETag")
+            cache["sessions"] = resp.json().get("sessions", [])
+            cache["fetched_at"] = time.monotonic()
+            return cache["sessions"]
         else:
             return None  # backend reachable but bad status
     except Exception:
         return None  # backend unreachable
 
+def invalidate_sessions():
+    """the session list is asked again on the next run"""
+    sessions_cache()["fetched_at"] = 0.0
+
+def history_entry(session_id):
+    """cached history of a session: the latest messages, whether older ones
+    exist, and the turns sent from here not read back from the backend yet"""
+    histories = st.session_state.setdefault("history_cache", {})
+    return histories.setdefault(session_id, {"messages": None, "has_older": False, "pending": [], "fetched_at": 0.0})
+
 def fetch_history(session_id):
-    """get specified session history"""
+    """get specified session history: its latest page first, then only the
+    messages newer than the cached ones, at most every HISTORY_TTL seconds
+    unless a turn was sent from here"""
+    entry = history_entry(session_id)
+    fresh = time.monotonic() - entry["fetched_at"] < HISTORY_TTL
+    if entry["messages"] is not None and fresh and not entry["pending"]:
+        return entry["messages"]
+    if entry["messages"]:
+        # seq rather than id: the ids change when an archived session is restored
+        params = {"after_seq": entry["messages"][-1]["seq"]}
+    else:
+        params = {"limit": HISTORY_PAGE}
+    try:
+        resp = http_client().get(f"{API_URL}/chat/{session_id}/history", params=params, timeout=TIMEOUT)
+        if resp.status_code == 200:
+            new_messages = resp.json()
+            if entry["messages"] is None:
+                entry["messages"], entry["has_older"] = new_messages, len(new_messages) == HISTORY_PAGE
+            else:
+                entry["messages"] += new_messages
+            if new_messages:
+                entry["pending"] = []  # the turns sent from here are in the database now
+            entry["fetched_at"] = time.monotonic()
+            return entry["messages"] + entry["pending"]
+        else:
+            return None  # backend reachable but bad status
+    except Exception:
+        return None  # backend unreachable
+
+def fetch_older_history(session_id):
+    """prepend the page of messages preceding the cached ones, False on error"""
+    entry = history_entry(session_id)
+    if not entry["messages"]:
+        return True
+    params = {"before": entry["messages"][0]["id"], "limit": HISTORY_PAGE}
+    try:
+        resp = http_client().get(f"{API_URL}/chat/{session_id}/history", params=params, timeout=TIMEOUT)
+        if resp.status_code == 200:
+            older = resp.json()
+            entry["messages"] = older + entry["messages"]
+            entry["has_older"] = len(older) == HISTORY_PAGE
+            return True
+        return False
+    except Exception:
+        return False
+
+def add_pending_turn(session_id, user_input, answer):
+    """show a turn sent from here without downloading the history again,
+    it is replaced by the stored messages on the next read"""
+    entry = history_entry(session_id)
+    entry["pending"] += [{"role": "user", "content": user_input}, {"role": "ai", "content": answer}]
+
+def search_messages(query, cursor=None):
+    """full-text search over the messages of all sessions, a page of
+    {"results": [...], "next_cursor": ...}"""
+    params = {"q": query, "limit": 10}
+    if cursor:
+        params["cursor"] = cursor
     try:
-        resp = requests.get(f"{API_URL}/chat/{session_id}/history")
+        resp = http_client().get(f"{API_URL}/chat/search", params=params, timeout=TIMEOUT)
         if resp.status_code == 200:
             return resp.json()
         else:
@@ -45,10 +134,37 @@ def fetch_history(session_id):
     except Exception:
         return None  # backend unreachable
 
+def rename_session(session_id, name):
+    """store the name of a session in the backend"""
+    try:
+        resp = http_client().patch(f"{API_URL}/chat/{session_id}", json={"name": name}, timeout=TIMEOUT)
+        if resp.status_code == 200:
+            return True
+        elif resp.status_code == 404:
+            return False  # session not found
+        else:
+            return None  # other backend error
+    except Exception:
+        return None  # backend unreachable
+
+def import_session_names(sessions):
+    """move the names of the local file of older versions to the backend,
+    once, for the sessions without a name there"""
+    if not os.path.exists(NAMES_PATH):
+        return
+    with open(NAMES_PATH, "r", encoding="utf-8") as f:
+        names_map = json.load(f)
+    unnamed = {session["session_id"] for session in sessions if not session.get("name")}
+    for sid, name in names_map.items():
+        if sid in unnamed and rename_session(sid, name) is None:
+            return  # backend error, tried again on the next run
+    os.replace(NAMES_PATH, NAMES_PATH + ".imported")
+    invalidate_sessions()
+
 def delete_session(session_id):
     """delete specified session"""
     try:
-        resp = requests.delete(f"{API_URL}/chat/{session_id}")
+        resp = http_client().delete(f"{API_URL}/chat/{session_id}", timeout=TIMEOUT)
         if resp.status_code == 200:
             return True
         elif resp.status_code == 404:
@@ -58,6 +174,24 @@ def delete_session(session_id):
     except Exception:
         return None  # backend unreachable
 
+def stream_chat(url, user_input, on_event):
+    """post a message to a streaming endpoint and yield the answer tokens,
+    other server-sent events (tool calls, done, error) go to on_event"""
+    with http_client().post(url, json={"user_input": user_input}, stream=True, timeout=STREAM_TIMEOUT) as resp:
+        if resp.status_code != 200:
+            on_event("error", {"detail": f"HTTP {resp.status_code}"})
+            return
+        event = None
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "token":
+                    yield data["content"]
+                else:
+                    on_event(event, data)
+
 def reinit_session_renaming_vars():
     """reinit session renaming variables"""
     st.session_state.renaming_session = None
@@ -72,6 +206,10 @@ def display_chat_history():
         if chat_history is None:
             st.error("❌ Backend unreachable. Cannot load chat history.")
         else:
+            if history_entry(backend_id)["has_older"] and st.button("Load earlier messages"):
+                if not fetch_older_history(backend_id):
+                    st.error("❌ Backend unreachable. Cannot load earlier messages.")
+                st.rerun()
             for msg in chat_history:
                 role = "user" if msg["role"] == "user" else "ai"
                 st.chat_message(role).write(msg["content"])
@@ -91,11 +229,15 @@ if "ui_pending_user_msg" not in st.session_state:
     st.session_state.ui_pending_user_msg = None
 if "ui_msg_sent" not in st.session_state:
     st.session_state.ui_msg_sent = False
+if "select_session_id" not in st.session_state:
+    st.session_state.select_session_id = None
 
 
 # load and restore saved sessions
-backend_sessions = fetch_sessions() # [{"session_id": ..., "created_at": ... }, ...]
-names_map = load_session_names() # {backend_session_id: friendly_name}
+backend_sessions = fetch_sessions() # [{"session_id": ..., "created_at": ..., "name": ...}, ...]
+if backend_sessions is not None and os.path.exists(NAMES_PATH):
+    import_session_names(backend_sessions)
+    backend_sessions = fetch_sessions()
 
 # each session should have a custom name, if not it's default
 used_names = set()
@@ -106,7 +248,7 @@ if backend_sessions is not None:
     for i, session in enumerate(backend_sessions, 1):
         sid = session["session_id"]
         # give custom name
-        custom_name = names_map.get(sid)
+        custom_name = session.get("name")
         if custom_name and custom_name not in used_names:
             friendly_name = custom_name
         else:
@@ -120,13 +262,14 @@ if backend_sessions is not None:
         id_to_name[sid] = friendly_name
         name_to_id[friendly_name] = sid
         used_names.add(friendly_name)
-    # only update names_map if backend is up and we have sessions
-    if set(names_map.keys()) != set(id_to_name.keys()):
-        names_map = {sid: name for sid, name in id_to_name.items()}
-        save_session_names(names_map)
 else:
     st.sidebar.error("❌ Backend unreachable.")
 
+# select a session created in the previous run
+if st.session_state.select_session_id in id_to_name:
+    st.session_state.active_session = id_to_name[st.session_state.select_session_id]
+    st.session_state.select_session_id = None
+
 # set friendly names and active session
 friendly_names = list(name_to_id.keys())
 if not st.session_state.active_session and not st.session_state.pending_new_session and friendly_names:
@@ -140,6 +283,33 @@ if st.sidebar.button("➕ New"):
     reinit_session_renaming_vars() # stop any session renaming
     st.rerun()
 
+# search box, the matching messages link to their session
+search_query = st.sidebar.text_input("🔍 Search messages", placeholder="words, or a prefix*").strip()
+search = st.session_state.setdefault("search", {"query": "", "results": [], "next_cursor": None, "error": False})
+if search_query != search["query"]:
+    page = search_messages(search_query) if search_query else {"results": [], "next_cursor": None}
+    search.update(query=search_query, error=page is None,
+                  results=page["results"] if page else [], next_cursor=page["next_cursor"] if page else None)
+if search["error"]:
+    st.sidebar.error("❌ Search unavailable.")
+elif search_query and not search["results"]:
+    st.sidebar.write("No match")
+for i, result in enumerate(search["results"]):
+    result_name = id_to_name.get(result["session_id"])
+    if result_name is None:
+        continue  # session deleted since
+    if st.sidebar.button(f"{result_name}: {result['snippet']}", key=f"search_{i}"):
+        st.session_state.active_session = result_name
+        st.session_state.pending_new_session = False
+        reinit_session_renaming_vars() # stop any session renaming
+        st.rerun()
+if search["next_cursor"] and st.sidebar.button("More results"):
+    page = search_messages(search["query"], search["next_cursor"])
+    if page is not None:
+        search["results"] += page["results"]
+        search["next_cursor"] = page["next_cursor"]
+    st.rerun()
+
 # chat sessions sidebar title
 st.sidebar.header("Sessions")
 
@@ -193,10 +363,8 @@ if delete_trigger is not None:
     result = delete_session(del_session_id)
     reinit_session_renaming_vars() # stop any session renaming
     if result is True:
-        # delete from disk-persisted names
-        if del_session_id in names_map:
-            del names_map[del_session_id]
-            save_session_names(names_map)
+        st.session_state.setdefault("history_cache", {}).pop(del_session_id, None)
+        invalidate_sessions()
         # select new active session
         current_names = [name for name in friendly_names if name != del_friendly_name]
         if del_friendly_name == st.session_state.active_session:
@@ -218,13 +386,18 @@ if save_rename_trigger is not None:
     else:
         # update name
         sid = name_to_id[old_name]
-        names_map[sid] = new_name
-        save_session_names(names_map)
-        # update active session
-        if st.session_state.active_session == old_name:
-            st.session_state.active_session = new_name
-        reinit_session_renaming_vars() # reinit session renaming vars
-        st.rerun()
+        result = rename_session(sid, new_name)
+        if result is True:
+            invalidate_sessions()
+            # update active session
+            if st.session_state.active_session == old_name:
+                st.session_state.active_session = new_name
+            reinit_session_renaming_vars() # reinit session renaming vars
+            st.rerun()
+        elif result is False:
+            rename_error = "Session not found on backend."
+        else:
+            rename_error = "❌ Backend unreachable. Cannot rename session."
     if rename_error:
         st.session_state.reneme_value = new_name
         st.sidebar.error(rename_error)
@@ -245,43 +418,44 @@ if st.session_state.ui_pending_user_msg:
     if not st.session_state.ui_msg_sent:
         st.session_state.ui_msg_sent = True
 
-        # start a new session
-        if st.session_state.pending_new_session or not friendly_names:
-            with st.spinner("Processing..."):
-                response = requests.post(f"{API_URL}/chat/start", json={"user_input": pending_msg})
-            
-            if response.status_code == 200:
-                data = response.json()
-                session_id = data["session_id"]
-
-                # reload session list as we just created one
-                backend_sessions = fetch_sessions()
-                for s in backend_sessions or []:
-                    if s["session_id"] not in names_map:
-                        # assign default name
-                        default_name = f"Session {len(names_map) + 1}"
-                        new_name = default_name
-                        n = 1
-                        while new_name in names_map.values():
-                            new_name = f"{default_name} ({n})"
-                            n += 1
-                        names_map[s["session_id"]] = new_name
-                        save_session_names(names_map)
-                        st.session_state.active_session = new_name
-                        break
-                st.session_state.pending_new_session = False
-            else:
-                st.error("❌ Failed to start chat session.")
-
+        # stream the answer of a new or an existing session
+        new_session = st.session_state.pending_new_session or not friendly_names
+        url = None
+        if new_session:
+            url = f"{API_URL}/chat/start/stream"
         elif st.session_state.active_session and st.session_state.active_session in name_to_id:
             backend_id = name_to_id[st.session_state.active_session]
-            with st.spinner("Processing..."):
-                response = requests.post(
-                    f"{API_URL}/chat/{backend_id}/continue",
-                    json={"user_input": pending_msg}
-                )
-                if response.status_code != 200:
-                    st.error("❌ Failed to continue chat.")
+            url = f"{API_URL}/chat/{backend_id}/continue/stream"
+
+        if url:
+            stream_result = {}
+            with st.chat_message("ai"):
+                tool_status = st.empty()
+
+                def on_event(event, data):
+                    if event == "tool_call":
+                        tool_status.caption(f"🔎 {data['name']}: {data['args']}")
+                    elif event == "tool_result":
+                        tool_status.caption(f"✅ {data['name']} done")
+                    else:
+                        stream_result[event] = data
+
+                try:
+                    st.write_stream(stream_chat(url, pending_msg, on_event))
+                except Exception:
+                    stream_result["error"] = {"detail": "Backend unreachable"}
+                tool_status.empty()
+
+            if "done" not in stream_result:
+                st.error("❌ Failed to start chat session." if new_session else "❌ Failed to continue chat.")
+            else:
+                session_id = stream_result["done"]["session_id"]
+                add_pending_turn(session_id, pending_msg, stream_result["done"]["response"])
+                if new_session:
+                    # listed, and selected, on the next run
+                    invalidate_sessions()
+                    st.session_state.select_session_id = session_id
+                    st.session_state.pending_new_session = False
         st.session_state.ui_pending_user_msg = None
         st.session_state.ui_msg_sent = False
         st.rerun()